@@ -1,12 +1,44 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, make_response, g, \
+    has_request_context, before_render_template, template_rendered, got_request_exception, stream_with_context, \
+    send_file, after_this_request
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from werkzeug.http import is_resource_modified
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
+from functools import lru_cache, wraps
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import atexit
+import base64
+import bisect
+import click
+import codecs
+import csv
+import fcntl
+import gzip
+import hashlib
+import io
+import json
+import math
 import os
+import pickle
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
 
 # =================== APP SETUP ===================
+_MODULE_STARTED = time.perf_counter()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'chandrika-jain-college-2024-secret')
 
@@ -22,11 +54,9 @@ if DATABASE_URL:
     
     app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
     STORAGE_TYPE = 'PostgreSQL (Permanent) ✅'
-    print("✅ Using Supabase PostgreSQL")
 else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////tmp/college.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.environ.get('SQLITE_PATH', '/tmp/college.db')
     STORAGE_TYPE = 'SQLite (Temporary) ⚠️'
-    print("⚠️ Using SQLite")
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
@@ -40,6 +70,12 @@ login_manager.init_app(app)
 login_manager.login_view = 'admin_login'
 
 # =================== MODELS ===================
+# Partial index over rows where a boolean flag has a given value, e.g. WHERE is_active
+def partial_index(name, *columns, flag='is_active', value=True):
+    return db.Index(name, *columns,
+                    postgresql_where=db.text(flag if value else f'NOT {flag}'),
+                    sqlite_where=db.text(f'{flag} = {int(value)}'))
+
 class Admin(UserMixin, db.Model):
     __tablename__ = 'admins'
     id = db.Column(db.Integer, primary_key=True)
@@ -51,6 +87,7 @@ class Admin(UserMixin, db.Model):
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (partial_index('ix_books_active_upload_date', 'upload_date', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     author = db.Column(db.String(200), nullable=False)
@@ -59,6 +96,9 @@ class Book(db.Model):
     course = db.Column(db.String(100))
     drive_link = db.Column(db.String(500), nullable=False)
     download_link = db.Column(db.String(500))
+    drive_file_id = db.Column(db.String(200))
+    preview_link = db.Column(db.String(500))
+    view_link = db.Column(db.String(500))
     description = db.Column(db.Text)
     uploaded_by = db.Column(db.String(120))
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
@@ -66,6 +106,7 @@ class Book(db.Model):
 
 class Result(db.Model):
     __tablename__ = 'results'
+    __table_args__ = (partial_index('ix_results_active_upload_date', 'upload_date', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     exam_type = db.Column(db.String(100))
@@ -73,12 +114,17 @@ class Result(db.Model):
     semester = db.Column(db.String(20))
     year = db.Column(db.String(10))
     drive_link = db.Column(db.String(500), nullable=False)
+    drive_file_id = db.Column(db.String(200))
+    preview_link = db.Column(db.String(500))
+    view_link = db.Column(db.String(500))
+    download_link = db.Column(db.String(500))
     uploaded_by = db.Column(db.String(120))
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
 
 class Notice(db.Model):
     __tablename__ = 'notices'
+    __table_args__ = (partial_index('ix_notices_active_post_date', 'post_date', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(300), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -117,6 +163,8 @@ class Course(db.Model):
 
 class Gallery(db.Model):
     __tablename__ = 'gallery'
+    __table_args__ = (partial_index('ix_gallery_active_upload_date', 'upload_date', 'id'),
+                      partial_index('ix_gallery_active_category', 'category', 'upload_date'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200))
     image_url = db.Column(db.String(500), nullable=False)
@@ -126,6 +174,8 @@ class Gallery(db.Model):
 
 class ContactMessage(db.Model):
     __tablename__ = 'contact_messages'
+    __table_args__ = (db.Index('ix_contact_messages_date', 'date', 'id'),
+                      partial_index('ix_contact_messages_unread', 'id', flag='is_read', value=False),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), nullable=False)
@@ -138,13 +188,38 @@ class ContactMessage(db.Model):
 # ✅ NEW - Visitor Tracking
 class Visitor(db.Model):
     __tablename__ = 'visitors'
+    __table_args__ = (db.Index('ix_visitors_day_ip_page', 'date_only', 'ip_address', 'page'),
+                      db.Index('ix_visitors_visit_date', 'visit_date'),)
     id = db.Column(db.Integer, primary_key=True)
     ip_address = db.Column(db.String(50))
     page = db.Column(db.String(200))
-    user_agent = db.Column(db.String(500))
+    user_agent = db.Column(db.String(500))   # legacy rows only; new rows use user_agent_id
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('user_agents.id'))
     visit_date = db.Column(db.DateTime, default=datetime.utcnow)
     date_only = db.Column(db.String(10))
 
+# Distinct user-agent strings, shared by all visitor rows
+class UserAgent(db.Model):
+    __tablename__ = 'user_agents'
+    id = db.Column(db.Integer, primary_key=True)
+    ua_hash = db.Column(db.String(40), unique=True, nullable=False)
+    value = db.Column(db.String(500), nullable=False)
+
+# Per-day, per-page traffic rollup maintained by the visitor flusher
+class VisitorDailyStat(db.Model):
+    __tablename__ = 'visitor_daily_stats'
+    day = db.Column(db.String(10), primary_key=True)
+    page = db.Column(db.String(200), primary_key=True)
+    hits = db.Column(db.Integer, nullable=False, default=0)      # every page view
+    uniques = db.Column(db.Integer, nullable=False, default=0)   # distinct IPs (= visitors rows)
+
+# HyperLogLog registers of visitor IPs; day or page '*' means all days / all pages
+class VisitorSketch(db.Model):
+    __tablename__ = 'visitor_sketches'
+    day = db.Column(db.String(10), primary_key=True)
+    page = db.Column(db.String(200), primary_key=True)
+    registers = db.Column(db.LargeBinary, nullable=False)   # zlib-compressed
+
 # ✅ NEW - Site Settings (Contact Info etc)
 class SiteSettings(db.Model):
     __tablename__ = 'site_settings'
@@ -156,96 +231,1765 @@ class SiteSettings(db.Model):
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        return Admin.query.get(int(user_id))
+        return cached_admin(int(user_id))
     except:
         return None
 
 # =================== HELPERS ===================
+def drive_file_id(link):
+    if not link or 'drive.google.com' not in str(link):
+        return None
+    if '/file/d/' in link:
+        return link.split('/file/d/')[1].split('/')[0] or None
+    if 'id=' in link:
+        return link.split('id=')[1].split('&')[0] or None
+    return None
+
 def convert_drive_link(link):
     if not link:
         return {'preview': '', 'download': '', 'view': ''}
-    if 'drive.google.com' in str(link):
-        file_id = None
-        if '/file/d/' in link:
-            file_id = link.split('/file/d/')[1].split('/')[0]
-        elif 'id=' in link:
-            file_id = link.split('id=')[1].split('&')[0]
-        if file_id:
-            return {
-                'preview': f'https://drive.google.com/file/d/{file_id}/preview',
-                'download': f'https://drive.google.com/uc?export=download&id={file_id}',
-                'view': f'https://drive.google.com/file/d/{file_id}/view'
-            }
+    file_id = drive_file_id(link)
+    if file_id:
+        return {
+            'preview': f'https://drive.google.com/file/d/{file_id}/preview',
+            'download': f'https://drive.google.com/uc?export=download&id={file_id}',
+            'view': f'https://drive.google.com/file/d/{file_id}/view'
+        }
     return {'preview': link, 'download': link, 'view': link}
 
+# Column values stored on Book/Result so templates never convert links per row
+def drive_link_fields(link):
+    links = convert_drive_link(link)
+    return {'drive_file_id': drive_file_id(link), 'preview_link': links['preview'],
+            'view_link': links['view'], 'download_link': links['download']}
+
 def convert_drive_image(link):
-    if not link:
+    file_id = drive_file_id(link)
+    if file_id:
+        return f'https://drive.google.com/uc?export=view&id={file_id}'
+    return link or ''
+
+# =================== REQUEST PROFILING ===================
+# Engine events time every SQL statement. Inside a request each one is charged
+# to the current phase (auth, visitor, settings, etag, or the view itself), the
+# totals go out in a Server-Timing header, and the last PERF_BUFFER_SIZE
+# requests are kept per process for /admin/perf. Statements slower than
+# SLOW_QUERY_MS are logged wherever they run.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+PERF_BUFFER_SIZE = int(os.environ.get('PERF_BUFFER_SIZE', 500))
+PERF_N_PLUS_ONE = int(os.environ.get('PERF_N_PLUS_ONE', 5))   # same SELECT this often in one request
+PERF_SERVER_TIMING = os.environ.get('PERF_SERVER_TIMING', '1') == '1'
+
+_perf_requests = deque(maxlen=PERF_BUFFER_SIZE)
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+def _perf():
+    return g.get('_perf') if has_request_context() else None
+
+@contextmanager
+def perf_phase(name):
+    perf = _perf()
+    if perf is None:
+        yield
+        return
+    outer, perf['phase'], start = perf['phase'], name, time.perf_counter()
+    try:
+        yield
+    finally:
+        perf['phase'] = outer
+        perf['phases'][name] = perf['phases'].get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+# Statement with literals and IN-lists folded, so repeats of one query compare equal
+def statement_shape(statement):
+    return _SQL_IN_LISTS.sub('(?...)', _SQL_LITERALS.sub('?', ' '.join(statement.split())))
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    ms = (time.perf_counter() - conn.info['query_started'].pop()) * 1000
+    perf = _perf()
+    if perf is not None:
+        perf['queries'].append((statement, ms, perf['phase']))
+    if ms >= SLOW_QUERY_MS:
+        where = request.endpoint if perf is not None else threading.current_thread().name
+        print(f"⚠️ Slow query ({ms:.0f}ms, {where}): {' '.join(statement.split())[:500]}")
+
+@event.listens_for(Engine, 'handle_error')
+def _query_failed(context):
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+@app.before_request
+def _start_profiling():
+    g._perf = {'start': time.perf_counter(), 'queries': [], 'phases': {}, 'phase': 'view'}
+
+@app.after_request
+def _finish_profiling(response):
+    perf = g.pop('_perf', None)
+    if perf is None or request.endpoint == 'static':
+        return response
+    total = (time.perf_counter() - perf['start']) * 1000
+    queries = perf['queries']
+    db_ms = sum(ms for _, ms, _ in queries)
+    if PERF_SERVER_TIMING:
+        timings = [f'db;dur={db_ms:.1f};desc="{len(queries)} queries"']
+        timings += [f'{name};dur={ms:.1f}' for name, ms in perf['phases'].items()]
+        response.headers.add('Server-Timing', ', '.join(timings + [f'app;dur={total:.1f}']))
+    shapes = {}
+    for statement, _, _ in queries:
+        if statement.lstrip()[:6].upper() == 'SELECT':
+            shape = statement_shape(statement)
+            shapes[shape] = shapes.get(shape, 0) + 1
+    by_phase = {}
+    for _, ms, phase in queries:
+        count, phase_ms = by_phase.get(phase, (0, 0.0))
+        by_phase[phase] = (count + 1, phase_ms + ms)
+    entry = {
+        'at': datetime.utcnow(), 'endpoint': request.endpoint or '-', 'method': request.method,
+        'path': request.full_path.rstrip('?'), 'status': response.status_code, 'ms': total, 'db_ms': db_ms,
+        'queries': len(queries), 'phases': by_phase,
+        'slowest': [(statement_shape(st)[:300], ms) for st, ms, _ in sorted(queries, key=lambda q: -q[1])[:3]],
+        'repeated': {shape[:300]: n for shape, n in shapes.items() if n >= PERF_N_PLUS_ONE}}
+    _perf_requests.append(entry)
+    if METRICS_ENABLED:
+        record_request_metrics(entry)
+    return response
+
+def perf_report():
+    recent = list(_perf_requests)
+    grouped, patterns = {}, {}
+    for r in recent:
+        grouped.setdefault(r['endpoint'], []).append(r)
+        for shape, n in r['repeated'].items():
+            p = patterns.setdefault((r['endpoint'], shape), {'endpoint': r['endpoint'], 'statement': shape,
+                                                              'requests': 0, 'max_repeats': 0})
+            p['requests'] += 1
+            p['max_repeats'] = max(p['max_repeats'], n)
+    endpoints = []
+    for endpoint, rs in grouped.items():
+        ms = sorted(r['ms'] for r in rs)
+        endpoints.append({'endpoint': endpoint, 'count': len(rs), 'p50': ms[len(ms) // 2],
+                          'p95': ms[min(len(ms) - 1, int(len(ms) * 0.95))], 'max': ms[-1],
+                          'queries': sum(r['queries'] for r in rs) / len(rs),
+                          'db_ms': sum(r['db_ms'] for r in rs) / len(rs)})
+    return {'requests': len(recent), 'endpoints': sorted(endpoints, key=lambda e: -e['p95']),
+            'patterns': sorted(patterns.values(), key=lambda p: (-p['max_repeats'], -p['requests'])),
+            'slowest': sorted(recent, key=lambda r: -r['ms'])[:15]}
+
+# =================== METRICS ===================
+# Opt-in Prometheus endpoint (METRICS_ENABLED=1). Each process keeps counters
+# and histograms in memory and writes them to METRICS_DIR/<pid>.json at most
+# every METRICS_FLUSH_SECONDS; /metrics merges the files of all workers.
+# Counters of exited workers are folded into _exited.json so totals never go
+# backwards; gauges are reported per live worker (pid label).
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR', '/tmp/cjdm-metrics')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')   # if set, scrapers send "Authorization: Bearer <token>"
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+METRIC_HELP = {
+    'cjdm_http_requests_total': ('counter', 'Requests by endpoint, method and status.'),
+    'cjdm_http_exceptions_total': ('counter', 'Unhandled exceptions by endpoint.'),
+    'cjdm_http_request_duration_seconds': ('histogram', 'Request latency by endpoint.'),
+    'cjdm_template_render_seconds': ('histogram', 'render_template time by endpoint and template.'),
+    'cjdm_db_queries_total': ('counter', 'SQL statements issued by endpoint.'),
+    'cjdm_db_query_seconds_total': ('counter', 'Time spent in SQL statements by endpoint.'),
+    'cjdm_db_pool_wait_seconds': ('histogram', 'Time spent waiting for a pooled connection.'),
+    'cjdm_db_pool_connections': ('gauge', 'Pool connections by state, per worker.'),
+    'cjdm_db_pool_size': ('gauge', 'Configured pool size, per worker.'),
+    'cjdm_visitor_events_total': ('counter', 'Visitor ingest events by outcome.'),
+    'cjdm_visitor_queue_pending': ('gauge', 'Page views queued but not yet written, per worker.'),
+    'cjdm_page_cache_requests_total': ('counter', 'Page cache lookups by result.'),
+    'cjdm_page_cache_hit_ratio': ('gauge', 'Page cache hits / (hits + misses), all workers.'),
+    'cjdm_thumbnails_total': ('counter', 'Thumbnail cache hits, misses, source fetches, errors and evictions.'),
+    'cjdm_login_attempts_total': ('counter', 'Login POSTs allowed, throttled or locked out, and their outcomes.'),
+    'cjdm_prerender_total': ('counter', 'Pre-rendered pages served, rendered, discarded as stale, and render errors.'),
+    'cjdm_compressed_responses_total': ('counter', 'Compressible responses by the encoding they were sent with.'),
+    'cjdm_compression_bytes_total': ('counter', 'Bytes of compressed responses before (in) and after (out).'),
+}
+
+_metrics = {'counters': {}, 'histograms': {}, 'written': 0.0, 'pool': None}
+_metrics_lock = threading.Lock()
+
+def inc_metric(name, value=1, **labels):
+    key = json.dumps([name, labels], sort_keys=True)
+    with _metrics_lock:
+        _metrics['counters'][key] = _metrics['counters'].get(key, 0) + value
+
+def observe_metric(name, seconds, buckets=LATENCY_BUCKETS, **labels):
+    key = json.dumps([name, labels], sort_keys=True)
+    with _metrics_lock:
+        histogram = _metrics['histograms'].get(key)
+        if histogram is None:
+            histogram = _metrics['histograms'][key] = {'buckets': list(buckets), 'counts': [0] * (len(buckets) + 1),
+                                                       'sum': 0.0}
+        histogram['counts'][bisect.bisect_left(buckets, seconds)] += 1
+        histogram['sum'] += seconds
+
+def record_request_metrics(entry):
+    endpoint = entry['endpoint']
+    inc_metric('cjdm_http_requests_total', endpoint=endpoint, method=entry['method'], status=str(entry['status']))
+    observe_metric('cjdm_http_request_duration_seconds', entry['ms'] / 1000, endpoint=endpoint)
+    inc_metric('cjdm_db_queries_total', entry['queries'], endpoint=endpoint)
+    inc_metric('cjdm_db_query_seconds_total', entry['db_ms'] / 1000, endpoint=endpoint)
+    if time.monotonic() - _metrics['written'] >= METRICS_FLUSH_SECONDS:
+        try: write_metrics()
+        except Exception as e: print(f"⚠️ Metrics write failed: {e}")
+
+def _metrics_snapshot():
+    with _metrics_lock:
+        counters = dict(_metrics['counters'])
+        histograms = {k: dict(h, counts=list(h['counts'])) for k, h in _metrics['histograms'].items()}
+    # Module-level tallies are already cumulative per process
+    stats = visitor_ingest_stats()
+    gauges = {json.dumps(['cjdm_visitor_queue_pending', {}]): stats.pop('pending')}
+    for outcome, value in stats.items():
+        counters[json.dumps(['cjdm_visitor_events_total', {'outcome': outcome}])] = value
+    for result, value in _page_cache_stats.items():
+        counters[json.dumps(['cjdm_page_cache_requests_total', {'result': result}])] = value
+    for result, value in _thumb_stats.items():
+        counters[json.dumps(['cjdm_thumbnails_total', {'result': result}])] = value
+    for result, value in _login_stats.items():
+        counters[json.dumps(['cjdm_login_attempts_total', {'result': result}])] = value
+    for result, value in _prerender_stats.items():
+        counters[json.dumps(['cjdm_prerender_total', {'result': result}])] = value
+    for encoding, value in _compress_stats.items():
+        counters[json.dumps(['cjdm_compressed_responses_total', {'encoding': encoding}])] = value
+    for direction, value in _compress_bytes.items():
+        counters[json.dumps(['cjdm_compression_bytes_total', {'direction': direction}])] = value
+    pool = _metrics['pool']
+    if pool is not None:
+        try:
+            gauges[json.dumps(['cjdm_db_pool_size', {}])] = pool.size()
+            for state, value in (('checked_out', pool.checkedout()), ('idle', pool.checkedin()),
+                                 ('overflow', max(pool.overflow(), 0))):
+                gauges[json.dumps(['cjdm_db_pool_connections', {'state': state}], sort_keys=True)] = value
+        except AttributeError:
+            pass   # pool class without size accounting (e.g. NullPool)
+    return {'pid': os.getpid(), 'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+def write_metrics():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(_metrics_snapshot(), f)
+    os.replace(path + '.tmp', path)
+    _metrics['written'] = time.monotonic()
+
+def _merge_metrics(total, snapshot):
+    for key, value in snapshot['counters'].items():
+        total['counters'][key] = total['counters'].get(key, 0) + value
+    for key, histogram in snapshot['histograms'].items():
+        merged = total['histograms'].get(key)
+        if merged is None or merged['buckets'] != histogram['buckets']:
+            total['histograms'][key] = dict(histogram, counts=list(histogram['counts']))
+        else:
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+            merged['sum'] += histogram['sum']
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def collect_metrics():
+    write_metrics()
+    total, gauges = {'counters': {}, 'histograms': {}}, []
+    exited_path = os.path.join(METRICS_DIR, '_exited.json')
+    with open(os.path.join(METRICS_DIR, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(exited_path) as f: exited = json.load(f)
+            except (OSError, ValueError):
+                exited = {'counters': {}, 'histograms': {}}
+            folded = False
+            for name in os.listdir(METRICS_DIR):
+                if not re.fullmatch(r'\d+\.json', name):
+                    continue
+                try:
+                    with open(os.path.join(METRICS_DIR, name)) as f: snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if _pid_alive(snapshot['pid']):
+                    _merge_metrics(total, snapshot)
+                    gauges += [(key, value, snapshot['pid']) for key, value in snapshot['gauges'].items()]
+                else:
+                    _merge_metrics(exited, snapshot)
+                    os.remove(os.path.join(METRICS_DIR, name))
+                    folded = True
+            if folded:
+                with open(exited_path + '.tmp', 'w') as f: json.dump(exited, f)
+                os.replace(exited_path + '.tmp', exited_path)
+            _merge_metrics(total, exited)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return total, gauges
+
+def _metric_labels(labels):
+    if not labels:
         return ''
-    if 'drive.google.com' in str(link):
-        file_id = None
-        if '/file/d/' in link:
-            file_id = link.split('/file/d/')[1].split('/')[0]
-        elif 'id=' in link:
-            file_id = link.split('id=')[1].split('&')[0]
-        if file_id:
-            return f'https://drive.google.com/uc?export=view&id={file_id}'
-    return link
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+def render_metrics():
+    total, gauges = collect_metrics()
+    series = {}
+    for key in sorted(total['counters']):
+        name, labels = json.loads(key)
+        series.setdefault(name, []).append(f"{name}{_metric_labels(labels)} {total['counters'][key]:.12g}")
+    for key in sorted(total['histograms']):
+        name, labels = json.loads(key)
+        histogram, cumulative = total['histograms'][key], 0
+        for le, count in zip([f'{b:g}' for b in histogram['buckets']] + ['+Inf'], histogram['counts']):
+            cumulative += count
+            series.setdefault(name, []).append(f"{name}_bucket{_metric_labels(dict(labels, le=le))} {cumulative}")
+        series[name] += [f"{name}_sum{_metric_labels(labels)} {histogram['sum']:.12g}",
+                         f"{name}_count{_metric_labels(labels)} {cumulative}"]
+    for key, value, pid in sorted(gauges, key=lambda g: (g[0], g[2])):
+        name, labels = json.loads(key)
+        series.setdefault(name, []).append(f"{name}{_metric_labels(dict(labels, pid=str(pid)))} {value:.12g}")
+    lookups = {json.loads(k)[1]['result']: v for k, v in total['counters'].items()
+               if k.startswith('["cjdm_page_cache_requests_total"')}
+    served = lookups.get('hits', 0) + lookups.get('misses', 0)
+    series['cjdm_page_cache_hit_ratio'] = [f"cjdm_page_cache_hit_ratio {lookups.get('hits', 0) / served if served else 0:.6g}"]
+    lines = []
+    for name in sorted(series):
+        kind, help_text = METRIC_HELP.get(name, ('untyped', ''))
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'] + series[name]
+    return '\n'.join(lines) + '\n'
+
+def _instrument_pool(pool):
+    do_get = pool._do_get
+    def timed_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            observe_metric('cjdm_db_pool_wait_seconds', time.perf_counter() - start, POOL_WAIT_BUCKETS)
+    pool._do_get = timed_get
+    _metrics['pool'] = pool
+
+def _template_started(sender, template, context, **extra):
+    g.setdefault('_template_starts', []).append(time.perf_counter())
+
+def _template_finished(sender, template, context, **extra):
+    starts = g.get('_template_starts')
+    if starts:
+        observe_metric('cjdm_template_render_seconds', time.perf_counter() - starts.pop(),
+                       endpoint=request.endpoint if has_request_context() else '-', template=template.name or '-')
+
+def _count_exception(sender, exception, **extra):
+    inc_metric('cjdm_http_exceptions_total', endpoint=request.endpoint or '-')
+
+if METRICS_ENABLED:
+    @app.before_request
+    def _watch_pool():
+        if _metrics['pool'] is not db.engine.pool:   # engine.dispose() swaps in a new pool
+            _instrument_pool(db.engine.pool)
+
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    got_request_exception.connect(_count_exception, app)
+
+    @atexit.register
+    def _write_metrics_at_exit():
+        try: write_metrics()
+        except: pass
+
+@app.route('/metrics')
+def metrics():
+    if not METRICS_ENABLED:
+        return 'Not Found', 404
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return 'Unauthorized', 401, {'WWW-Authenticate': 'Bearer'}
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# =================== SETTINGS CACHE ===================
+# Every worker keeps an in-memory snapshot of site_settings. Writers bump a
+# version row; other workers compare it at most every SETTINGS_CHECK_SECONDS
+# and reload the snapshot only when it changed.
+SETTINGS_VERSION_KEY = '_settings_version'
+SETTINGS_CHECK_SECONDS = float(os.environ.get('SETTINGS_CHECK_SECONDS', 5))
+
+_settings_cache = {'version': None, 'values': {}, 'checked': 0.0}
+_settings_lock = threading.Lock()
+
+def site_settings(fresh=False):
+    if not fresh and _settings_cache['version'] is not None and \
+            time.monotonic() - _settings_cache['checked'] < SETTINGS_CHECK_SECONDS:
+        return _settings_cache['values']
+    with _settings_lock, perf_phase('settings'):
+        try:
+            version = db.session.query(SiteSettings.value).filter_by(key=SETTINGS_VERSION_KEY).scalar() or '0'
+            if version != _settings_cache['version']:
+                _settings_cache['values'] = {s.key: s.value for s in SiteSettings.query.all()
+                                             if s.key != SETTINGS_VERSION_KEY}
+                _settings_cache['version'] = version
+            _settings_cache['checked'] = time.monotonic()
+        except:
+            pass
+    return _settings_cache['values']
 
 # ✅ NEW - Get Site Setting
 def get_setting(key, default=''):
+    return site_settings().get(key, default)
+
+# ✅ NEW - Set Site Settings (one transaction + version bump)
+def set_settings(values):
     try:
-        setting = SiteSettings.query.filter_by(key=key).first()
-        return setting.value if setting else default
+        existing = {s.key: s for s in SiteSettings.query.filter(
+            SiteSettings.key.in_(list(values) + [SETTINGS_VERSION_KEY])).all()}
+        values = dict(values, **{SETTINGS_VERSION_KEY: str(time.time_ns())})
+        for key, value in values.items():
+            setting = existing.get(key)
+            if setting:
+                setting.value = value
+                setting.updated_at = datetime.utcnow()
+            else:
+                db.session.add(SiteSettings(key=key, value=value))
+        db.session.commit()
     except:
-        return default
+        db.session.rollback()
+        raise
+    finally:
+        _settings_cache['version'] = None
 
-# ✅ NEW - Set Site Setting
 def set_setting(key, value):
+    try: set_settings({key: value})
+    except: pass
+
+# =================== PAGINATION ===================
+# Keyset (seek) pagination: pages are cut with WHERE (date, id) < cursor rather
+# than OFFSET, so every page costs one index range scan however deep it is.
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 24))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+
+def _per_page():
+    return max(1, min(request.args.get('per_page', PAGE_SIZE, type=int) or PAGE_SIZE, MAX_PAGE_SIZE))
+
+def _encode_cursor(row, columns):
+    values = [getattr(row, c.key) for c in columns]
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode_cursor(token, columns):
     try:
-        setting = SiteSettings.query.filter_by(key=key).first()
-        if setting:
-            setting.value = value
-            setting.updated_at = datetime.utcnow()
-        else:
-            db.session.add(SiteSettings(key=key, value=value))
-        db.session.commit()
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if len(values) != len(columns):
+            return None
+        return tuple(datetime.fromisoformat(v) if isinstance(c.type, db.DateTime) else v
+                     for v, c in zip(values, columns))
     except:
-        db.session.rollback()
+        return None
+
+def page_url(**args):
+    # Public pages only carry the parameters they read, so a cached page never leaks someone's ?fbclid=
+    params = _page_params.get(request.endpoint)
+    query = {k: v for k, v in request.args.items()
+             if k not in ('after', 'before', 'offset') and (params is None or k in params)}
+    query.update({k: v for k, v in args.items() if v is not None})
+    return url_for(request.endpoint, **(request.view_args or {}), **query)
+
+# Returns (rows, page) where page holds prev/next links for templates/_pager.html.
+# `columns` must be unique together (end with the primary key) and indexed.
+def keyset_paginate(query, *columns, descending=True):
+    per_page = _per_page()
+    token = request.args.get('before') or request.args.get('after')
+    cursor = _decode_cursor(token, columns) if token else None
+    backwards = cursor is not None and bool(request.args.get('before'))
+    newest_first = descending != backwards
+    if cursor is not None:
+        key = db.tuple_(*columns)
+        query = query.filter(key < cursor if newest_first else key > cursor)
+    query = query.order_by(*[c.desc() if newest_first else c.asc() for c in columns])
+    rows = query.limit(per_page + 1).all()
+    more, rows = len(rows) > per_page, rows[:per_page]
+    if backwards:
+        rows.reverse()
+    has_next, has_prev = (True, more) if backwards else (more, cursor is not None)
+    return rows, {
+        'per_page': per_page,
+        'next_url': page_url(after=_encode_cursor(rows[-1], columns)) if rows and has_next else None,
+        'prev_url': page_url(before=_encode_cursor(rows[0], columns)) if rows and has_prev else None,
+    }
+
+# Relevance-ranked results have no stable key to seek on, so they page by offset
+def offset_paginate(query):
+    per_page = _per_page()
+    offset = max(0, request.args.get('offset', 0, type=int))
+    rows = query.offset(offset).limit(per_page + 1).all()
+    more, rows = len(rows) > per_page, rows[:per_page]
+    return rows, {
+        'per_page': per_page,
+        'next_url': page_url(offset=offset + per_page) if more else None,
+        'prev_url': page_url(offset=max(0, offset - per_page) or None) if offset else None,
+    }
+
+# =================== BOT FILTER ===================
+# Crawlers, link-preview fetchers, uptime pingers and HTTP libraries are
+# classified from the User-Agent before a page view is queued, so they never
+# reach the visitors table or the traffic numbers. BOT_PATTERNS is one
+# precompiled alternation of named groups (the group that matched is the
+# category), memoized per raw UA string.
+#   tally - skip the visitor row, add to bot_hits per day and category (default)
+#   drop  - skip the visitor row, count only in the ingest stats
+#   off   - record bots like everyone else
+BOT_FILTER = os.environ.get('BOT_FILTER', 'tally')
+BOT_PATTERNS = {
+    'search': r'googlebot|google-inspectiontool|googleother|storebot-google|adsbot-google|mediapartners-google|'
+              r'apis-google|feedfetcher-google|bingbot|bingpreview|msnbot|adidxbot|slurp|duckduckbot|duckassistbot|'
+              r'baiduspider|yandex(?:bot|images|mobilebot|metrika|accessibilitybot|renderresourcesbot)|sogou|'
+              r'exabot|seznambot|yeti/|naverbot|applebot|petalbot|qwantify|qwantbot|mojeekbot|coccocbot',
+    'ai': r'gptbot|chatgpt-user|oai-searchbot|claudebot|claude-web|anthropic-ai|ccbot|perplexitybot|bytespider|'
+          r'amazonbot|meta-externalagent|cohere-ai|diffbot|youbot|timpibot|imagesiftbot|omgili',
+    'preview': r'facebookexternalhit|facebookcatalog|meta-externalfetcher|twitterbot|linkedinbot|'
+               r'telegrambot|discordbot|slackbot|slack-imgproxy|skypeuripreview|pinterestbot|pinterest/0\.|'
+               r'redditbot|embedly|iframely|vkshare|snap url preview|line-poker|'
+               r'quora link preview|google-pagerenderer|bitlybot|flipboardproxy|flipboardrss|'
+               r'xing-contenttabreceiver|'
+               # These apps' fetchers and in-app browsers share the name; only the browsers have an engine token
+               r'^(?!.*(?:applewebkit|gecko/)).*(?:whatsapp|viber|tumblr|outbrain|mastodon|bluesky)',
+    'seo': r'ahrefsbot|ahrefssiteaudit|semrushbot|siteauditbot|mj12bot|dotbot|rogerbot|screaming frog|'
+           r'seokicks|blexbot|serpstatbot|dataforseobot|barkrowler|megaindex|zoominfobot|linkdexbot|'
+           r'seostar|sistrix|awariobot|brandwatch',
+    'monitor': r'uptimerobot|pingdom|statuscake|site24x7|newrelicpinger|datadog|betteruptime|better uptime|'
+               r'hetrixtools|freshping|uptime-kuma|checkly|nagios|zabbix|monitis|catchpoint|kube-probe|'
+               r'elb-healthchecker|googlehc|health-?check|render/',
+    'tool': r'curl/|wget/|python-requests|python-urllib|python-httpx|aiohttp|go-http-client|^java/|okhttp|'
+            r'apache-httpclient|axios/|node-fetch|undici|libwww-perl|guzzlehttp|^php/|scrapy|httpie|'
+            r'postmanruntime|insomnia|headlesschrome|phantomjs|puppeteer|playwright|selenium|lighthouse|'
+            r'pagespeed|gtmetrix|w3c_validator|validator\.nu',
+    'other': r'(?<!cu)bot\b|crawl|spider|scraper|archiver|feedly|feedburner|inoreader|newsblur|^\s*$',
+}
+BOT_EXTRA_PATTERNS = os.environ.get('BOT_EXTRA_PATTERNS', '')   # lower-case regex alternation, added to "other"
+if BOT_EXTRA_PATTERNS:
+    BOT_PATTERNS['other'] += '|' + BOT_EXTRA_PATTERNS
+# Patterns are lower case; lowering the UA once is ~4x faster than re.I
+_BOT_RE = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in BOT_PATTERNS.items()))
+
+class BotHit(db.Model):
+    __tablename__ = 'bot_hits'
+    day = db.Column(db.String(10), primary_key=True)
+    category = db.Column(db.String(20), primary_key=True)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+_bot_hits = {}   # (day, category) -> hits not yet written
+_bot_hits_lock = threading.Lock()
+
+# Bot category of a User-Agent string, or None for a browser
+@lru_cache(maxsize=4096)
+def classify_user_agent(user_agent):
+    match = _BOT_RE.search(user_agent.lower())
+    return match.lastgroup if match else None
+
+def _tally_bot(category, when):
+    key = (when.strftime('%Y-%m-%d'), category)
+    with _bot_hits_lock:
+        _bot_hits[key] = _bot_hits.get(key, 0) + 1
+
+def _write_bot_hits():
+    with _bot_hits_lock:
+        hits = dict(_bot_hits)
+        _bot_hits.clear()
+    if not hits:
+        return
+    with app.app_context():
+        try:
+            stmt = upsert_insert(BotHit).values([{'day': day, 'category': category, 'hits': n}
+                                                 for (day, category), n in hits.items()])
+            db.session.execute(stmt.on_conflict_do_update(index_elements=['day', 'category'],
+                                                          set_={'hits': BotHit.hits + stmt.excluded.hits}))
+            db.session.commit()
+        except Exception as e:
+            print(f"❌ Bot tally flush error: {e}")
+            try: db.session.rollback()
+            except: pass
+            with _bot_hits_lock:   # keep them for the next flush
+                for key, n in hits.items():
+                    _bot_hits[key] = _bot_hits.get(key, 0) + n
+
+def bot_traffic(days=30):
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    return db.session.query(BotHit.category, db.func.sum(BotHit.hits)).filter(BotHit.day >= since) \
+        .group_by(BotHit.category).order_by(db.func.sum(BotHit.hits).desc()).all()
+
+# =================== VISITOR INGEST ===================
+# Page views are queued in memory and written by a background thread in
+# batched multi-row inserts, so public routes never wait on the visitors table.
+VISITOR_QUEUE_SIZE = int(os.environ.get('VISITOR_QUEUE_SIZE', 10000))
+VISITOR_BATCH_SIZE = int(os.environ.get('VISITOR_BATCH_SIZE', 200))
+VISITOR_FLUSH_SECONDS = float(os.environ.get('VISITOR_FLUSH_SECONDS', 5))
+VISITOR_SEEN_MAX = int(os.environ.get('VISITOR_SEEN_MAX', 100000))
+
+_visitor_queue = queue.Queue(maxsize=VISITOR_QUEUE_SIZE)
+_visitor_stats = {'queued': 0, 'dropped': 0, 'written': 0, 'batches': 0, 'errors': 0, 'bots': 0}
+_visitor_seen = set()   # (ip, page, day) keys already stored
+_visitor_write_lock = threading.Lock()
+_visitor_start_lock = threading.Lock()
+_visitor_wakeup = threading.Event()
+_visitor_worker = {'pid': None}
 
-# ✅ NEW - Track Visitor
 def track_visitor(page):
     try:
         ip = request.headers.get('X-Forwarded-For', request.remote_addr)
         if ip:
             ip = ip.split(',')[0].strip()
-        today = datetime.utcnow().strftime('%Y-%m-%d')
-        
-        # Check if same IP already visited today (avoid duplicate counting)
-        existing = Visitor.query.filter_by(
-            ip_address=ip, page=page, date_only=today
-        ).first()
-        
-        if not existing:
-            visitor = Visitor(
-                ip_address=ip,
-                page=page,
-                user_agent=str(request.user_agent)[:500],
-                date_only=today
-            )
-            db.session.add(visitor)
-            db.session.commit()
+        event = (ip, page, str(request.user_agent)[:500], datetime.utcnow())
+        category = classify_user_agent(event[2]) if BOT_FILTER != 'off' else None
     except:
+        return
+    if category:
+        _visitor_stats['bots'] += 1
+        if BOT_FILTER == 'tally':
+            _tally_bot(category, event[3])
+        return
+    _start_visitor_worker()
+    try:
+        _visitor_queue.put_nowait(event)
+        _visitor_stats['queued'] += 1
+        if _visitor_queue.qsize() >= VISITOR_BATCH_SIZE:
+            _visitor_wakeup.set()
+    except queue.Full:
+        _visitor_stats['dropped'] += 1
+        if _visitor_stats['dropped'] % 1000 == 1:
+            print(f"⚠️ Visitor queue full, {_visitor_stats['dropped']} page views dropped so far")
+
+def _start_visitor_worker():
+    # One flusher per process; gunicorn forks workers, so key it on the pid
+    if _visitor_worker['pid'] == os.getpid():
+        return
+    with _visitor_start_lock:
+        if _visitor_worker['pid'] != os.getpid():
+            _visitor_worker['pid'] = os.getpid()
+            threading.Thread(target=_visitor_flush_loop, name='visitor-flush', daemon=True).start()
+
+def _visitor_flush_loop():
+    while True:
+        _visitor_wakeup.wait(VISITOR_FLUSH_SECONDS)
+        _visitor_wakeup.clear()
+        flush_visitors()
+        _maybe_compact_visitors()
+
+def _write_visitors(events):
+    with app.app_context():
+        try:
+            rows, counts = {}, {}
+            for ip, page, user_agent, when in events:
+                day = when.strftime('%Y-%m-%d')
+                key = (ip, page, day)
+                counts.setdefault((day, page), [0, 0])[0] += 1
+                if key not in _visitor_seen and key not in rows:
+                    rows[key] = {'ip_address': ip, 'page': page, 'user_agent': user_agent,
+                                 'visit_date': when, 'date_only': day}
+            if rows:
+                # Other workers (or an earlier run) may already have stored some of these
+                existing = db.session.query(Visitor.ip_address, Visitor.page, Visitor.date_only).filter(
+                    Visitor.date_only.in_({k[2] for k in rows}),
+                    Visitor.ip_address.in_({k[0] for k in rows})).all()
+                for key in existing:
+                    rows.pop(tuple(key), None)
+                    _visitor_seen.add(tuple(key))
+            if rows:
+                ua_ids = user_agent_ids({r['user_agent'] for r in rows.values()})
+                for row in rows.values():
+                    row['user_agent_id'] = ua_ids.get(row.pop('user_agent'))
+                db.session.execute(db.insert(Visitor), list(rows.values()))
+            for ip, page, day in rows:
+                counts[(day, page)][1] += 1
+            _bump_daily_stats(counts)
+            add_to_sketches(rows)
+            db.session.commit()
+            if len(_visitor_seen) + len(rows) > VISITOR_SEEN_MAX:
+                _visitor_seen.clear()
+            _visitor_seen.update(rows)
+            _visitor_stats['written'] += len(rows)
+            _visitor_stats['batches'] += 1
+            return True
+        except Exception as e:
+            _visitor_stats['errors'] += 1
+            print(f"❌ Visitor flush error: {e}")
+            try: db.session.rollback()
+            except: pass
+            return False
+
+def _ua_hash(value):
+    return hashlib.sha1(value.encode('utf-8', 'replace')).hexdigest()
+
+# Map user-agent strings to user_agents ids, inserting the ones not seen before
+def user_agent_ids(values, conn=None):
+    conn = conn or db.session
+    values = {v for v in values if v}
+    if not values:
+        return {}
+    hashes = {_ua_hash(v): v for v in values}
+    stmt = upsert_insert(UserAgent).values([{'ua_hash': h, 'value': v} for h, v in hashes.items()])
+    conn.execute(stmt.on_conflict_do_nothing(index_elements=['ua_hash']))
+    found = conn.execute(db.select(UserAgent.ua_hash, UserAgent.id).where(UserAgent.ua_hash.in_(hashes))).all()
+    return {hashes[h]: ua_id for h, ua_id in found}
+
+def upsert_insert(model):
+    # INSERT .. ON CONFLICT for the two databases this app runs on
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def _bump_daily_stats(counts):
+    if not counts:
+        return
+    stmt = upsert_insert(VisitorDailyStat).values([
+        {'day': day, 'page': page, 'hits': hits, 'uniques': uniques}
+        for (day, page), (hits, uniques) in counts.items()])
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['day', 'page'],
+        set_={'hits': VisitorDailyStat.hits + stmt.excluded.hits,
+              'uniques': VisitorDailyStat.uniques + stmt.excluded.uniques}))
+
+# Rebuild the rollup from raw visitor rows (hits can only be recovered as one per row).
+# Days whose raw rows were already compacted away keep their rollup.
+def rebuild_daily_stats():
+    flush_visitors()
+    VisitorDailyStat.query.filter(VisitorDailyStat.day.in_(
+        db.select(Visitor.date_only).distinct())).delete(synchronize_session=False)
+    db.session.execute(db.insert(VisitorDailyStat).from_select(
+        ['day', 'page', 'hits', 'uniques'],
+        db.select(Visitor.date_only, Visitor.page, db.func.count(Visitor.id),
+                  db.func.count(db.distinct(Visitor.ip_address)))
+        .where(Visitor.date_only.isnot(None), Visitor.page.isnot(None))
+        .group_by(Visitor.date_only, Visitor.page)))
+    db.session.commit()
+    return VisitorDailyStat.query.count()
+
+def traffic_series(days, label_format):
+    # One grouped read of the rollup for the last `days` days, oldest first
+    now = datetime.utcnow()
+    dates = [now - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    counts = dict(db.session.query(VisitorDailyStat.day, db.func.sum(VisitorDailyStat.uniques))
+                  .filter(VisitorDailyStat.day >= dates[0].strftime('%Y-%m-%d'))
+                  .group_by(VisitorDailyStat.day).all())
+    return [{'date': d.strftime('%Y-%m-%d'), 'day': d.strftime(label_format),
+             'count': int(counts.get(d.strftime('%Y-%m-%d')) or 0)} for d in dates]
+
+# Write every queued page view now (flusher thread, worker shutdown, CLI commands).
+# Draining and writing share one lock so a shutdown flush waits for the batch in flight.
+# A batch that fails to write goes back on the queue for the next flush; whatever
+# no longer fits under VISITOR_QUEUE_SIZE is counted as dropped.
+def flush_visitors():
+    with _visitor_write_lock:
+        while True:
+            batch = []
+            try:
+                while len(batch) < VISITOR_BATCH_SIZE:
+                    batch.append(_visitor_queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                break
+            if not _write_visitors(batch):
+                _requeue_visitors(batch)
+                break
+    _write_bot_hits()
+
+def _requeue_visitors(events):
+    for i, event in enumerate(events):
+        try:
+            _visitor_queue.put_nowait(event)
+        except queue.Full:
+            _visitor_stats['dropped'] += len(events) - i
+            print(f"⚠️ Visitor queue full, {len(events) - i} page views of a failed batch dropped")
+            return
+
+def visitor_ingest_stats():
+    return dict(_visitor_stats, pending=_visitor_queue.qsize())
+
+atexit.register(flush_visitors)
+
+# =================== VISITOR RETENTION ===================
+# Raw visitor rows older than VISITOR_RETENTION_DAYS are covered by the daily
+# rollup, appended to monthly gzip NDJSON archives and then deleted in small
+# batches, each in its own short transaction. Runs from `flask compact-visitors`
+# and, every VISITOR_COMPACT_HOURS, in a thread of its own (started by the
+# flusher, which keeps writing batches meanwhile) in whichever worker gets the
+# lock first.
+VISITOR_RETENTION_DAYS = int(os.environ.get('VISITOR_RETENTION_DAYS', 180))
+VISITOR_ARCHIVE_DIR = os.environ.get('VISITOR_ARCHIVE_DIR', '/tmp/cjdm-visitor-archive')
+VISITOR_COMPACT_HOURS = float(os.environ.get('VISITOR_COMPACT_HOURS', 24))
+VISITOR_COMPACT_BATCH = int(os.environ.get('VISITOR_COMPACT_BATCH', 1000))
+
+_visitor_compaction = {'next': time.monotonic() + 600, 'thread': None}
+
+# Cross-process mutex: advisory lock on PostgreSQL, flock next to the SQLite file
+@contextmanager
+def exclusive_lock(name, blocking=True):
+    if db.engine.dialect.name == 'postgresql':
+        key = int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], 'big', signed=True)
+        with db.engine.connect() as conn:
+            if blocking:
+                conn.execute(db.text('SELECT pg_advisory_lock(:key)'), {'key': key})
+                acquired = True
+            else:
+                acquired = conn.execute(db.text('SELECT pg_try_advisory_lock(:key)'), {'key': key}).scalar()
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    conn.execute(db.text('SELECT pg_advisory_unlock(:key)'), {'key': key})
+        return
+    path = f"{db.engine.url.database or '/tmp/college.db'}.{name}.lock"
+    with open(path, 'a') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            acquired = True
+        except BlockingIOError:
+            acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+def _visitor_archive_row(visitor, user_agent):
+    return json.dumps({'id': visitor.id, 'ip_address': visitor.ip_address, 'page': visitor.page,
+                       'user_agent': user_agent, 'visit_date': visitor.visit_date.isoformat() if visitor.visit_date else None,
+                       'date_only': visitor.date_only}) + '\n'
+
+def compact_visitors(retention_days=VISITOR_RETENTION_DAYS, archive_dir=VISITOR_ARCHIVE_DIR,
+                     batch_size=VISITOR_COMPACT_BATCH):
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+    report = {'cutoff': cutoff, 'rolled_up': 0, 'archived': 0, 'deleted': 0, 'user_agents': 0}
+
+    # 1. Days that predate the rollup get their aggregates from the raw rows first
+    missing = db.select(Visitor.date_only, Visitor.page, db.func.count(Visitor.id),
+                        db.func.count(db.distinct(Visitor.ip_address))).where(
+        Visitor.date_only < cutoff, Visitor.page.isnot(None),
+        ~db.exists().where(VisitorDailyStat.day == Visitor.date_only, VisitorDailyStat.page == Visitor.page)
+    ).group_by(Visitor.date_only, Visitor.page)
+    report['rolled_up'] = db.session.execute(db.insert(VisitorDailyStat).from_select(
+        ['day', 'page', 'hits', 'uniques'], missing)).rowcount
+    db.session.commit()
+
+    # 2. Archive and delete expired rows in id order, one short transaction per batch
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+    while True:
+        batch = db.session.query(Visitor, db.func.coalesce(UserAgent.value, Visitor.user_agent)).outerjoin(
+            UserAgent, UserAgent.id == Visitor.user_agent_id).filter(
+            Visitor.date_only < cutoff).order_by(Visitor.id).limit(batch_size).all()
+        if not batch:
+            break
+        if archive_dir:
+            months = {}
+            for visitor, user_agent in batch:
+                months.setdefault((visitor.date_only or 'unknown')[:7], []).append(_visitor_archive_row(visitor, user_agent))
+            for month, lines in months.items():
+                with gzip.open(os.path.join(archive_dir, f'visitors-{month}.ndjson.gz'), 'at', encoding='utf-8') as f:
+                    f.writelines(lines)
+            report['archived'] += len(batch)
+        ids = [visitor.id for visitor, _ in batch]
+        report['deleted'] += Visitor.query.filter(Visitor.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+    # 3. Move user-agent strings still stored inline on retained rows into the lookup table
+    while True:
+        rows = db.session.query(Visitor.id, Visitor.user_agent).filter(
+            Visitor.user_agent.isnot(None)).order_by(Visitor.id).limit(batch_size).all()
+        if not rows:
+            break
+        ua_ids = user_agent_ids({ua for _, ua in rows})
+        visitors = Visitor.__table__
+        db.session.execute(db.update(visitors).where(visitors.c.id == db.bindparam('row_id')).values(
+            user_agent=None, user_agent_id=db.bindparam('ua_id')),
+            [{'row_id': row_id, 'ua_id': ua_ids.get(ua)} for row_id, ua in rows])
+        db.session.commit()
+        report['user_agents'] += len(rows)
+    return report
+
+def _maybe_compact_visitors():
+    # The first run on years of raw rows can take long; the flusher must not wait for it
+    if not VISITOR_COMPACT_HOURS or time.monotonic() < _visitor_compaction['next']:
+        return
+    running = _visitor_compaction['thread']
+    if running and running.is_alive():
+        return
+    _visitor_compaction['next'] = time.monotonic() + VISITOR_COMPACT_HOURS * 3600
+    _visitor_compaction['thread'] = threading.Thread(target=_compact_visitors_now, name='visitor-compaction',
+                                                     daemon=True)
+    _visitor_compaction['thread'].start()
+
+def _compact_visitors_now():
+    with app.app_context():
         try:
+            with exclusive_lock('visitor-compaction', blocking=False) as acquired:
+                if acquired:
+                    report = compact_visitors()
+                    if report['deleted'] or report['user_agents']:
+                        print(f"✅ Visitor compaction: {report}")
+        except Exception as e:
+            print(f"❌ Visitor compaction error: {e}")
             db.session.rollback()
+
+# =================== UNIQUE VISITOR SKETCHES ===================
+# HyperLogLog with 2^12 one-byte registers: unique counts carry a standard
+# error of 1.04 / sqrt(4096) ~ 1.6% (so ~95% of estimates within +/-3.3%),
+# and are exact-ish below a few hundred thanks to linear counting. Sketches
+# merge by register-wise max, so week/month/all-time uniques come from
+# merging day sketches in memory instead of COUNT(DISTINCT) over raw rows.
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+_HLL_POWERS = [2.0 ** -i for i in range(65)]
+
+class HyperLogLog:
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers or HLL_REGISTERS)
+
+    @classmethod
+    def load(cls, blob):
+        return cls(zlib.decompress(blob)) if blob else cls()
+
+    def dump(self):
+        return zlib.compress(bytes(self.registers), 6)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index, rest = x >> (64 - HLL_PRECISION), x & ((1 << (64 - HLL_PRECISION)) - 1)
+        rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = HLL_REGISTERS
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(_HLL_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+def add_to_sketches(keys):
+    # keys: (ip, page, day) of newly stored visits; runs inside the flusher's transaction
+    updates = {}
+    for ip, page, day in keys:
+        for key in ((day, page), (day, '*'), ('*', page), ('*', '*')):
+            updates.setdefault(key, HyperLogLog()).add(ip)
+    if not updates:
+        return
+    db.session.execute(upsert_insert(VisitorSketch).values([
+        {'day': day, 'page': page, 'registers': HyperLogLog().dump()} for day, page in updates
+    ]).on_conflict_do_nothing(index_elements=['day', 'page']))
+    stored = db.session.query(VisitorSketch).filter(
+        db.tuple_(VisitorSketch.day, VisitorSketch.page).in_(list(updates))).with_for_update().all()
+    for sketch in stored:
+        sketch.registers = HyperLogLog.load(sketch.registers).merge(updates[(sketch.day, sketch.page)]).dump()
+
+def unique_visitors(days=None, page='*'):
+    # days: list of 'YYYY-MM-DD' strings, or None for all time
+    query = db.session.query(VisitorSketch.registers).filter_by(page=page)
+    query = query.filter(VisitorSketch.day.in_(days)) if days else query.filter_by(day='*')
+    merged = HyperLogLog()
+    for (blob,) in query:
+        merged.merge(HyperLogLog.load(blob))
+    return merged.count()
+
+# Add the retained raw rows to the sketches (idempotent: re-adding an IP is a no-op)
+def rebuild_visitor_sketches(batch_size=5000):
+    flush_visitors()
+    last_id, added = 0, 0
+    while True:
+        rows = db.session.query(Visitor.id, Visitor.ip_address, Visitor.page, Visitor.date_only).filter(
+            Visitor.id > last_id, Visitor.date_only.isnot(None), Visitor.page.isnot(None)
+        ).order_by(Visitor.id).limit(batch_size).all()
+        if not rows:
+            return added
+        add_to_sketches([(ip, page, day) for _, ip, page, day in rows])
+        db.session.commit()
+        last_id, added = rows[-1][0], added + len(rows)
+
+# =================== CONTENT CHANGES ===================
+# Every committed ORM write records the tables it touched; handlers registered
+# with @on_content_change run after the commit with that set of table names.
+_content_handlers = []
+
+def on_content_change(handler):
+    _content_handlers.append(handler)
+    return handler
+
+# Core (non-ORM) bulk writes are invisible to the flush hook, so they report themselves
+def note_content_change(*models):
+    db.session.info.setdefault('changed_tables', set()).update(m.__tablename__ for m in models)
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_tables(session, flush_context):
+    changed = session.info.setdefault('changed_tables', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if hasattr(obj, '__table__'):
+            changed.add(obj.__table__.name)
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_content_change(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        for handler in _content_handlers:
+            try: handler(tables)
+            except Exception as e: print(f"❌ Content change handler {handler.__name__}: {e}")
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+# =================== CONTENT COUNTERS ===================
+# Dashboard totals (active rows, unread messages) kept in content_counters
+# instead of seven COUNT(*) scans per load. after_flush turns each ORM insert,
+# delete and flip of the counted flag into a relative UPDATE in the same
+# transaction, so a rollback undoes it as well. Core bulk writes call
+# bump_content_counter() themselves; reconcile_content_counters() recomputes
+# everything from source (`flask reconcile-counters`).
+class ContentCounter(db.Model):
+    __tablename__ = 'content_counters'
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+COUNTERS = {'books': (Book, 'is_active', True), 'results': (Result, 'is_active', True),
+            'notices': (Notice, 'is_active', True), 'faculty': (Faculty, 'is_active', True),
+            'courses': (Course, 'is_active', True), 'gallery': (Gallery, 'is_active', True),
+            'messages': (ContactMessage, 'is_read', False)}
+_COUNTED = {model: (name, flag, value) for name, (model, flag, value) in COUNTERS.items()}
+
+# Load the old flag value on assignment even when the attribute was expired,
+# otherwise the flush history cannot tell whether the row was counted before
+for _model, (_name, _flag, _value) in _COUNTED.items():
+    event.listen(getattr(_model, _flag), 'set', lambda *args: None, active_history=True)
+
+def _counter_update(name, delta):
+    table = ContentCounter.__table__
+    return db.update(table).where(table.c.name == name).values(value=table.c.value + delta)
+
+def bump_content_counter(model, delta):
+    if model in _COUNTED and delta:
+        db.session.execute(_counter_update(_COUNTED[model][0], delta))
+
+@event.listens_for(Session, 'after_flush')
+def _maintain_content_counters(session, flush_context):
+    deltas = {}
+    for kind, objects in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            if type(obj) not in _COUNTED:
+                continue
+            name, flag, value = _COUNTED[type(obj)]
+            history = inspect(obj).attrs[flag].history
+            if kind == 'new':
+                delta = int(getattr(obj, flag) == value)
+            elif kind == 'deleted':
+                delta = -int((history.deleted or history.unchanged or [None])[0] == value)
+            elif history.has_changes():
+                delta = int(history.added[0] == value) - int(bool(history.deleted) and history.deleted[0] == value)
+            else:
+                continue
+            if delta:
+                deltas[name] = deltas.get(name, 0) + delta
+    if deltas:
+        conn = session.connection()
+        for name, delta in deltas.items():
+            conn.execute(_counter_update(name, delta))
+
+def reconcile_content_counters(conn=None):
+    conn = conn or db.session
+    table = ContentCounter.__table__
+    before = dict(conn.execute(db.select(table.c.name, table.c.value)).all())
+    for name, (model, flag, value) in COUNTERS.items():
+        if name not in before:
+            conn.execute(db.insert(table).values(name=name, value=0))
+        count = db.select(db.func.count()).select_from(model.__table__).where(
+            model.__table__.c[flag] == value).scalar_subquery()
+        conn.execute(db.update(table).where(table.c.name == name).values(value=count))
+    after = dict(conn.execute(db.select(table.c.name, table.c.value)).all())
+    if conn is db.session:
+        db.session.commit()
+    return {name: (before.get(name), after[name]) for name in COUNTERS}
+
+def content_counts():
+    counts = dict(db.session.execute(db.select(ContentCounter.name, ContentCounter.value)).all())
+    return {name: counts.get(name, 0) for name in COUNTERS}
+
+# =================== ADMIN IDENTITY CACHE ===================
+# load_user() runs on every admin request. A per-process LRU answers it from
+# the fields views and templates use (id, username, name, role) for up to
+# ADMIN_IDENTITY_TTL seconds. Any commit to the admins table (add_user,
+# delete_user) clears this worker's copy at once; in other workers a deleted
+# or changed user is noticed within the TTL.
+ADMIN_IDENTITY_TTL = float(os.environ.get('ADMIN_IDENTITY_TTL', 30))
+ADMIN_IDENTITY_MAX = 256
+
+class AdminIdentity(UserMixin):
+    def __init__(self, admin):
+        self.id, self.username, self.name, self.role = admin.id, admin.username, admin.name, admin.role
+
+_identity_cache = OrderedDict()   # admin id -> (monotonic expiry, AdminIdentity)
+_identity_lock = threading.Lock()
+
+def cached_admin(user_id):
+    now = time.monotonic()
+    with _identity_lock:
+        entry = _identity_cache.get(user_id)
+        if entry and entry[0] > now:
+            _identity_cache.move_to_end(user_id)
+            return entry[1]
+    with perf_phase('auth'):
+        admin = db.session.get(Admin, user_id)
+    if admin is None:   # not cached, so a user created later under this id is seen at once
+        return None
+    identity = AdminIdentity(admin)
+    with _identity_lock:
+        _identity_cache[user_id] = (now + ADMIN_IDENTITY_TTL, identity)
+        _identity_cache.move_to_end(user_id)
+        while len(_identity_cache) > ADMIN_IDENTITY_MAX:
+            _identity_cache.popitem(last=False)
+    return identity
+
+@on_content_change
+def _invalidate_admin_identities(tables):
+    if Admin.__tablename__ in tables:
+        with _identity_lock:
+            _identity_cache.clear()
+
+# =================== PAGE CACHE ===================
+# Full rendered responses of anonymous public pages, keyed on path + normalized
+# query string and tagged with the tables they were built from. A tag's
+# generation changes whenever one of its tables is committed to, which makes
+# every entry built on the old generation a miss.
+#   memory - per-process LRU capped at PAGE_CACHE_MAX_BYTES (single worker)
+#   disk   - shared directory, safe across gunicorn workers (default)
+#   none   - disabled
+PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'disk')
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', '/tmp/cjdm-page-cache')
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 1000))
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 600))
+
+def _entry_size(entry):
+    return len(entry['body']) + sum(map(len, entry.get('encoded', {}).values()))
+
+class MemoryPageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes, self.size = max_bytes, 0
+        self.entries, self.generations = OrderedDict(), {}
+        self.lock = threading.Lock()
+
+    def generation(self, tag):
+        return self.generations.get(tag, 0)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old: self.size -= _entry_size(old)
+            self.entries[key] = entry
+            self.size += _entry_size(entry)
+            while self.size > self.max_bytes and self.entries:
+                self.size -= _entry_size(self.entries.popitem(last=False)[1])
+
+    def invalidate(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+
+class DiskPageCache:
+    def __init__(self, directory, max_entries):
+        self.directory, self.max_entries, self.writes = directory, max_entries, 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, name, data):
+        tmp = self._path(f'.{name}.{os.getpid()}.tmp')
+        with open(tmp, 'wb') as f: f.write(data)
+        os.replace(tmp, self._path(name))
+
+    def generation(self, tag):
+        try:
+            with open(self._path(f'tag-{tag}'), 'rb') as f: return f.read()
+        except FileNotFoundError:
+            return b''
+
+    def get(self, key):
+        try:
+            with open(self._path(hashlib.sha1(key.encode()).hexdigest()), 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, entry):
+        self._write(hashlib.sha1(key.encode()).hexdigest(), pickle.dumps(entry))
+        self.writes += 1
+        if self.writes % 50 == 0:
+            self.prune()
+
+    def prune(self):
+        files = [e for e in os.scandir(self.directory) if len(e.name) == 40]
+        if len(files) > self.max_entries:
+            files.sort(key=lambda e: e.stat().st_mtime)
+            for entry in files[:len(files) - self.max_entries]:
+                try: os.remove(entry.path)
+                except FileNotFoundError: pass
+
+    def invalidate(self, tags):
+        for tag in tags:
+            self._write(f'tag-{tag}', f'{os.getpid()}-{time.time_ns()}'.encode())
+
+page_cache = {'memory': lambda: MemoryPageCache(PAGE_CACHE_MAX_BYTES),
+              'disk': lambda: DiskPageCache(PAGE_CACHE_DIR, PAGE_CACHE_MAX_ENTRIES)}.get(
+    PAGE_CACHE_BACKEND, lambda: None)()
+_page_cache_stats = {'hits': 0, 'misses': 0, 'bypass': 0}
+
+@on_content_change
+def _invalidate_page_cache(tables):
+    if page_cache:
+        page_cache.invalidate(tables)
+
+def _code_fingerprint():
+    # Entries written by an older deploy (other templates) must never be served
+    paths = [__file__] + [os.path.join(root, f) for folder in (os.path.join(app.root_path, app.template_folder),
+             app.static_folder) for root, _, files in os.walk(folder) for f in files]
+    return hashlib.sha1(str(sorted((p, os.path.getmtime(p)) for p in paths)).encode()).hexdigest()[:12]
+
+_CODE_FINGERPRINT = _code_fingerprint()
+
+PAGINATION_PARAMS = ('after', 'before', 'offset', 'per_page')
+_page_params = {}   # endpoint -> query parameters its view reads, filled in by page_view
+
+def _page_cache_key():
+    # Tracking parameters (utm_*, fbclid, ...) don't change the page, so they don't split the cache
+    params = _page_params.get(request.endpoint, ())
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if v and k in params)
+    return _CODE_FINGERPRINT + request.path + '?' + '&'.join(f'{k}={v}' for k, v in args)
+
+# =================== CONDITIONAL GET ===================
+# A page's content version is one aggregate statement over its source tables
+# (newest id, active row count, newest date). Together with the settings
+# version it forms a weak ETag, so a matching If-None-Match gets a 304 before
+# the page's own queries or template run.
+CONTENT_DATES = {'notices': 'post_date', 'books': 'upload_date', 'results': 'upload_date',
+                 'gallery': 'upload_date'}
+
+def content_version(*models):
+    columns = []
+    for model in models:
+        active = db.select(model).filter_by(is_active=True).subquery()
+        columns += [db.select(db.func.max(active.c.id)).scalar_subquery(),
+                    db.select(db.func.count()).select_from(active).scalar_subquery()]
+        if model.__tablename__ in CONTENT_DATES:
+            columns.append(db.select(db.func.max(active.c[CONTENT_DATES[model.__tablename__]])).scalar_subquery())
+    # The settings version rides along, so the ETag never trails another worker's set_settings
+    columns.append(db.select(SiteSettings.value).filter_by(key=SETTINGS_VERSION_KEY).scalar_subquery())
+    *row, settings_version = db.session.execute(db.select(*columns)).one()
+    settings_version = settings_version or '0'
+    if settings_version != _settings_cache['version']:
+        site_settings(fresh=True)
+    dates = [v for v in row if isinstance(v, datetime)]
+    if settings_version != '0':
+        dates.append(datetime.utcfromtimestamp(int(settings_version) / 1e9))
+    dated = all(m.__tablename__ in CONTENT_DATES for m in models)
+    return [str(v) for v in row] + [settings_version], (max(dates) if dates and dated else None)
+
+def _validators(models):
+    version, last_modified = content_version(*models)
+    etag = hashlib.sha1(json.dumps([_CODE_FINGERPRINT, _page_cache_key(), version]).encode()).hexdigest()
+    return etag, last_modified
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Cookie')
+    return response
+
+# Public page: counts the visit, answers conditional requests, then serves from
+# the page cache when possible. `models` are the tables the page is rendered
+# from; site settings are implied. `params` are the query parameters the view
+# reads; any others are ignored for caching and dropped from its page links.
+def page_view(page, *models, cache=True, params=()):
+    tags = sorted({m.__tablename__ for m in models} | {SiteSettings.__tablename__})
+    def decorator(view):
+        _page_sources[view.__name__] = set(tags)
+        _page_params[view.__name__] = set(params)
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with perf_phase('visitor'):
+                track_visitor(page)
+            anonymous = request.method in ('GET', 'HEAD') and '_flashes' not in session \
+                and not current_user.is_authenticated
+            if anonymous and PRERENDER:
+                response = serve_prerendered(request.endpoint)
+                if response is not None:
+                    return response
+            etag = last_modified = None
+            if anonymous:
+                try:
+                    with perf_phase('etag'):
+                        etag, last_modified = _validators(models)
+                except Exception as e: print(f"Conditional GET error: {e}")
+                if etag and request.if_none_match.contains_weak(etag):
+                    return _set_validators(app.response_class(status=304), etag, last_modified)
+            if not (cache and anonymous and page_cache):
+                _page_cache_stats['bypass'] += 1
+                response = make_response(view(*args, **kwargs))
+                return _set_validators(response, etag, last_modified) if etag and response.status_code == 200 else response
+            key = _page_cache_key()
+            entry = page_cache.get(key)
+            if entry and entry['expires'] > time.time() and \
+                    all(page_cache.generation(t) == g for t, g in entry['tags'].items()):
+                _page_cache_stats['hits'] += 1
+                encoding = pick_encoding(entry.get('encoded', {}))
+                response = app.response_class(entry['encoded'][encoding] if encoding else entry['body'],
+                                              status=entry['status'], headers=entry['headers'])
+                if encoding:
+                    send_encoded(response, encoding, len(entry['body']))
+                response.headers['X-Cache'] = 'HIT'
+                return _set_validators(response, etag, last_modified) if etag else response
+            _page_cache_stats['misses'] += 1
+            generations = {t: page_cache.generation(t) for t in tags}
+            site_settings(fresh=True)   # read after the generations, so a stored entry is never older than its tags
+            response = make_response(view(*args, **kwargs))
+            response.headers['Vary'] = 'Cookie'
+            if response.status_code == 200 and not response.direct_passthrough \
+                    and not session.modified and 'Set-Cookie' not in response.headers:
+                body, encoded = response.get_data(), precompress(response.get_data(), response.mimetype)
+                page_cache.set(key, {
+                    'body': body, 'encoded': encoded, 'status': response.status_code,
+                    'headers': [(k, v) for k, v in response.headers.items()
+                                if k not in ('Content-Length', 'ETag', 'Last-Modified')],
+                    'tags': generations, 'expires': time.time() + PAGE_CACHE_TTL})
+                encoding = pick_encoding(encoded)
+                if encoding:   # already compressed for the store; don't let _compress_response do it again
+                    response.set_data(encoded[encoding])
+                    send_encoded(response, encoding, len(body))
+            response.headers['X-Cache'] = 'MISS'
+            return _set_validators(response, etag, last_modified) if etag and response.status_code == 200 else response
+        return wrapper
+    return decorator
+
+# =================== STATIC PRE-RENDER ===================
+# With PRERENDER on, the read-only public pages and the gallery filtered by
+# each category are rendered to HTML files through their own views and
+# templates. page_view then answers anonymous GETs for them with a stat and a
+# file read: no SQL, no Jinja. A commit to a page's source tables deletes its
+# files and queues it for a background thread to render again. Until then, and
+# for pages not rendered yet, the normal path answers and queues the page.
+# Files live in a directory per code fingerprint, so a deploy with new
+# templates never serves old ones.
+PRERENDER = os.environ.get('PRERENDER', '').lower() in ('1', 'true', 'on')
+PRERENDER_ROOT = os.environ.get('PRERENDER_DIR', '/tmp/cjdm-static')
+PRERENDER_DIR = os.path.join(PRERENDER_ROOT, _CODE_FINGERPRINT)
+PRERENDER_DELAY = float(os.environ.get('PRERENDER_DELAY', 1))   # seconds to gather a burst of edits
+PRERENDER_ENDPOINTS = ['index', 'about', 'courses', 'faculty', 'notices', 'results', 'gallery']
+
+_page_sources = {}   # endpoint -> tables it renders from, filled in by page_view
+_prerender_pending = set()   # (endpoint, category); category None means every variant
+_prerender_wakeup = threading.Event()
+_prerender_start_lock = threading.Lock()
+_prerender_worker = {'pid': None}
+_prerender_stats = {'served': 0, 'rendered': 0, 'discarded': 0, 'errors': 0}
+
+def prerender_pages(endpoints=None):
+    pages = []
+    for endpoint in endpoints or PRERENDER_ENDPOINTS:
+        pages.append((endpoint, ''))
+        if endpoint == 'gallery':
+            pages += [('gallery', c) for (c,) in db.session.query(Gallery.category)
+                      .filter_by(is_active=True).distinct() if c]
+    return pages
+
+def _prerender_path(endpoint, category='', root=None):
+    name = f"gallery/{urllib.parse.quote(category, safe='')}.html" if category else f'{endpoint}.html'
+    return os.path.join(root or PRERENDER_DIR, name)
+
+@contextmanager
+def _prerender_lock():
+    os.makedirs(PRERENDER_DIR, exist_ok=True)
+    with open(os.path.join(PRERENDER_DIR, '.lock'), 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+
+def _prerender_stamp(endpoint):
+    try:
+        with open(os.path.join(PRERENDER_DIR, f'.{endpoint}.stamp'), 'rb') as f: return f.read()
+    except FileNotFoundError:
+        return b''
+
+def render_page(endpoint, category=''):
+    # The page exactly as an anonymous visitor gets it; None if it must not be stored
+    path = app.url_map.bind('localhost').build(endpoint, {'category': category} if category else {})
+    with app.test_request_context(path, base_url=SITE_URL or None):
+        site_settings(fresh=True)   # files outlive the settings check interval; never bake in a stale snapshot
+        response = make_response(app.view_functions[endpoint].__wrapped__())
+        if response.status_code != 200 or session.modified:
+            return None
+        return response.get_data()
+
+def prerender(pages, root=None):
+    # Files for the serving directory are only swapped in if no commit
+    # invalidated the page while it rendered
+    written = 0
+    for endpoint, category in pages:
+        stamp = _prerender_stamp(endpoint)
+        try:
+            body = render_page(endpoint, category)
+        except Exception as e:
+            _prerender_stats['errors'] += 1
+            print(f"❌ Pre-render {endpoint} {category}: {e}")
+            continue
+        if body is None:
+            continue
+        path = _prerender_path(endpoint, category, root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        files = {path: body}
+        files.update({path + ASSET_ENCODINGS[e]: data for e, data in precompress(body, 'text/html').items()})
+        tmps = {}
+        for target, data in files.items():
+            tmps[target] = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmps[target], 'wb') as f: f.write(data)
+        with _prerender_lock() if not root else nullcontext():
+            if root or _prerender_stamp(endpoint) == stamp:
+                for target, tmp in tmps.items():
+                    os.replace(tmp, target)
+                # Variants carry the page's mtime; serve_prerendered only sends a variant that matches it
+                st = os.stat(path)
+                for target in tmps:
+                    os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+                _prerender_stats['rendered'] += not root
+                written += 1
+            else:
+                for tmp in tmps.values():
+                    os.remove(tmp)
+                _prerender_stats['discarded'] += 1
+    return written
+
+def invalidate_prerendered(endpoints):
+    with _prerender_lock():
+        for endpoint in endpoints:
+            with open(os.path.join(PRERENDER_DIR, f'.{endpoint}.stamp'), 'wb') as f:
+                f.write(f'{os.getpid()}-{time.time_ns()}'.encode())
+            paths = [_prerender_path(endpoint)]
+            if endpoint == 'gallery' and os.path.isdir(os.path.join(PRERENDER_DIR, 'gallery')):
+                paths += [e.path for e in os.scandir(os.path.join(PRERENDER_DIR, 'gallery'))
+                          if e.name.endswith('.html')]
+            paths += [p + suffix for p in paths for suffix in ASSET_ENCODINGS.values()]
+            for path in paths:
+                try: os.remove(path)
+                except FileNotFoundError: pass
+
+def serve_prerendered(endpoint):
+    # Only parameters the view reads count; ?fbclid= and utm_* links still get the file
+    args = {k for k, v in request.args.items() if v and k in _page_params.get(endpoint, ())}
+    if endpoint not in PRERENDER_ENDPOINTS or args - ({'category'} if endpoint == 'gallery' else set()):
+        return None
+    category = request.args.get('category', '')
+    path = _prerender_path(endpoint, category)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        queue_prerender([(endpoint, category)])
+        return None
+    with f:
+        st = os.fstat(f.fileno())
+        etag = f'{st.st_mtime_ns:x}-{st.st_size:x}'
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            body, encoding = None, pick_encoding(COMPRESS_ENCODINGS)
+            if encoding:
+                try:
+                    with open(path + ASSET_ENCODINGS[encoding], 'rb') as variant:
+                        if os.fstat(variant.fileno()).st_mtime_ns == st.st_mtime_ns:
+                            body = variant.read()
+                except FileNotFoundError:
+                    pass
+            response = app.response_class(body if body is not None else f.read(), mimetype='text/html')
+            if body is not None:
+                send_encoded(response, encoding, st.st_size)
+            response.headers['X-Cache'] = 'STATIC'
+    _prerender_stats['served'] += 1
+    return _set_validators(response, etag, datetime.utcfromtimestamp(int(st.st_mtime)))
+
+def queue_prerender(pages):
+    # The renderer only starts from a request. Commits outside one (bootstrap in
+    # the gunicorn master before it forks, CLI writes) leave the pages pending
+    # for the first worker that queues something.
+    _prerender_pending.update(pages)
+    if has_request_context():
+        _start_prerender_worker()
+        _prerender_wakeup.set()
+
+@on_content_change
+def _prerender_stale(tables):
+    if not PRERENDER:
+        return
+    endpoints = [e for e in PRERENDER_ENDPOINTS if _page_sources.get(e, set()) & tables]
+    if endpoints:
+        invalidate_prerendered(endpoints)
+        queue_prerender([(e, None) for e in endpoints])
+
+def _start_prerender_worker():
+    # One renderer per process, like the visitor flusher
+    if _prerender_worker['pid'] == os.getpid():
+        return
+    with _prerender_start_lock:
+        if _prerender_worker['pid'] != os.getpid():
+            _prerender_worker['pid'] = os.getpid()
+            for entry in os.scandir(PRERENDER_ROOT) if os.path.isdir(PRERENDER_ROOT) else []:
+                if entry.is_dir() and entry.name != _CODE_FINGERPRINT:   # files from an older deploy
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            threading.Thread(target=_prerender_loop, name='prerender', daemon=True).start()
+
+def _prerender_loop():
+    while True:
+        _prerender_wakeup.wait()
+        time.sleep(PRERENDER_DELAY)
+        _prerender_wakeup.clear()
+        batch = set(_prerender_pending)
+        _prerender_pending.difference_update(batch)
+        try:
+            with app.app_context():
+                # Only categories that exist, so arbitrary ?category= values never reach the disk
+                known = prerender_pages(sorted({e for e, _ in batch}))
+                prerender([p for p in known if p in batch or (p[0], None) in batch])
+        except Exception as e:
+            _prerender_stats['errors'] += 1
+            print(f"❌ Pre-render error: {e}")
+
+# =================== MIGRATIONS ===================
+# db.create_all() only creates missing tables. Anything that must also reach
+# existing databases (indexes, new columns, backfills) is a numbered migration,
+# applied once and recorded in schema_migrations.
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def _create_indexes(*models):
+    def step(conn):
+        for model in models:
+            for index in model.__table__.indexes:
+                index.create(conn, checkfirst=True)
+    return step
+
+def _add_columns(model, *names):
+    def step(conn):
+        existing = {c['name'] for c in db.inspect(conn).get_columns(model.__tablename__)}
+        for name in names:
+            if name not in existing:
+                column = model.__table__.c[name]
+                conn.exec_driver_sql(f'ALTER TABLE {model.__tablename__} ADD COLUMN {name} '
+                                     f'{column.type.compile(conn.dialect)}')
+    return step
+
+def _steps(*steps):
+    return lambda conn: [step(conn) for step in steps]
+
+# Fill the stored Drive link columns for rows written before they existed
+def backfill_drive_links(conn, batch_size=500, commit=False):
+    updated = 0
+    for model in (Book, Result):
+        last_id = 0
+        while True:
+            rows = conn.execute(db.select(model.id, model.drive_link)
+                                .where(model.id > last_id, model.view_link.is_(None))
+                                .order_by(model.id).limit(batch_size)).all()
+            if not rows:
+                break
+            conn.execute(db.update(model).where(model.id == db.bindparam('row_id')),
+                         [dict(drive_link_fields(link), row_id=row_id) for row_id, link in rows])
+            if commit:
+                conn.commit()
+            last_id, updated = rows[-1][0], updated + len(rows)
+    return updated
+
+MIGRATIONS = [
+    (1, 'hot query indexes', _create_indexes(Book, Result, Notice, Gallery, ContactMessage, Visitor)),
+    (2, 'book search index', lambda conn: _create_book_search(conn)),
+    (3, 'stored drive link variants', _steps(
+        _add_columns(Book, 'drive_file_id', 'preview_link', 'view_link'),
+        _add_columns(Result, 'drive_file_id', 'preview_link', 'view_link', 'download_link'),
+        lambda conn: backfill_drive_links(conn))),
+    (4, 'user agent lookup table', _steps(
+        lambda conn: UserAgent.__table__.create(conn, checkfirst=True),
+        _add_columns(Visitor, 'user_agent_id'))),
+    (5, 'content counters', _steps(
+        lambda conn: ContentCounter.__table__.create(conn, checkfirst=True),
+        lambda conn: reconcile_content_counters(conn))),
+    (6, 'bot hit tally', lambda conn: BotHit.__table__.create(conn, checkfirst=True)),
+    (7, 'stored sitemap and feed', lambda conn: GeneratedDocument.__table__.create(conn, checkfirst=True)),
+]
+
+# =================== BOOK SEARCH ===================
+# PostgreSQL: weighted tsvector expression with a GIN index (kept current by Postgres).
+# SQLite: FTS5 table over books kept in sync by triggers on insert/update/delete.
+# Title outranks author/subject, which outrank the description.
+BOOK_TSVECTOR_SQL = ("setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+                     "setweight(to_tsvector('simple', coalesce(author, '') || ' ' || coalesce(subject, '')), 'B') || "
+                     "setweight(to_tsvector('simple', coalesce(description, '')), 'C')")
+BOOK_FTS_COLUMNS = 'title, author, subject, description'
+BOOK_FTS_RANK = 'bm25(books_fts, 10.0, 4.0, 4.0, 1.0)'
+
+def _create_book_search(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_books_search ON books USING GIN (({BOOK_TSVECTOR_SQL}))")
+        return
+    try:
+        conn.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+                             f"{BOOK_FTS_COLUMNS}, content='books', content_rowid='id', "
+                             f"tokenize='unicode61 remove_diacritics 2')")
+    except Exception as e:
+        print(f"⚠️ SQLite FTS5 unavailable, library search stays on LIKE: {e}")
+        return
+    new = ', '.join('new.' + c for c in BOOK_FTS_COLUMNS.split(', '))
+    old = ', '.join('old.' + c for c in BOOK_FTS_COLUMNS.split(', '))
+    conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN "
+                         f"INSERT INTO books_fts(rowid, {BOOK_FTS_COLUMNS}) VALUES (new.id, {new}); END")
+    conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN "
+                         f"INSERT INTO books_fts(books_fts, rowid, {BOOK_FTS_COLUMNS}) VALUES ('delete', old.id, {old}); END")
+    conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF {BOOK_FTS_COLUMNS} ON books BEGIN "
+                         f"INSERT INTO books_fts(books_fts, rowid, {BOOK_FTS_COLUMNS}) VALUES ('delete', old.id, {old}); "
+                         f"INSERT INTO books_fts(rowid, {BOOK_FTS_COLUMNS}) VALUES (new.id, {new}); END")
+    conn.exec_driver_sql("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+_book_search = {'backend': None}
+
+def book_search_backend():
+    if _book_search['backend'] is None:
+        backend = 'like'
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                backend = 'postgres'
+            elif db.session.execute(db.text(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'books_fts'")).first():
+                backend = 'fts5'
         except:
             pass
+        _book_search['backend'] = backend
+    return _book_search['backend']
+
+def search_terms(text):
+    return re.findall(r'\w+', text.lower())[:8]
+
+def like_search(query, text):
+    # Unranked substring match (the original library search; also the fallback)
+    return query.filter(db.or_(Book.title.ilike(f'%{text}%'), Book.author.ilike(f'%{text}%'),
+                               Book.subject.ilike(f'%{text}%'))).order_by(Book.upload_date.desc())
+
+# Ranked prefix search: every term must match the start of a word
+def search_books(query, text, backend=None):
+    terms = search_terms(text)
+    backend = backend or book_search_backend()
+    if not terms or backend == 'like':
+        return like_search(query, text)
+    if backend == 'postgres':
+        document = db.literal_column(f'({BOOK_TSVECTOR_SQL})')
+        tsquery = db.func.to_tsquery('simple', ' & '.join(f'{t}:*' for t in terms))
+        return query.filter(document.op('@@')(tsquery)).order_by(
+            db.func.ts_rank(document, tsquery).desc(), Book.upload_date.desc())
+    fts = db.table('books_fts', db.column('rowid'))
+    return query.join(fts, fts.c.rowid == Book.id).filter(
+        db.text('books_fts MATCH :book_match').bindparams(book_match=' '.join(f'"{t}"*' for t in terms))
+    ).order_by(db.text(BOOK_FTS_RANK), Book.upload_date.desc())
+
+def migrate_db(engine=None):
+    engine = engine or db.engine
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        done = set(conn.execute(db.select(SchemaMigration.version)).scalars())
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            with engine.begin() as conn:
+                step(conn)
+                conn.execute(db.insert(SchemaMigration).values(
+                    version=version, name=name, applied_at=datetime.utcnow()))
+            applied.append(version)
+            print(f"✅ Migration {version}: {name}")
+        except Exception as e:
+            # Another worker may have applied it at the same time
+            with engine.connect() as conn:
+                if conn.execute(db.select(SchemaMigration.version).filter_by(version=version)).first():
+                    continue
+            print(f"❌ Migration {version} ({name}) failed: {e}")
+            raise
+    return applied
+
+# The query shapes the public pages and admin analytics depend on. They select
+# a few columns every schema version has, so `db-upgrade --report` can explain
+# them against a database that has not been migrated yet.
+def hot_queries():
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    return {
+        'home notices': db.select(Notice.id, Notice.title).filter_by(is_active=True)
+                          .order_by(Notice.post_date.desc()).limit(5),
+        'notices page': db.select(Notice.id, Notice.title).filter_by(is_active=True).order_by(Notice.post_date.desc()),
+        'library': db.select(Book.id, Book.title).filter_by(is_active=True).order_by(Book.upload_date.desc()),
+        'results': db.select(Result.id, Result.title).filter_by(is_active=True).order_by(Result.upload_date.desc()),
+        'gallery': db.select(Gallery.id, Gallery.title).filter_by(is_active=True).order_by(Gallery.upload_date.desc()),
+        'gallery category': db.select(Gallery.id, Gallery.title).filter_by(is_active=True, category='Campus')
+                              .order_by(Gallery.upload_date.desc()),
+        'visitor dedupe': db.select(Visitor.ip_address, Visitor.page, Visitor.date_only)
+                            .filter(Visitor.date_only.in_([today]), Visitor.ip_address.in_(['127.0.0.1'])),
+        'unique today': db.select(db.func.count(db.distinct(Visitor.ip_address))).filter_by(date_only=today),
+        'recent visitors': db.select(Visitor.id, Visitor.page, Visitor.ip_address)
+                             .order_by(Visitor.visit_date.desc()).limit(50),
+        'unread messages': db.select(db.func.count()).select_from(ContactMessage).filter_by(is_read=False),
+        'messages': db.select(ContactMessage.id, ContactMessage.subject).order_by(ContactMessage.date.desc()),
+    }
+
+def explain_hot_queries(engine=None):
+    engine = engine or db.engine
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    plans = {}
+    with engine.connect() as conn:
+        for name, stmt in hot_queries().items():
+            sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+            rows = conn.exec_driver_sql(prefix + sql).fetchall()
+            plans[name] = [str(row[-1]) for row in rows]
+    return plans
 
 def init_db():
     with app.app_context():
         try:
             db.create_all()
+            migrate_db()
             print("✅ Tables created!")
 
+            # Existing deployments: fill the traffic rollup once from raw visitor rows
+            if not VisitorDailyStat.query.first() and Visitor.query.first():
+                print(f"✅ Traffic rollup backfilled ({rebuild_daily_stats()} rows)")
+            if not VisitorSketch.query.first() and Visitor.query.first():
+                print(f"✅ Unique-visitor sketches built from {rebuild_visitor_sketches()} rows")
+
             if not Admin.query.filter_by(username='admin').first():
                 db.session.add(Admin(username='admin',
                     password_hash=generate_password_hash('admin123'),
@@ -327,11 +2071,838 @@ def init_db():
             print(f"❌ DB Error: {e}")
             try: db.session.rollback()
             except: pass
+            raise
+
+# =================== STARTUP ===================
+# Importing the app touches no database. Schema creation, migrations and seed
+# data run once per deploy in bootstrap_db() ('flask bootstrap', or the
+# on_starting hook in gunicorn.conf.py) under an exclusive lock. Each process
+# then only compares schema_migrations with the newest migration before its
+# first request; a process that finds an older schema bootstraps it itself
+# (under the same lock) unless AUTO_BOOTSTRAP=0, in which case it answers 503.
+# A failed bootstrap raises: the deploy stops, and a worker answers 503 until
+# a later request finds the schema current.
+AUTO_BOOTSTRAP = os.environ.get('AUTO_BOOTSTRAP', '1') == '1'
+SCHEMA_VERSION = max(version for version, _, _ in MIGRATIONS)
+
+_startup = {'import_ms': None, 'schema_check_ms': None, 'bootstrap_ms': None, 'ready': False}
+_startup_lock = threading.Lock()
+
+def schema_version():
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(db.select(db.func.max(SchemaMigration.version))).scalar() or 0
+    except Exception:
+        return 0   # no schema_migrations table yet
+
+def bootstrap_db():
+    print(f"\n{'='*50}\n🎓 Chandrika Jain Degree Mahavidyalaya\n📍 Borda, Kalahandi\n💾 {STORAGE_TYPE}\n{'='*50}\n")
+    start = time.perf_counter()
+    with app.app_context():
+        try:
+            with exclusive_lock('bootstrap'):
+                init_db()
+            version = schema_version()
+        finally:
+            db.session.remove()
+            db.engine.dispose()   # gunicorn forks workers after this; don't share its connections
+    _startup['bootstrap_ms'] = (time.perf_counter() - start) * 1000
+    print(f"✅ Bootstrap done in {_startup['bootstrap_ms']:.0f}ms (schema v{version})")
+    return version
+
+@app.before_request
+def _check_schema():
+    if _startup['ready']:
+        return
+    with _startup_lock:
+        if _startup['ready']:
+            return
+        start = time.perf_counter()
+        version = schema_version()
+        _startup['schema_check_ms'] = (time.perf_counter() - start) * 1000
+        if version < SCHEMA_VERSION:
+            if not AUTO_BOOTSTRAP:
+                print(f"❌ Schema v{version}, this code needs v{SCHEMA_VERSION}: run 'flask bootstrap'")
+                return 'Service Unavailable', 503
+            print(f"⚠️ Schema v{version} < v{SCHEMA_VERSION}, bootstrapping from pid {os.getpid()}")
+            try:
+                version = bootstrap_db()
+            except Exception:
+                return 'Service Unavailable', 503   # init_db() printed the error; the next request retries
+            if version < SCHEMA_VERSION:
+                print(f"❌ Schema still v{version} after bootstrapping, this code needs v{SCHEMA_VERSION}")
+                return 'Service Unavailable', 503
+        _startup['ready'] = True
+        print(f"✅ Worker {os.getpid()} ready: app imported in {_startup['import_ms']:.0f}ms, "
+              f"schema checked in {_startup['schema_check_ms']:.1f}ms")
+
+# =================== BULK IMPORT ===================
+# CSV or JSONL rows are parsed one at a time from the upload stream, validated,
+# given their stored Drive link variants, and inserted IMPORT_BATCH_SIZE rows
+# per executemany of one compiled INSERT (the driver batches the rows; building
+# a fresh multi-row VALUES statement per batch costs more to compile than it
+# saves), committing every IMPORT_CHUNK_SIZE rows. Memory stays
+# flat whatever the file size; the report keeps the first IMPORT_MAX_ERRORS
+# row errors. A chunk the database rejects is retried row by row so the
+# report names the offending lines.
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 500))
+
+IMPORT_KINDS = {
+    'books': {'model': Book, 'required': ('title', 'author', 'subject', 'drive_link'),
+              'optional': ('semester', 'course', 'description'), 'links': ('drive_link',),
+              'derive': lambda row: drive_link_fields(row['drive_link'])},
+    'results': {'model': Result, 'required': ('title', 'drive_link'),
+                'optional': ('exam_type', 'course', 'semester', 'year'), 'links': ('drive_link',),
+                'derive': lambda row: drive_link_fields(row['drive_link'])},
+    'faculty': {'model': Faculty, 'required': ('name',),
+                'optional': ('designation', 'department', 'qualification', 'email', 'phone', 'photo_url',
+                             'experience', 'specialization'), 'links': ('photo_url',),
+                'derive': lambda row: {'photo_url': convert_drive_image(row['photo_url'])}},
+    'courses': {'model': Course, 'required': ('name',),
+                'optional': ('code', 'duration', 'description', 'eligibility', 'seats', 'department'), 'links': (),
+                'derive': lambda row: {'seats': int(row['seats'] or 0)}},
+}
+
+def import_format(filename, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if filename.lower().rsplit('.', 1)[-1] in ('jsonl', 'ndjson', 'json') else 'csv'
+
+# Yields (line number, row dict or None, parse error or None) without reading ahead
+def iter_import_rows(stream, fmt):
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f'invalid JSON: {e}'
+            continue
+        yield (line_no, row, None) if isinstance(row, dict) else (line_no, None, 'expected a JSON object')
+
+def _validate_import_row(spec, raw):
+    row = {str(k).strip().lower().replace(' ', '_'): '' if v is None else str(v).strip()
+           for k, v in raw.items() if k}
+    values = {name: row.get(name, '') for name in spec['required'] + spec['optional']}
+    errors = [f'{name} is required' for name in spec['required'] if not values[name]]
+    errors += [f'{name} is not a link' for name in spec['links']
+               if values[name] and not values[name].startswith(('http://', 'https://'))]
+    if values.get('seats') and not values['seats'].isdigit():
+        errors.append('seats must be a whole number')
+    if errors:
+        return None, errors
+    values.update(spec['derive'](values))
+    columns = spec['model'].__table__.c
+    errors = [f'{name} is longer than {columns[name].type.length} characters' for name, value in values.items()
+              if isinstance(value, str) and getattr(columns[name].type, 'length', None)
+              and len(value) > columns[name].type.length]
+    return (None, errors) if errors else (values, [])
+
+def _write_import_chunk(model, chunk, report, fail):
+    try:
+        for i in range(0, len(chunk), IMPORT_BATCH_SIZE):
+            db.session.execute(db.insert(model.__table__), [values for _, values in chunk[i:i + IMPORT_BATCH_SIZE]])
+        bump_content_counter(model, len(chunk))
+        note_content_change(model)
+        db.session.commit()
+        report['imported'] += len(chunk)
+    except Exception:
+        db.session.rollback()
+        imported = 0
+        for line, values in chunk:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(db.insert(model.__table__), [values])
+                imported += 1
+            except Exception as e:
+                fail(line, [str(getattr(e, 'orig', e)).splitlines()[0][:200]])
+        bump_content_counter(model, imported)
+        note_content_change(model)
+        db.session.commit()
+        report['imported'] += imported
+
+def import_rows(kind, stream, fmt='csv', uploaded_by='import', dry_run=False, on_error=None):
+    spec = IMPORT_KINDS[kind]
+    columns = spec['model'].__table__.c
+    defaults = {k: v for k, v in {'uploaded_by': uploaded_by, 'upload_date': datetime.utcnow(),
+                                  'is_active': True}.items() if k in columns}
+    report = {'kind': kind, 'format': fmt, 'dry_run': dry_run, 'rows': 0, 'imported': 0, 'failed': 0,
+              'errors': [], 'fatal': None}
+    def fail(line, errors):
+        report['failed'] += 1
+        if on_error:
+            on_error(line, errors)
+        if len(report['errors']) < IMPORT_MAX_ERRORS:
+            report['errors'].append({'line': line, 'errors': errors})
+    start, chunk = time.perf_counter(), []
+    try:
+        for line, raw, error in iter_import_rows(stream, fmt):
+            report['rows'] += 1
+            values, errors = _validate_import_row(spec, raw) if raw is not None else (None, [error])
+            if errors:
+                fail(line, errors)
+            elif dry_run:
+                report['imported'] += 1
+            else:
+                chunk.append((line, dict(values, **defaults)))
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    _write_import_chunk(spec['model'], chunk, report, fail)
+                    chunk = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        report['fatal'] = f'Stopped after {report["rows"]} rows: {e}'
+    if chunk:
+        _write_import_chunk(spec['model'], chunk, report, fail)
+    report['seconds'] = round(time.perf_counter() - start, 2)
+    return report
+
+# =================== EXPORT ===================
+# Contact messages and visitor logs streamed as CSV or NDJSON, optionally
+# gzipped, without loading the result set. PostgreSQL reads through a
+# server-side cursor (stream_results + yield_per); SQLite pages through the
+# primary key EXPORT_CHUNK_SIZE rows at a time, so no read transaction stays
+# open for the whole export. Visitor rows already compacted away are in the
+# monthly NDJSON archives instead.
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def export_filters(args):
+    start, end = args.get('start'), args.get('end')
+    return {'start': datetime.strptime(start, '%Y-%m-%d') if start else None,
+            'end': datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1) if end else None,
+            'page': args.get('page') or None}
+
+def _export_select(kind, start=None, end=None, page=None):
+    if kind == 'messages':
+        m = ContactMessage
+        stmt, id_col, date_col = db.select(m.id, m.date, m.name, m.email, m.phone, m.subject, m.message,
+                                           m.is_read), m.id, m.date
+    else:
+        v = Visitor
+        stmt = db.select(v.id, v.visit_date, v.page, v.ip_address,
+                         db.func.coalesce(UserAgent.value, v.user_agent).label('user_agent')
+                         ).outerjoin(UserAgent, UserAgent.id == v.user_agent_id)
+        id_col, date_col = v.id, v.visit_date
+        if page:
+            stmt = stmt.where(v.page == page)
+    if start:
+        stmt = stmt.where(date_col >= start)
+    if end:
+        stmt = stmt.where(date_col < end)
+    return stmt, id_col
+
+def iter_export_rows(kind, **filters):
+    stmt, id_col = _export_select(kind, **filters)
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            yield from conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE).execute(
+                stmt.order_by(id_col))
+        return
+    last_id = 0
+    while True:
+        with db.engine.connect() as conn:
+            rows = conn.execute(stmt.where(id_col > last_id).order_by(id_col).limit(EXPORT_CHUNK_SIZE)).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+# Spreadsheet apps run cells starting with these as formulas
+def _csv_safe(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+def export_lines(kind, fmt='csv', stats=None, **filters):
+    rows = iter_export_rows(kind, **filters)
+    if fmt == 'ndjson':
+        for row in rows:
+            if stats is not None: stats['rows'] += 1
+            yield json.dumps(row._asdict(), default=lambda v: v.isoformat()) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_export_select(kind)[0].selected_columns.keys())
+    for row in rows:
+        writer.writerow([_csv_safe(v) for v in row])
+        if stats is not None: stats['rows'] += 1
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+# =================== THUMBNAILS ===================
+# Gallery and faculty images are fetched from their source (usually Drive)
+# once through thumb_fetcher, resized to THUMB_WIDTHS and kept in a disk cache
+# shared by all workers. The cache is capped at THUMB_CACHE_MAX_BYTES, and the
+# least recently served files are evicted first. Concurrent misses for one
+# image wait on a single fetch: a thread lock inside the worker and a flock
+# across workers. Thumbnail URLs carry a hash of the source URL, so responses
+# are immutable. Without Pillow the original is cached and served at every
+# width.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+THUMB_WIDTHS = tuple(sorted(int(w) for w in os.environ.get('THUMB_WIDTHS', '160,320,640').split(',')))
+THUMB_DIR = os.environ.get('THUMB_DIR', '/tmp/cjdm-thumbs')
+THUMB_CACHE_MAX_BYTES = int(os.environ.get('THUMB_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+THUMB_SOURCE_MAX_BYTES = int(os.environ.get('THUMB_SOURCE_MAX_BYTES', 15 * 1024 * 1024))
+THUMB_FETCH_TIMEOUT = float(os.environ.get('THUMB_FETCH_TIMEOUT', 10))
+THUMB_RETRY_SECONDS = 60   # after a failed fetch, send browsers to the source instead of retrying
+THUMB_MAX_AGE = 365 * 24 * 3600
+THUMB_SOURCES = {'gallery': (Gallery, 'image_url'), 'faculty': (Faculty, 'photo_url')}
+
+class ThumbnailError(Exception):
+    pass
+
+def http_fetch(url):
+    req = urllib.request.Request(url, headers={'User-Agent': 'cjdm-thumbnailer/1.0'})
+    with urllib.request.urlopen(req, timeout=THUMB_FETCH_TIMEOUT) as response:
+        data = response.read(THUMB_SOURCE_MAX_BYTES + 1)
+    if len(data) > THUMB_SOURCE_MAX_BYTES:
+        raise ThumbnailError(f'source larger than {THUMB_SOURCE_MAX_BYTES} bytes')
+    return data
+
+# Any callable url -> bytes will do (a Drive API client, a stub in benchmarks)
+thumb_fetcher = http_fetch
+
+_thumb_stats = {'hits': 0, 'misses': 0, 'fetches': 0, 'errors': 0, 'evicted': 0}
+_thumb_failures = {}   # source hash -> monotonic time of the last failed fetch
+_thumb_locks = {}
+_thumb_locks_lock = threading.Lock()
+
+# Drive serves an HTML interstitial instead of the file now and then
+def image_type(data):
+    if data[:3] == b'\xff\xd8\xff': return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n': return 'image/png'
+    if data[:4] == b'GIF8': return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP': return 'image/webp'
+    raise ThumbnailError('source is not a JPEG, PNG, GIF or WebP image')
+
+def thumb_version(url):
+    return hashlib.sha1(url.encode()).hexdigest()[:16]
+
+def thumb_width(width):
+    return next((w for w in THUMB_WIDTHS if w >= width), THUMB_WIDTHS[-1])
+
+def thumb_url(kind, obj, width):
+    url = getattr(obj, THUMB_SOURCES[kind][1])
+    if not url:
+        return ''
+    return url_for('thumbnail_image', kind=kind, id=obj.id, width=thumb_width(width), v=thumb_version(url))
+
+def _thumb_path(name):
+    return os.path.join(THUMB_DIR, name)
+
+def _thumb_write(name, data):
+    tmp = _thumb_path(f'.{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp, 'wb') as f: f.write(data)
+    os.replace(tmp, _thumb_path(name))
+
+@contextmanager
+def _thumb_lock(source):
+    with _thumb_locks_lock:
+        lock = _thumb_locks.setdefault(source, threading.Lock())
+    with lock:
+        path = _thumb_path(f'.{source}.lock')
+        while True:
+            handle = open(path, 'a')
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:   # prune_thumbnails may have unlinked it while we waited; lock the file now at `path`
+                if os.fstat(handle.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            handle.close()
+        with handle:
+            yield
+
+def _resize(data, width):
+    if Image is None:
+        return data
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width <= width:
+            return data
+        img.thumbnail((width, width * 4))
+        out = io.BytesIO()
+        if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+            img.convert('RGBA').save(out, 'PNG', optimize=True)
+        else:
+            img.convert('RGB').save(out, 'JPEG', quality=82, optimize=True, progressive=True)
+        return out.getvalue()
+
+def _thumb_hit(path):
+    try: st = os.stat(path)
+    except FileNotFoundError: return False
+    if time.time() - st.st_mtime > 60:
+        os.utime(path)   # mtime is the LRU clock; touched at most once a minute
+    _thumb_stats['hits'] += 1
+    return True
+
+# Path of the cached `width` thumbnail of source_url, fetching it if needed
+def thumbnail(source_url, width):
+    source = thumb_version(source_url)
+    name = f'{source}-{width}'
+    if _thumb_hit(_thumb_path(name)):
+        return _thumb_path(name)
+    failed = _thumb_failures.get(source)
+    if failed and time.monotonic() - failed < THUMB_RETRY_SECONDS:
+        raise ThumbnailError('source failed recently')
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    with _thumb_lock(source):
+        if _thumb_hit(_thumb_path(name)):   # another thread or worker just made it
+            return _thumb_path(name)
+        _thumb_stats['misses'] += 1
+        try:
+            try:
+                with open(_thumb_path(f'{source}-orig'), 'rb') as f: data = f.read()
+            except FileNotFoundError:
+                _thumb_stats['fetches'] += 1
+                data = thumb_fetcher(source_url)
+                image_type(data)
+                _thumb_write(f'{source}-orig', data)
+            _thumb_write(name, _resize(data, width))
+        except Exception as e:
+            _thumb_stats['errors'] += 1
+            _thumb_failures[source] = time.monotonic()
+            raise ThumbnailError(str(e)) from e
+    _thumb_failures.pop(source, None)
+    prune_thumbnails()
+    return _thumb_path(name)
+
+def prune_thumbnails(max_bytes=None):
+    max_bytes = THUMB_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    files, locks = [], []
+    for entry in os.scandir(THUMB_DIR):
+        if entry.name.endswith('.lock'):
+            locks.append(entry)
+            continue
+        if entry.name.startswith('.'):
+            continue
+        try:
+            st = entry.stat()
+            files.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+    total = sum(size for _, size, _ in files)
+    removed, kept = 0, []
+    for _, size, path in sorted(files):
+        if total <= max_bytes * (0.9 if removed else 1):   # headroom so the next few misses don't prune again
+            kept.append(path)
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except FileNotFoundError:
+            pass
+    _thumb_stats['evicted'] += removed
+    # Lock files of sources with nothing cached any more (evicted, or never fetched)
+    live = {os.path.basename(path).rsplit('-', 1)[0] for path in kept}
+    for entry in locks:
+        if entry.name[1:-len('.lock')] in live:
+            continue
+        with open(entry.path, 'a') as handle:
+            try: fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError: continue   # a fetch is under way
+            try: os.remove(entry.path)
+            except FileNotFoundError: pass
+    return removed
+
+# =================== LOGIN THROTTLING ===================
+# Token buckets per client IP and per username, kept in a small SQLite file
+# that every worker on the host shares, so a burst of login POSTs is turned
+# away before any password hash is checked. From LOGIN_LOCKOUT_AFTER failures
+# on, each failure locks both keys for twice as long as the last, up to
+# LOGIN_LOCKOUT_MAX; a successful login clears both. If the store cannot be
+# used, logins are let through rather than locking everyone out.
+LOGIN_THROTTLE_DB = os.environ.get('LOGIN_THROTTLE_DB', '/tmp/cjdm-login-throttle.db')
+LOGIN_LIMITS = {   # key kind -> (burst, sustained attempts per minute)
+    'ip': (int(os.environ.get('LOGIN_IP_BURST', 10)), float(os.environ.get('LOGIN_IP_PER_MINUTE', 10))),
+    'user': (int(os.environ.get('LOGIN_USER_BURST', 5)), float(os.environ.get('LOGIN_USER_PER_MINUTE', 5))),
+}
+LOGIN_LOCKOUT_AFTER = int(os.environ.get('LOGIN_LOCKOUT_AFTER', 5))
+LOGIN_LOCKOUT_BASE = int(os.environ.get('LOGIN_LOCKOUT_BASE', 30))
+LOGIN_LOCKOUT_MAX = int(os.environ.get('LOGIN_LOCKOUT_MAX', 900))
+LOGIN_IDLE_SECONDS = 24 * 3600   # buckets untouched this long are dropped, forgetting old failures
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))   # Render adds one X-Forwarded-For entry
+
+_login_store = {'pid': None, 'conn': None, 'writes': 0}
+_login_store_lock = threading.Lock()
+_login_stats = {'allowed': 0, 'throttled': 0, 'locked': 0, 'failed': 0, 'succeeded': 0, 'lockouts': 0}
+
+# Entries left of the ones our proxies appended are whatever the client sent
+def client_ip():
+    hops = [h.strip() for h in request.headers.get('X-Forwarded-For', '').split(',') if h.strip()]
+    if TRUSTED_PROXY_HOPS and hops:
+        return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return request.remote_addr or ''
+
+def _login_db():
+    if _login_store['pid'] != os.getpid():   # never share a connection across a fork
+        conn = sqlite3.connect(LOGIN_THROTTLE_DB, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS login_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                     'updated REAL NOT NULL, failures INTEGER NOT NULL DEFAULT 0, locked_until REAL NOT NULL DEFAULT 0)')
+        conn.execute('CREATE TABLE IF NOT EXISTS login_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        _login_store.update(pid=os.getpid(), conn=conn)
+    return _login_store['conn']
+
+@contextmanager
+def _login_transaction():
+    with _login_store_lock:
+        conn = _login_db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+def _login_count(conn, *names):
+    for name in names:
+        _login_stats[name] += 1
+        conn.execute('INSERT INTO login_counters (name, value) VALUES (?, 1) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+def _login_keys(ip, username):
+    keys = [('ip', f'ip:{ip}')]
+    if username.strip():
+        keys.append(('user', f'user:{username.strip().lower()}'))
+    return keys
+
+# Seconds the client must wait, or 0 after taking a token from each bucket
+def login_throttle(ip, username, now=None):
+    now = time.time() if now is None else now
+    try:
+        with _login_transaction() as conn:
+            wait, result, buckets = 0, 'allowed', []
+            for kind, key in _login_keys(ip, username):
+                burst, per_minute = LOGIN_LIMITS[kind]
+                row = conn.execute('SELECT tokens, updated, locked_until FROM login_buckets WHERE key = ?',
+                                   (key,)).fetchone()
+                tokens, updated, locked_until = row or (burst, now, 0)
+                tokens = min(burst, tokens + (now - updated) * per_minute / 60)
+                if locked_until > now:
+                    wait, result = max(wait, locked_until - now), 'locked'
+                elif tokens < 1:
+                    wait = max(wait, (1 - tokens) * 60 / per_minute)
+                    result = 'locked' if result == 'locked' else 'throttled'
+                buckets.append((key, tokens))
+            for key, tokens in buckets:
+                conn.execute('INSERT INTO login_buckets (key, tokens, updated) VALUES (?, ?, ?) ON CONFLICT(key) '
+                             'DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                             (key, tokens if wait else tokens - 1, now))
+            _login_count(conn, result)
+        return wait
+    except sqlite3.Error as e:
+        print(f"⚠️ Login throttle unavailable: {e}")
+        return 0
+
+def login_result(ip, username, success, now=None):
+    now = time.time() if now is None else now
+    try:
+        with _login_transaction() as conn:
+            lockout = False
+            for kind, key in _login_keys(ip, username):
+                if success:
+                    conn.execute('UPDATE login_buckets SET failures = 0, locked_until = 0 WHERE key = ?', (key,))
+                    continue
+                failures = (conn.execute('SELECT failures FROM login_buckets WHERE key = ?',
+                                         (key,)).fetchone() or (0,))[0] + 1
+                locked_until = 0
+                if failures >= LOGIN_LOCKOUT_AFTER:
+                    step = min(failures - LOGIN_LOCKOUT_AFTER, 16)
+                    locked_until, lockout = now + min(LOGIN_LOCKOUT_MAX, LOGIN_LOCKOUT_BASE * 2 ** step), True
+                conn.execute('UPDATE login_buckets SET failures = ?, locked_until = ? WHERE key = ?',
+                             (failures, locked_until, key))
+            _login_count(conn, *(['succeeded'] if success else ['failed'] + ['lockouts'] * lockout))
+            _login_store['writes'] += 1
+            if _login_store['writes'] % 100 == 0:
+                conn.execute('DELETE FROM login_buckets WHERE updated < ? AND locked_until < ?',
+                             (now - LOGIN_IDLE_SECONDS, now))
+    except sqlite3.Error as e:
+        print(f"⚠️ Login throttle unavailable: {e}")
+
+def login_throttle_report(now=None):
+    now = time.time() if now is None else now
+    try:
+        with _login_store_lock:
+            conn = _login_db()
+            counters = dict(conn.execute('SELECT name, value FROM login_counters').fetchall())
+            locked = conn.execute('SELECT key, failures, locked_until - ? FROM login_buckets WHERE locked_until > ? '
+                                  'ORDER BY locked_until DESC LIMIT 20', (now, now)).fetchall()
+    except sqlite3.Error as e:
+        print(f"⚠️ Login throttle unavailable: {e}")
+        counters, locked = {}, []
+    return {'counters': {name: counters.get(name, 0) for name in _login_stats}, 'locked': locked}
+
+def reset_login_throttle(key=None):
+    with _login_transaction() as conn:
+        if key:
+            return conn.execute('DELETE FROM login_buckets WHERE key = ?', (key,)).rowcount
+        conn.execute('DELETE FROM login_counters')
+        return conn.execute('DELETE FROM login_buckets').rowcount
+
+# =================== SITEMAP AND FEED ===================
+# /sitemap.xml and /feed.atom are rendered once and stored in
+# generated_documents with their ETag, so polling crawlers and feed readers
+# get a stored blob (or a 304) instead of a query and a template render.
+# A commit touching a document's source tables drops it on a separate
+# connection and, inside a request, rebuilds it once the view is done; after
+# CLI writes the next GET rebuilds it.
+SITE_URL = os.environ.get('SITE_URL', '').rstrip('/')   # default: the host of the request that builds it
+FEED_SIZE = int(os.environ.get('FEED_SIZE', 50))
+
+class GeneratedDocument(db.Model):
+    __tablename__ = 'generated_documents'
+    name = db.Column(db.String(40), primary_key=True)
+    body = db.Column(db.LargeBinary, nullable=False)
+    etag = db.Column(db.String(40), nullable=False)
+    built_at = db.Column(db.DateTime, nullable=False)
+
+# endpoint, source model, date column, changefreq
+SITEMAP_PAGES = [('index', Notice, 'post_date', 'daily'), ('about', None, None, 'monthly'),
+                 ('courses', Course, None, 'monthly'), ('faculty', Faculty, None, 'monthly'),
+                 ('library', Book, 'upload_date', 'weekly'), ('results', Result, 'upload_date', 'weekly'),
+                 ('notices', Notice, 'post_date', 'daily'), ('gallery', Gallery, 'upload_date', 'weekly'),
+                 ('contact', None, None, 'yearly')]
+
+def _build_sitemap(base):
+    dated = {m: db.select(db.func.max(getattr(m, col))).where(m.is_active == True).scalar_subquery()
+             for _, m, col, _ in SITEMAP_PAGES if col}
+    newest = dict(zip(dated, db.session.execute(db.select(*dated.values())).one()))
+    pages = [{'path': url_for(endpoint), 'lastmod': newest.get(model), 'changefreq': freq}
+             for endpoint, model, _, freq in SITEMAP_PAGES]
+    return render_template('sitemap.xml', base=base, pages=pages)
+
+def _build_feed(base):
+    notices = Notice.query.filter_by(is_active=True).order_by(Notice.post_date.desc()).limit(FEED_SIZE).all()
+    results = Result.query.filter_by(is_active=True).order_by(Result.upload_date.desc()).limit(FEED_SIZE).all()
+    entries = [{'kind': 'notices', 'id': n.id, 'title': n.title, 'updated': n.post_date,
+                'category': n.category or 'General', 'summary': n.content[:500],
+                'link': f"{base}{url_for('notices')}#notice-{n.id}"} for n in notices]
+    entries += [{'kind': 'results', 'id': r.id, 'title': r.title, 'updated': r.upload_date, 'category': 'Result',
+                 'summary': ' '.join(filter(None, [r.course, r.semester and f'Semester {r.semester}', r.year,
+                                                   r.exam_type])),
+                 'link': r.view_link or r.drive_link} for r in results]
+    entries = sorted(entries, key=lambda e: e['updated'], reverse=True)[:FEED_SIZE]
+    updated = entries[0]['updated'] if entries else datetime(2000, 1, 1)
+    return render_template('feed.atom.xml', base=base, entries=entries, updated=updated)
+
+DOCUMENTS = {
+    'sitemap.xml': {'sources': {m.__tablename__ for _, m, col, _ in SITEMAP_PAGES if col},
+                    'mimetype': 'application/xml', 'build': _build_sitemap},
+    'feed.atom': {'sources': {Notice.__tablename__, Result.__tablename__},
+                  'mimetype': 'application/atom+xml', 'build': _build_feed},
+}
+_documents = {}   # name -> (etag, body, encoded variants) last read or built by this process
+
+def refresh_documents(names):
+    base = SITE_URL or request.url_root.rstrip('/')
+    for name in names:
+        body = DOCUMENTS[name]['build'](base).encode()
+        etag = hashlib.sha1(body).hexdigest()
+        stmt = upsert_insert(GeneratedDocument).values(name=name, body=body, etag=etag, built_at=datetime.utcnow())
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={
+            'body': stmt.excluded.body, 'etag': stmt.excluded.etag, 'built_at': stmt.excluded.built_at}))
+        _documents[name] = (etag, body, precompress(body, DOCUMENTS[name]['mimetype']))
+    db.session.commit()
+
+@on_content_change
+def _refresh_stale_documents(tables):
+    names = {name for name, doc in DOCUMENTS.items() if doc['sources'] & tables}
+    if not names:
+        return
+    with db.engine.begin() as conn:   # the committed session cannot run more SQL from here
+        table = GeneratedDocument.__table__
+        conn.execute(db.delete(table).where(table.c.name.in_(names)))
+    if has_request_context():
+        if 'stale_documents' not in g:
+            # Bound here: a bootstrap inside the request runs in its own app context and g
+            stale = g.stale_documents = set()
+            @after_this_request
+            def _rebuild(response):
+                try: refresh_documents(sorted(stale))
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Sitemap/feed rebuild error: {e}")
+                return response
+        g.stale_documents |= names
+
+def serve_document(name):
+    row = db.session.execute(db.select(GeneratedDocument.etag, GeneratedDocument.built_at).filter_by(name=name)).first()
+    if row is None:
+        refresh_documents([name])
+        row = db.session.execute(db.select(GeneratedDocument.etag, GeneratedDocument.built_at)
+                                 .filter_by(name=name)).one()
+    response = app.response_class(mimetype=DOCUMENTS[name]['mimetype'])
+    response.set_etag(row.etag)
+    response.last_modified = row.built_at
+    response.headers['Cache-Control'] = 'no-cache'
+    if not is_resource_modified(request.environ, etag=row.etag, last_modified=row.built_at):
+        response.status_code = 304
+        return response
+    cached = _documents.get(name)
+    if not cached or cached[0] != row.etag:
+        body = db.session.execute(db.select(GeneratedDocument.body).filter_by(name=name, etag=row.etag)).scalar()
+        if body is None:   # rebuilt between the two reads
+            return serve_document(name)
+        cached = _documents[name] = (row.etag, body, precompress(body, DOCUMENTS[name]['mimetype']))
+    encoding = pick_encoding(cached[2])
+    response.set_data(cached[2][encoding] if encoding else cached[1])
+    return send_encoded(response, encoding, len(cached[1])) if encoding else response
+
+# =================== STATIC ASSETS ===================
+# The site's own CSS and JS live in static/ and are served as bundles named
+# after a hash of their content, with a year-long immutable cache lifetime:
+# an edit produces a new name. Each bundle and its gzip and brotli variants
+# are written to ASSET_DIR once at boot (or by `flask build-assets`), and the
+# asset route sends the variant the client accepts without compressing
+# anything per request.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_DIR = os.environ.get('ASSET_DIR', '/tmp/cjdm-assets')
+ASSET_BUNDLES = {'site.css': ['css/site.css'], 'site.js': ['js/site.js']}
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_MIMETYPES = {'.css': 'text/css', '.js': 'text/javascript'}
+ASSET_ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+_ASSET_NAME = re.compile(r'^[\w-]+\.[0-9a-f]{12}\.(css|js)$')
+_asset_manifest = {}   # bundle -> fingerprinted file name
+
+def build_assets(directory=None):
+    directory = directory or ASSET_DIR
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    for bundle, sources in ASSET_BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(app.static_folder, source), 'rb') as f: parts.append(f.read())
+        body = b'\n'.join(parts)
+        stem, ext = os.path.splitext(bundle)
+        name = f'{stem}.{hashlib.sha1(body).hexdigest()[:12]}{ext}'
+        variants = {'': lambda: body, '.gz': lambda: gzip.compress(body, 9, mtime=0)}
+        if brotli:
+            variants['.br'] = lambda: brotli.compress(body, quality=11)
+        for suffix, encode in variants.items():
+            path = os.path.join(directory, name + suffix)
+            if not os.path.exists(path):   # same name, same bytes: another worker or boot already wrote it
+                tmp = f'{path}.{os.getpid()}.tmp'
+                with open(tmp, 'wb') as f: f.write(encode())
+                os.replace(tmp, path)
+        manifest[bundle] = name
+    return manifest
+
+try:
+    _asset_manifest.update(build_assets())
+except Exception as e:
+    print(f"❌ Asset build error, serving the unbundled static files: {e}")
+
+def asset_url(bundle):
+    name = _asset_manifest.get(bundle)
+    return url_for('asset', name=name) if name else url_for('static', filename=ASSET_BUNDLES[bundle][0])
+
+def send_asset(name):
+    path = os.path.join(ASSET_DIR, name)
+    if not _ASSET_NAME.match(name) or not os.path.exists(path):
+        return '', 404
+    encoding = request.accept_encodings.best_match(
+        [e for e, suffix in ASSET_ENCODINGS.items() if os.path.exists(path + suffix)])
+    response = send_file(path + ASSET_ENCODINGS.get(encoding, ''), mimetype=ASSET_MIMETYPES[os.path.splitext(name)[1]],
+                         max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+# =================== RESPONSE COMPRESSION ===================
+# Dynamic text responses (pages, JSON, XML, CSV) are compressed with brotli or
+# gzip, whichever Accept-Encoding prefers. Bodies under COMPRESS_MIN_BYTES
+# go out as they are, since the framing would cost more than it saves.
+# Streamed and file responses (exports, thumbnails, assets) are left alone;
+# they handle their own encoding. A strong ETag becomes weak, since it
+# was computed over the uncompressed bytes.
+COMPRESS = os.environ.get('COMPRESS', 'on') != 'off'
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+COMPRESS_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript', 'application/json',
+                      'application/xml', 'application/atom+xml', 'image/svg+xml'}
+COMPRESS_ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+_compress_stats = {'br': 0, 'gzip': 0, 'identity': 0}
+_compress_bytes = {'in': 0, 'out': 0}
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, COMPRESS_GZIP_LEVEL, mtime=0)
+
+# Encoded variants stored next to a cached or pre-rendered page, so its hits
+# are not compressed again on every request
+def precompress(body, mimetype):
+    if not COMPRESS or mimetype not in COMPRESS_MIMETYPES or len(body) < COMPRESS_MIN_BYTES:
+        return {}
+    return {encoding: compress_body(body, encoding) for encoding in COMPRESS_ENCODINGS}
+
+def pick_encoding(available):
+    return request.accept_encodings.best_match([e for e in COMPRESS_ENCODINGS if e in available]) \
+        if COMPRESS else None
+
+def send_encoded(response, encoding, size):
+    response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:   # computed over the identity bytes
+        response.set_etag(etag, weak=True)
+    _compress_stats[encoding] += 1
+    _compress_bytes['in'] += size
+    _compress_bytes['out'] += response.content_length or 0
+    return response
+
+@app.after_request
+def _compress_response(response):
+    if not COMPRESS or response.mimetype not in COMPRESS_MIMETYPES or response.direct_passthrough \
+            or response.is_streamed or response.content_encoding or response.status_code in (204, 206, 304):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if not encoding or len(body) < COMPRESS_MIN_BYTES:
+        _compress_stats['identity'] += 1
+        return response
+    response.set_data(compress_body(body, encoding))
+    return send_encoded(response, encoding, len(body))
 
 # =================== PUBLIC ROUTES ===================
 @app.route('/')
+@page_view('home', Notice, Course, Gallery)
 def index():
-    track_visitor('home')
     try:
         notices = Notice.query.filter_by(is_active=True).order_by(Notice.post_date.desc()).limit(5).all()
         courses = Course.query.filter_by(is_active=True).all()
@@ -341,20 +2912,20 @@ def index():
     return render_template('index.html', notices=notices, courses=courses, gallery=gallery)
 
 @app.route('/about')
+@page_view('about')
 def about():
-    track_visitor('about')
     return render_template('about.html')
 
 @app.route('/courses')
+@page_view('courses', Course)
 def courses():
-    track_visitor('courses')
     try: all_courses = Course.query.filter_by(is_active=True).all()
     except: all_courses = []
     return render_template('courses.html', courses=all_courses)
 
 @app.route('/faculty')
+@page_view('faculty', Faculty)
 def faculty():
-    track_visitor('faculty')
     try:
         all_faculty = Faculty.query.filter_by(is_active=True).all()
         departments = [d[0] for d in db.session.query(Faculty.department).filter_by(is_active=True).distinct().all() if d[0]]
@@ -362,8 +2933,9 @@ def faculty():
     return render_template('faculty.html', faculty=all_faculty, departments=departments)
 
 @app.route('/library')
+@page_view('library', Book, cache=False,
+           params=('subject', 'course', 'semester', 'search') + PAGINATION_PARAMS)
 def library():
-    track_visitor('library')
     try:
         subject = request.args.get('subject', '')
         course = request.args.get('course', '')
@@ -373,41 +2945,71 @@ def library():
         if subject: query = query.filter(Book.subject.ilike(f'%{subject}%'))
         if course: query = query.filter(Book.course.ilike(f'%{course}%'))
         if semester: query = query.filter_by(semester=semester)
-        if search:
-            query = query.filter(db.or_(Book.title.ilike(f'%{search}%'),
-                Book.author.ilike(f'%{search}%'), Book.subject.ilike(f'%{search}%')))
-        books = query.order_by(Book.upload_date.desc()).all()
+        if search: books, page = offset_paginate(search_books(query, search))
+        else: books, page = keyset_paginate(query, Book.upload_date, Book.id)
         subjects = [s[0] for s in db.session.query(Book.subject).filter_by(is_active=True).distinct().all() if s[0]]
         courses_list = [c[0] for c in db.session.query(Book.course).filter_by(is_active=True).distinct().all() if c[0]]
-    except: books, subjects, courses_list = [], [], []
-    return render_template('library.html', books=books, subjects=subjects,
-                         courses=courses_list, convert_drive_link=convert_drive_link)
+    except: books, subjects, courses_list, page = [], [], [], None
+    return render_template('library.html', books=books, subjects=subjects, page=page,
+                         courses=courses_list)
 
 @app.route('/results')
+@page_view('results', Result, params=PAGINATION_PARAMS)
 def results():
-    track_visitor('results')
-    try: all_results = Result.query.filter_by(is_active=True).order_by(Result.upload_date.desc()).all()
-    except: all_results = []
-    return render_template('results.html', results=all_results, convert_drive_link=convert_drive_link)
+    try: all_results, page = keyset_paginate(Result.query.filter_by(is_active=True), Result.upload_date, Result.id)
+    except: all_results, page = [], None
+    return render_template('results.html', results=all_results, page=page)
+
+@app.route('/thumb/<kind>/<int:id>/<int:width>')
+def thumbnail_image(kind, id, width):
+    if kind not in THUMB_SOURCES or width not in THUMB_WIDTHS:
+        return '', 404
+    model, column = THUMB_SOURCES[kind]
+    url = db.session.execute(db.select(getattr(model, column))
+                             .where(model.id == id, model.is_active == True)).scalar()
+    if not url:   # unknown, removed or soft-deleted: nothing to proxy or redirect to
+        return '', 404
+    try:
+        path = thumbnail(url, width)
+    except ThumbnailError as e:
+        print(f"⚠️ Thumbnail {kind}/{id}: {e}")
+        return redirect(url)
+    with open(path, 'rb') as f:
+        mimetype = image_type(f.read(12))
+    response = send_file(path, mimetype=mimetype, max_age=THUMB_MAX_AGE, etag=f'{thumb_version(url)}-{width}')
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/assets/<name>')
+def asset(name):
+    return send_asset(name)
 
 @app.route('/gallery')
+@page_view('gallery', Gallery, params=('category',) + PAGINATION_PARAMS)
 def gallery():
-    track_visitor('gallery')
     try:
         category = request.args.get('category', '')
         query = Gallery.query.filter_by(is_active=True)
         if category: query = query.filter_by(category=category)
-        images = query.order_by(Gallery.upload_date.desc()).all()
+        images, page = keyset_paginate(query, Gallery.upload_date, Gallery.id)
         categories = [c[0] for c in db.session.query(Gallery.category).filter_by(is_active=True).distinct().all() if c[0]]
-    except: images, categories = [], []
-    return render_template('gallery.html', images=images, categories=categories)
+    except: images, categories, page = [], [], None
+    return render_template('gallery.html', images=images, categories=categories, page=page)
 
 @app.route('/notices')
+@page_view('notices', Notice, params=PAGINATION_PARAMS)
 def notices():
-    track_visitor('notices')
-    try: all_notices = Notice.query.filter_by(is_active=True).order_by(Notice.post_date.desc()).all()
-    except: all_notices = []
-    return render_template('notices.html', notices=all_notices)
+    try: all_notices, page = keyset_paginate(Notice.query.filter_by(is_active=True), Notice.post_date, Notice.id)
+    except: all_notices, page = [], None
+    return render_template('notices.html', notices=all_notices, page=page)
+
+@app.route('/sitemap.xml')
+def sitemap_xml():
+    return serve_document('sitemap.xml')
+
+@app.route('/feed.atom')
+def atom_feed():
+    return serve_document('feed.atom')
 
 @app.route('/contact', methods=['GET', 'POST'])
 def contact():
@@ -428,11 +3030,20 @@ def contact():
 def admin_login():
     if current_user.is_authenticated: return redirect(url_for('admin_dashboard'))
     if request.method == 'POST':
+        ip, username = client_ip(), request.form.get('username', '')
+        wait = math.ceil(login_throttle(ip, username))
+        if wait:
+            flash(f'Too many login attempts. Try again in {wait} seconds.', 'error')
+            response = make_response(render_template('admin/login.html'), 429)
+            response.headers['Retry-After'] = str(wait)
+            return response
         try:
-            user = Admin.query.filter_by(username=request.form['username']).first()
+            user = Admin.query.filter_by(username=username).first()
             if user and check_password_hash(user.password_hash, request.form['password']):
+                login_result(ip, username, True)
                 login_user(user); flash(f'Welcome {user.name}!', 'success')
                 return redirect(url_for('admin_dashboard'))
+            login_result(ip, username, False)
             flash('Invalid credentials!', 'error')
         except: flash('Login error!', 'error')
     return render_template('admin/login.html')
@@ -448,46 +3059,24 @@ def admin_logout():
 def admin_dashboard():
     try:
         today = datetime.utcnow().strftime('%Y-%m-%d')
-        yesterday = (datetime.utcnow() - timedelta(days=1)).strftime('%Y-%m-%d')
         
-        stats = {
-            'books': Book.query.filter_by(is_active=True).count(),
-            'results': Result.query.filter_by(is_active=True).count(),
-            'notices': Notice.query.filter_by(is_active=True).count(),
-            'faculty': Faculty.query.filter_by(is_active=True).count(),
-            'courses': Course.query.filter_by(is_active=True).count(),
-            'messages': ContactMessage.query.filter_by(is_read=False).count(),
-            'gallery': Gallery.query.filter_by(is_active=True).count(),
-        }
+        stats = content_counts()
         
-        # ✅ Traffic Stats
+        # ✅ Traffic Stats (from the daily rollup)
+        month = traffic_series(30, '%a')
+        daily_traffic = month[-7:]
         traffic = {
-            'today': Visitor.query.filter_by(date_only=today).count(),
-            'yesterday': Visitor.query.filter_by(date_only=yesterday).count(),
-            'total': Visitor.query.count(),
-            'this_week': Visitor.query.filter(
-                Visitor.visit_date >= datetime.utcnow() - timedelta(days=7)
-            ).count(),
-            'this_month': Visitor.query.filter(
-                Visitor.visit_date >= datetime.utcnow() - timedelta(days=30)
-            ).count(),
+            'today': month[-1]['count'],
+            'yesterday': month[-2]['count'],
+            'total': int(db.session.query(db.func.sum(VisitorDailyStat.uniques)).scalar() or 0),
+            'this_week': sum(d['count'] for d in daily_traffic),
+            'this_month': sum(d['count'] for d in month),
         }
         
         # ✅ Page-wise traffic today
         page_traffic = db.session.query(
-            Visitor.page, db.func.count(Visitor.id)
-        ).filter_by(date_only=today).group_by(Visitor.page).all()
-        
-        # ✅ Last 7 days traffic
-        daily_traffic = []
-        for i in range(6, -1, -1):
-            day = (datetime.utcnow() - timedelta(days=i)).strftime('%Y-%m-%d')
-            count = Visitor.query.filter_by(date_only=day).count()
-            daily_traffic.append({
-                'date': day,
-                'day': (datetime.utcnow() - timedelta(days=i)).strftime('%a'),
-                'count': count
-            })
+            VisitorDailyStat.page, VisitorDailyStat.uniques
+        ).filter_by(day=today).order_by(VisitorDailyStat.uniques.desc()).all()
         
         recent_notices = Notice.query.order_by(Notice.post_date.desc()).limit(5).all()
         recent_messages = ContactMessage.query.order_by(ContactMessage.date.desc()).limit(5).all()
@@ -514,24 +3103,13 @@ def admin_settings():
                       'college_website', 'principal_name', 'office_hours', 'library_hours',
                       'facebook_url', 'twitter_url', 'instagram_url', 'youtube_url',
                       'whatsapp_number', 'google_map_embed', 'admission_open', 'admission_text']
-            for field in fields:
-                value = request.form.get(field, '')
-                set_setting(field, value)
+            set_settings({field: request.form.get(field, '') for field in fields})
             flash('✅ Settings updated!', 'success')
         except Exception as e:
             flash(f'Error: {e}', 'error')
         return redirect(url_for('admin_settings'))
     
-    # Get all settings
-    settings = {}
-    try:
-        all_settings = SiteSettings.query.all()
-        for s in all_settings:
-            settings[s.key] = s.value
-    except:
-        pass
-    
-    return render_template('admin/settings.html', settings=settings)
+    return render_template('admin/settings.html', settings=site_settings(fresh=True))
 
 # ✅ NEW - Traffic Analytics Page
 @app.route('/admin/analytics')
@@ -540,51 +3118,77 @@ def admin_analytics():
     try:
         today = datetime.utcnow().strftime('%Y-%m-%d')
         
-        # Overall stats
-        traffic = {
-            'today': Visitor.query.filter_by(date_only=today).count(),
-            'total': Visitor.query.count(),
-            'this_week': Visitor.query.filter(
-                Visitor.visit_date >= datetime.utcnow() - timedelta(days=7)).count(),
-            'this_month': Visitor.query.filter(
-                Visitor.visit_date >= datetime.utcnow() - timedelta(days=30)).count(),
-            'unique_today': db.session.query(db.func.count(db.distinct(Visitor.ip_address))).filter_by(date_only=today).scalar(),
-            'unique_total': db.session.query(db.func.count(db.distinct(Visitor.ip_address))).scalar(),
-        }
-        
         # Last 30 days daily traffic
-        daily_traffic = []
-        for i in range(29, -1, -1):
-            day = (datetime.utcnow() - timedelta(days=i)).strftime('%Y-%m-%d')
-            count = Visitor.query.filter_by(date_only=day).count()
-            daily_traffic.append({
-                'date': day,
-                'day': (datetime.utcnow() - timedelta(days=i)).strftime('%d %b'),
-                'count': count
-            })
+        daily_traffic = traffic_series(30, '%d %b')
         
         # Page-wise traffic (all time)
         page_traffic = db.session.query(
-            Visitor.page, db.func.count(Visitor.id)
-        ).group_by(Visitor.page).order_by(db.func.count(Visitor.id).desc()).all()
+            VisitorDailyStat.page, db.func.sum(VisitorDailyStat.uniques)
+        ).group_by(VisitorDailyStat.page).order_by(db.func.sum(VisitorDailyStat.uniques).desc()).all()
+        
+        # Overall stats
+        traffic = {
+            'today': daily_traffic[-1]['count'],
+            'total': sum(int(count or 0) for page, count in page_traffic),
+            'this_week': sum(d['count'] for d in daily_traffic[-7:]),
+            'this_month': sum(d['count'] for d in daily_traffic),
+            'unique_today': unique_visitors([today]),
+            'unique_week': unique_visitors([d['date'] for d in daily_traffic[-7:]]),
+            'unique_month': unique_visitors([d['date'] for d in daily_traffic]),
+            'unique_total': unique_visitors(),
+        }
         
         # Recent visitors
         recent_visitors = Visitor.query.order_by(Visitor.visit_date.desc()).limit(50).all()
         
     except Exception as e:
         print(f"Analytics error: {e}")
-        traffic = {'today':0,'total':0,'this_week':0,'this_month':0,'unique_today':0,'unique_total':0}
+        traffic = {'today':0,'total':0,'this_week':0,'this_month':0,
+                   'unique_today':0,'unique_week':0,'unique_month':0,'unique_total':0}
         daily_traffic, page_traffic, recent_visitors = [], [], []
     
+    try: bots = bot_traffic(30)
+    except Exception as e: print(f"Analytics error: {e}"); bots = []
     return render_template('admin/analytics.html', traffic=traffic,
                          daily_traffic=daily_traffic, page_traffic=page_traffic,
-                         recent_visitors=recent_visitors)
+                         recent_visitors=recent_visitors, ingest=visitor_ingest_stats(), bots=bots,
+                         bot_filter=BOT_FILTER)
+
+# ✅ Request timings of this worker (ring buffer)
+@app.route('/admin/perf')
+@login_required
+def admin_perf():
+    return render_template('admin/perf.html', perf=perf_report(), pid=os.getpid(), startup=_startup,
+                         buffer_size=PERF_BUFFER_SIZE, slow_query_ms=SLOW_QUERY_MS,
+                         n_plus_one=PERF_N_PLUS_ONE, logins=login_throttle_report(), login_limits=LOGIN_LIMITS)
+
+# --- BULK IMPORT ---
+@app.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+def admin_import():
+    report = None
+    if request.method == 'POST':
+        upload, kind = request.files.get('file'), request.form.get('kind')
+        if kind not in IMPORT_KINDS or not upload or not upload.filename:
+            flash('Choose what to import and a CSV or JSONL file', 'error')
+        else:
+            report = import_rows(kind, upload.stream, import_format(upload.filename, request.form.get('format')),
+                                 uploaded_by=current_user.name, dry_run=bool(request.form.get('dry_run')))
+            report['filename'] = upload.filename
+            if report['fatal']: flash(f"❌ {report['fatal']}", 'error')
+            elif report['dry_run']: flash(f"✅ {report['imported']} rows valid, {report['failed']} with errors", 'success')
+            else: flash(f"✅ {report['imported']} {kind} imported, {report['failed']} rows skipped", 'success')
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(report or {'error': 'kind and file are required'}), 200 if report else 400
+    return render_template('admin/import.html', report=report, kinds=IMPORT_KINDS,
+                         batch_size=IMPORT_BATCH_SIZE, chunk_size=IMPORT_CHUNK_SIZE)
 
 # --- BOOKS ---
 @app.route('/admin/books')
 @login_required
 def manage_books():
-    return render_template('admin/manage_books.html', books=Book.query.order_by(Book.upload_date.desc()).all())
+    books, page = keyset_paginate(Book.query, Book.upload_date, Book.id)
+    return render_template('admin/manage_books.html', books=books, page=page)
 
 @app.route('/admin/books/add', methods=['POST'])
 @login_required
@@ -593,8 +3197,8 @@ def add_book():
         b = Book(title=request.form['title'], author=request.form['author'],
                 subject=request.form['subject'], semester=request.form.get('semester',''),
                 course=request.form.get('course',''), drive_link=request.form['drive_link'],
-                description=request.form.get('description',''), uploaded_by=current_user.name)
-        b.download_link = convert_drive_link(b.drive_link)['download']
+                description=request.form.get('description',''), uploaded_by=current_user.name,
+                **drive_link_fields(request.form['drive_link']))
         db.session.add(b); db.session.commit(); flash('✅ Book added!', 'success')
     except Exception as e: db.session.rollback(); flash(f'Error: {e}', 'error')
     return redirect(url_for('manage_books'))
@@ -610,7 +3214,8 @@ def delete_book(id):
 @app.route('/admin/results')
 @login_required
 def manage_results():
-    return render_template('admin/manage_results.html', results=Result.query.order_by(Result.upload_date.desc()).all())
+    results, page = keyset_paginate(Result.query, Result.upload_date, Result.id)
+    return render_template('admin/manage_results.html', results=results, page=page)
 
 @app.route('/admin/results/add', methods=['POST'])
 @login_required
@@ -619,7 +3224,7 @@ def add_result():
         db.session.add(Result(title=request.form['title'], exam_type=request.form.get('exam_type',''),
             course=request.form.get('course',''), semester=request.form.get('semester',''),
             year=request.form.get('year',''), drive_link=request.form['drive_link'],
-            uploaded_by=current_user.name))
+            uploaded_by=current_user.name, **drive_link_fields(request.form['drive_link'])))
         db.session.commit(); flash('✅ Result uploaded!', 'success')
     except Exception as e: db.session.rollback(); flash(f'Error: {e}', 'error')
     return redirect(url_for('manage_results'))
@@ -635,7 +3240,8 @@ def delete_result(id):
 @app.route('/admin/notices')
 @login_required
 def manage_notices():
-    return render_template('admin/manage_notices.html', notices=Notice.query.order_by(Notice.post_date.desc()).all())
+    notices, page = keyset_paginate(Notice.query, Notice.post_date, Notice.id)
+    return render_template('admin/manage_notices.html', notices=notices, page=page)
 
 @app.route('/admin/notices/add', methods=['POST'])
 @login_required
@@ -659,7 +3265,8 @@ def delete_notice(id):
 @app.route('/admin/faculty')
 @login_required
 def manage_faculty():
-    return render_template('admin/manage_faculty.html', faculty=Faculty.query.filter_by(is_active=True).all())
+    faculty, page = keyset_paginate(Faculty.query.filter_by(is_active=True), Faculty.id, descending=False)
+    return render_template('admin/manage_faculty.html', faculty=faculty, page=page)
 
 @app.route('/admin/faculty/add', methods=['POST'])
 @login_required
@@ -685,8 +3292,8 @@ def delete_faculty(id):
 @app.route('/admin/gallery')
 @login_required
 def manage_gallery():
-    return render_template('admin/manage_gallery.html',
-        images=Gallery.query.filter_by(is_active=True).order_by(Gallery.upload_date.desc()).all())
+    images, page = keyset_paginate(Gallery.query.filter_by(is_active=True), Gallery.upload_date, Gallery.id)
+    return render_template('admin/manage_gallery.html', images=images, page=page)
 
 @app.route('/admin/gallery/add', methods=['POST'])
 @login_required
@@ -710,7 +3317,8 @@ def delete_gallery(id):
 @app.route('/admin/courses')
 @login_required
 def manage_courses():
-    return render_template('admin/manage_courses.html', courses=Course.query.filter_by(is_active=True).all())
+    courses, page = keyset_paginate(Course.query.filter_by(is_active=True), Course.id, descending=False)
+    return render_template('admin/manage_courses.html', courses=courses, page=page)
 
 @app.route('/admin/courses/add', methods=['POST'])
 @login_required
@@ -736,8 +3344,8 @@ def delete_course(id):
 @app.route('/admin/messages')
 @login_required
 def admin_messages():
-    return render_template('admin/messages.html',
-        messages=ContactMessage.query.order_by(ContactMessage.date.desc()).all())
+    messages, page = keyset_paginate(ContactMessage.query, ContactMessage.date, ContactMessage.id)
+    return render_template('admin/messages.html', messages=messages, page=page)
 
 @app.route('/admin/messages/read/<int:id>')
 @login_required
@@ -746,13 +3354,37 @@ def mark_read(id):
     except: db.session.rollback()
     return redirect(url_for('admin_messages'))
 
+# --- EXPORT ---
+@app.route('/admin/export/<kind>')
+@login_required
+def admin_export(kind):
+    back = 'admin_messages' if kind == 'messages' else 'admin_analytics'
+    if kind not in ('messages', 'visitors'):
+        return redirect(url_for('admin_dashboard'))
+    fmt = request.args.get('format', 'csv')
+    try:
+        filters = export_filters(request.args)
+    except ValueError:
+        flash('Dates must be YYYY-MM-DD!', 'error'); return redirect(url_for(back))
+    if fmt not in EXPORT_FORMATS:
+        flash('Format must be csv or ndjson!', 'error'); return redirect(url_for(back))
+    filename = f"{kind}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+    body, mimetype = export_lines(kind, fmt, **filters), EXPORT_FORMATS[fmt]
+    if request.args.get('gzip') == '1':
+        body, mimetype, filename = gzip_stream(body), 'application/gzip', filename + '.gz'
+    response = app.response_class(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # --- USERS ---
 @app.route('/admin/users')
 @login_required
 def manage_users():
     if current_user.role != 'admin':
         flash('Access denied!', 'error'); return redirect(url_for('admin_dashboard'))
-    return render_template('admin/manage_users.html', users=Admin.query.all())
+    users, page = keyset_paginate(Admin.query, Admin.id, descending=False)
+    return render_template('admin/manage_users.html', users=users, page=page)
 
 @app.route('/admin/users/add', methods=['POST'])
 @login_required
@@ -783,17 +3415,12 @@ def delete_user(id):
 # =================== CONTEXT ===================
 @app.context_processor
 def utility_processor():
-    settings = {}
-    try:
-        all_settings = SiteSettings.query.all()
-        for s in all_settings:
-            settings[s.key] = s.value
-    except:
-        pass
     return {
         'now': datetime.utcnow,
         'convert_drive_image': convert_drive_image,
-        'site': settings,
+        'thumb_url': thumb_url,
+        'asset_url': asset_url,
+        'site': site_settings(),
         'get_setting': get_setting
     }
 
@@ -802,10 +3429,147 @@ def not_found(e): return redirect(url_for('index'))
 @app.errorhandler(500)
 def server_error(e): return redirect(url_for('index'))
 
+# =================== CLI ===================
+@app.cli.command('import-catalogue')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Default: from the file extension.')
+@click.option('--dry-run', is_flag=True, help='Validate rows without inserting them.')
+@click.option('--uploaded-by', default='import', show_default=True)
+def import_catalogue_command(kind, path, fmt, dry_run, uploaded_by):
+    """Stream-import books, results, faculty or courses from a CSV or JSONL file."""
+    with open(path, 'rb') as f:
+        report = import_rows(kind, f, import_format(path, fmt), uploaded_by, dry_run,
+                             on_error=lambda line, errors: print(f"❌ line {line}: {'; '.join(errors)}"))
+    if report['fatal']:
+        print(f"❌ {report['fatal']}")
+    verb = 'valid' if dry_run else 'imported'
+    print(f"✅ {report['rows']} rows read, {report['imported']} {verb}, {report['failed']} failed "
+          f"in {report['seconds']}s")
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(['messages', 'visitors']))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--start', help='First day, YYYY-MM-DD.')
+@click.option('--end', help='Last day (inclusive), YYYY-MM-DD.')
+@click.option('--page', help='Only visits to this page (visitors only).')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', default='-', help='File to write; default stdout.')
+def export_command(kind, fmt, start, end, page, compress, output):
+    """Stream contact messages or visitor logs as CSV or NDJSON."""
+    try:
+        filters = export_filters({'start': start, 'end': end, 'page': page})
+    except ValueError:
+        raise click.BadParameter('dates must be YYYY-MM-DD')
+    stats = {'rows': 0}
+    started = time.perf_counter()
+    lines = export_lines(kind, fmt, stats, **filters)
+    with click.open_file(output, 'wb') as f:
+        for chunk in gzip_stream(lines) if compress else (line.encode() for line in lines):
+            f.write(chunk)
+    click.echo(f"✅ {stats['rows']} {kind} rows exported in {time.perf_counter() - started:.1f}s", err=True)
+
+@app.cli.command('reset-login-throttle')
+@click.argument('key', required=False)
+def reset_login_throttle_command(key):
+    """Lift login lockouts: one key (ip:1.2.3.4, user:admin) or everything."""
+    print(f"✅ {reset_login_throttle(key)} login throttle entries removed")
+
+@app.cli.command('prerender')
+@click.option('--output', '-o', help='Write a static export here instead of the serving directory.')
+def prerender_command(output):
+    """Render the public pages and each gallery category to static HTML now."""
+    started = time.perf_counter()
+    pages = prerender_pages()
+    written = prerender(pages, root=output)
+    print(f"✅ {written}/{len(pages)} pages rendered to {output or PRERENDER_DIR} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+@app.cli.command('build-assets')
+@click.option('--output', '-o', help='Directory to write to; default ASSET_DIR.')
+def build_assets_command(output):
+    """Write the fingerprinted CSS/JS bundles and their gzip and brotli variants."""
+    directory = output or ASSET_DIR
+    for bundle, name in build_assets(directory).items():
+        sizes = [f"{suffix or 'raw'} {os.path.getsize(os.path.join(directory, name + suffix))}"
+                 for suffix in ('', '.gz', '.br') if os.path.exists(os.path.join(directory, name + suffix))]
+        print(f"✅ {bundle} -> {name} ({', '.join(sizes)} bytes)")
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute the dashboard content counters from their source tables."""
+    for name, (before, after) in reconcile_content_counters().items():
+        print(f"{'✅' if before == after else '⚠️'} {name}: {after}" + ('' if before == after else f" (was {before})"))
+
+@app.cli.command('bootstrap')
+def bootstrap_command():
+    """Create tables, apply migrations and seed default data (once, under a lock)."""
+    bootstrap_db()
+
+@app.cli.command('rebuild-traffic-stats')
+def rebuild_traffic_stats_command():
+    """Rebuild the daily traffic rollup from the raw visitors table."""
+    print(f"✅ {rebuild_daily_stats()} daily traffic rows rebuilt")
+
+@app.cli.command('rebuild-visitor-sketches')
+def rebuild_visitor_sketches_command():
+    """Add all retained raw visitor rows to the unique-visitor sketches."""
+    print(f"✅ {rebuild_visitor_sketches()} visitor rows added to sketches")
+
+@app.cli.command('compact-visitors')
+@click.option('--days', default=VISITOR_RETENTION_DAYS, show_default=True, help='Raw rows to keep, in days.')
+@click.option('--archive-dir', default=VISITOR_ARCHIVE_DIR, show_default=True,
+              help='Where monthly NDJSON archives go; empty to delete without archiving.')
+@click.option('--batch-size', default=VISITOR_COMPACT_BATCH, show_default=True)
+def compact_visitors_command(days, archive_dir, batch_size):
+    """Roll up, archive and delete visitor rows older than the retention window."""
+    flush_visitors()
+    with exclusive_lock('visitor-compaction'):
+        report = compact_visitors(days, archive_dir, batch_size)
+    print(f"✅ Rows before {report['cutoff']}: {report['rolled_up']} rollup rows added, "
+          f"{report['archived']} archived, {report['deleted']} deleted; "
+          f"{report['user_agents']} user agents moved to the lookup table")
+
+@app.cli.command('backfill-drive-links')
+@click.option('--batch-size', default=500, show_default=True)
+def backfill_drive_links_command(batch_size):
+    """Store preview/view/download links for books and results missing them."""
+    with db.engine.connect() as conn:
+        print(f"✅ {backfill_drive_links(conn, batch_size, commit=True)} rows updated")
+
+@app.cli.command('db-upgrade')
+@click.option('--report', is_flag=True, help='Print hot query plans before and after.')
+def db_upgrade_command(report):
+    """Create missing tables and apply pending migrations."""
+    before = {}
+    if report:
+        try:
+            before = explain_hot_queries()
+        except Exception as e:
+            print(f"⚠️ No 'before' plans, the current schema cannot explain them: {e}")
+    db.create_all()
+    applied = migrate_db()
+    print(f"✅ {len(applied)} migration(s) applied")
+    if report:
+        after = explain_hot_queries()
+        for name in after:
+            print(f"\n▶ {name}")
+            if before and before.get(name) != after[name]:
+                print('  before: ' + '\n          '.join(before.get(name, [])))
+            print('  after:  ' + '\n          '.join(after[name]))
+
+@app.cli.command('db-report')
+def db_report_command():
+    """Show applied migrations and the query plan of each hot query."""
+    for m in SchemaMigration.query.order_by(SchemaMigration.version).all():
+        print(f"  {m.version:>3}  {m.applied_at:%Y-%m-%d %H:%M}  {m.name}")
+    for name, plan in explain_hot_queries().items():
+        print(f"\n▶ {name}\n  " + '\n  '.join(plan))
+
 # =================== RUN ===================
-print(f"\n{'='*50}\n🎓 Chandrika Jain Degree Mahavidyalaya\n📍 Borda, Kalahandi\n💾 {STORAGE_TYPE}\n{'='*50}\n")
-init_db()
+_startup['import_ms'] = (time.perf_counter() - _MODULE_STARTED) * 1000
 
 if __name__ == '__main__':
+    bootstrap_db()
     port = int(os.environ.get('PORT', 7860))
     app.run(host='0.0.0.0', port=port, debug=False)
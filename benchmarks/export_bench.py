@@ -0,0 +1,85 @@
+"""Export benchmark: throughput and peak memory of the streaming visitor export.
+
+Seeds a throwaway SQLite database (or the scratch PostgreSQL database in
+DATABASE_URL) with synthetic visitor rows, then streams them through
+export_lines() as CSV, NDJSON and gzipped CSV, reporting rows per second and
+peak Python heap use, which should stay flat as the table grows. For
+reference it also loads the same rows the old way, Visitor.query.all().
+
+    python benchmarks/export_bench.py --sizes 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--sizes', type=int, nargs='+', default=[50000, 200000])
+parser.add_argument('--no-heap', action='store_true', help='Skip heap tracing, which slows the export ~2x.')
+parser.add_argument('--no-baseline', action='store_true', help='Skip the load-everything comparison.')
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-export-bench.db')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    if os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+def seed(total):
+    have = site.db.session.query(site.db.func.count(site.Visitor.id)).scalar()
+    ua = site.UserAgent.query.first() or site.UserAgent(ua_hash='bench', value='Mozilla/5.0 (bench)')
+    site.db.session.add(ua)
+    site.db.session.flush()
+    start = datetime.utcnow() - timedelta(days=90)
+    for offset in range(have, total, 10000):
+        rows = [{'page': ('home', 'books', 'results', 'notices')[i % 4], 'ip_address': f'10.0.{i % 250}.{i % 199}',
+                 'user_agent_id': ua.id if i % 10 else None, 'user_agent': None if i % 10 else 'Legacy/1.0',
+                 'visit_date': start + timedelta(seconds=i * 7), 'date_only': None}
+                for i in range(offset, min(offset + 10000, total))]
+        site.db.session.execute(site.db.insert(site.Visitor.__table__), rows)
+        site.db.session.commit()
+
+def measure(run):
+    if not args.no_heap:
+        tracemalloc.start()
+    started = time.perf_counter()
+    rows = run()
+    seconds = time.perf_counter() - started
+    heap = '-'
+    if not args.no_heap:
+        heap = f'{tracemalloc.get_traced_memory()[1] / 1e6:.1f}MB'
+        tracemalloc.stop()
+    return rows, seconds, heap
+
+def export(fmt, compress):
+    def run():
+        stats = {'rows': 0}
+        lines = site.export_lines('visitors', fmt, stats)
+        for _ in site.gzip_stream(lines) if compress else lines:
+            pass
+        return stats['rows']
+    return run
+
+def load_all():
+    rows = site.Visitor.query.all()
+    site.db.session.expunge_all()
+    return len(rows)
+
+with site.app.app_context():
+    print(f"{'rows':>9}  {'export':<12}{'seconds':>10}{'rows/s':>10}{'peak heap':>12}")
+    for size in args.sizes:
+        seed(size)
+        runs = [('csv', export('csv', False)), ('ndjson', export('ndjson', False)), ('csv.gz', export('csv', True))]
+        if not args.no_baseline:
+            runs.append(('query.all()', load_all))
+        for label, run in runs:
+            rows, seconds, heap = measure(run)
+            assert rows == size, (label, rows)
+            print(f"{size:>9}  {label:<12}{seconds:>10.2f}{size / max(seconds, 0.001):>10.0f}{heap:>12}")
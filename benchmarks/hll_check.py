@@ -0,0 +1,80 @@
+"""Accuracy check for the unique-visitor HyperLogLog against exact counts.
+
+Replays synthetic traffic (repeat visitors, several pages, many days) and
+compares sketch estimates with exact distinct counts, including merged
+week/month/all-time sketches. Exits non-zero if any estimate falls outside
+4 standard errors (1.04 / sqrt(2^12) ~ 1.6% each), or if a sketch changes
+across dump/load or when merged with itself.
+
+    python benchmarks/hll_check.py
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import HLL_REGISTERS, HyperLogLog  # noqa: E402
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--days', type=int, default=60)
+parser.add_argument('--visitors-per-day', type=int, default=3000)
+parser.add_argument('--seed', type=int, default=7)
+args = parser.parse_args()
+
+rng = random.Random(args.seed)
+std_error = 1.04 / math.sqrt(HLL_REGISTERS)
+pages = ['home', 'library', 'notices', 'results', 'gallery']
+population = [f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+              for _ in range(args.days * args.visitors_per_day // 2)]
+
+day_sketches, day_exact = [], []
+for day in range(args.days):
+    sketch, exact = HyperLogLog(), set()
+    # Half of each day's visitors are regulars drawn from a shared population
+    for i in range(args.visitors_per_day):
+        ip = rng.choice(population) if i % 2 else f'day{day}-visitor{i}'
+        for _ in range(rng.randint(1, 4)):   # repeat page views must not inflate counts
+            sketch.add(ip)
+        exact.add(ip)
+    day_sketches.append(sketch)
+    day_exact.append(exact)
+
+def merged(indexes):
+    result, exact = HyperLogLog(), set()
+    for i in indexes:
+        result.merge(day_sketches[i])
+        exact |= day_exact[i]
+    return result.count(), len(exact)
+
+small = HyperLogLog()
+for i in range(150):
+    small.add(f'10.0.0.{i}')
+
+failures = []
+def check(ok, label):
+    print(f"{'✅' if ok else '❌'} {label}")
+    if not ok:
+        failures.append(label)
+
+print(f"registers={HLL_REGISTERS}  standard error={std_error:.2%}  bound={4 * std_error:.2%}\n")
+for name, estimate, exact in [('150 visitors (linear counting)', small.count(), 150),
+                              ('single day', day_sketches[-1].count(), len(day_exact[-1])),
+                              ('last 7 days', *merged(range(args.days - 7, args.days))),
+                              ('last 30 days', *merged(range(args.days - 30, args.days))),
+                              (f'all {args.days} days', *merged(range(args.days)))]:
+    error = (estimate - exact) / exact
+    check(abs(error) <= 4 * std_error, f"{name:<32}exact {exact:>8}  estimate {estimate:>8}  error {error:>+7.2%}")
+
+# Sketches survive the round trip through the database column
+stored = HyperLogLog.load(day_sketches[-1].dump())
+check(stored.count() == day_sketches[-1].count(), 'dump/load keeps the estimate')
+# Merging is idempotent, so a day merged twice into a window is not counted twice
+twice = HyperLogLog()
+twice.merge(day_sketches[-1])
+twice.merge(day_sketches[-1])
+check(twice.count() == day_sketches[-1].count(), 'merging the same day twice does not inflate the count')
+
+print(f"\n{'❌ ' + str(len(failures)) + ' check(s) failed' if failures else '✅ all checks passed'}")
+sys.exit(1 if failures else 0)
@@ -0,0 +1,69 @@
+"""Bulk import benchmark: throughput and peak memory of import_rows().
+
+Writes synthetic book CSV files of increasing size to disk, imports each into
+a throwaway SQLite database (or the scratch PostgreSQL database in
+DATABASE_URL) and reports rows per second and peak Python heap use, which
+should stay flat as files grow. For reference it also times the old path, one
+ORM add + commit per row as add_book() does, on a small sample.
+
+    python benchmarks/import_bench.py --sizes 10000 100000
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 20000])
+parser.add_argument('--per-row-sample', type=int, default=500)
+parser.add_argument('--no-heap', action='store_true', help='Skip heap tracing, which slows the import ~3x.')
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-import-bench.db')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    if os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title', 'author', 'subject', 'semester', 'course', 'drive_link', 'description'])
+        for i in range(rows):
+            writer.writerow([f'Bench Book {i}', f'Author {i % 300}', 'Physics', i % 6 + 1, 'BSC',
+                             f'https://drive.google.com/file/d/import-{i}/view', 'Synthetic row ' * 5])
+
+with site.app.app_context(), tempfile.TemporaryDirectory() as work:
+    print(f"{'rows':>9}{'file':>10}{'seconds':>10}{'rows/s':>10}{'peak heap':>12}")
+    for size in args.sizes:
+        path = os.path.join(work, f'books-{size}.csv')
+        write_csv(path, size)
+        if not args.no_heap:
+            tracemalloc.start()
+        with open(path, 'rb') as f:
+            report = site.import_rows('books', f, 'csv', uploaded_by='bench')
+        heap = '-'
+        if not args.no_heap:
+            heap = f'{tracemalloc.get_traced_memory()[1] / 1e6:.1f}MB'
+            tracemalloc.stop()
+        assert report['imported'] == size, report
+        print(f"{size:>9}{os.path.getsize(path) / 1e6:>8.1f}MB{report['seconds']:>10.2f}"
+              f"{size / max(report['seconds'], 0.001):>10.0f}{heap:>12}")
+
+    start = time.perf_counter()
+    for i in range(args.per_row_sample):
+        link = f'https://drive.google.com/file/d/one-{i}/view'
+        site.db.session.add(site.Book(title=f'One By One {i}', author='A', subject='Physics', drive_link=link,
+                                      uploaded_by='bench', **site.drive_link_fields(link)))
+        site.db.session.commit()
+    elapsed = time.perf_counter() - start
+    print(f"\nadd + commit per row (old path): {args.per_row_sample / elapsed:.0f} rows/s "
+          f"over {args.per_row_sample} rows")
@@ -0,0 +1,111 @@
+"""Scrape /metrics from a multi-worker gunicorn and check the aggregation.
+
+Starts gunicorn with METRICS_ENABLED=1 against a throwaway SQLite database,
+sends a known number of requests, scrapes /metrics like Prometheus would and
+checks that request counters add up across workers. It then restarts one
+worker and checks that no counter went backwards. Exits non-zero on mismatch.
+
+    python benchmarks/metrics_check.py --workers 3 --requests 300
+"""
+import argparse
+import http.client
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$')
+PATHS = ['/', '/about', '/courses', '/library', '/notices']
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--workers', type=int, default=2)
+parser.add_argument('--requests', type=int, default=200)
+parser.add_argument('--concurrency', type=int, default=8)
+parser.add_argument('--port', type=int, default=8766)
+args = parser.parse_args()
+
+def fetch(path):
+    conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=30)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, response.read().decode()
+    finally:
+        conn.close()
+
+def scrape():
+    status, body = fetch('/metrics')
+    assert status == 200, f'/metrics returned {status}'
+    samples = {}
+    for line in body.splitlines():
+        if line and not line.startswith('#'):
+            name, labels, value = SAMPLE.match(line).groups()
+            samples[name + (labels or '')] = float(value)
+    return samples
+
+def total(samples, prefix, exclude='endpoint="metrics"'):
+    return sum(v for k, v in samples.items() if k.startswith(prefix) and exclude not in k)
+
+def worker_pids(samples):
+    return sorted({int(m) for k in samples for m in re.findall(r'pid="(\d+)"', k)})
+
+work = tempfile.mkdtemp(prefix='cjdm-metrics-check-')
+env = dict(os.environ, METRICS_ENABLED='1', METRICS_DIR=os.path.join(work, 'metrics'), METRICS_FLUSH_SECONDS='0',
+           SQLITE_PATH=os.path.join(work, 'college.db'), PAGE_CACHE_DIR=os.path.join(work, 'cache'))
+env.pop('DATABASE_URL', None)
+server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+                           '--workers', str(args.workers), '--log-level', 'warning'],
+                          cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+failures = []
+def check(ok, label):
+    print(f"{'✅' if ok else '❌'} {label}")
+    if not ok:
+        failures.append(label)
+
+try:
+    deadline = time.time() + 60
+    while True:
+        try:
+            fetch('/about')
+            break
+        except OSError:
+            if server.poll() is not None or time.time() > deadline:
+                raise SystemExit('❌ gunicorn did not start')
+            time.sleep(0.2)
+    before = total(scrape(), 'cjdm_http_requests_total')
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        statuses = list(pool.map(lambda i: fetch(PATHS[i % len(PATHS)])[0], range(args.requests)))
+    # Every worker has flushed its own file by now (METRICS_FLUSH_SECONDS=0)
+    samples = scrape()
+    counted = total(samples, 'cjdm_http_requests_total') - before
+    check(counted == args.requests, f'request counter: {counted:g} counted for {args.requests} sent '
+          f'({statuses.count(200)} x 200)')
+    histogram = total(samples, 'cjdm_http_request_duration_seconds_count') - before
+    check(histogram == args.requests, f'latency histogram: {histogram:g} observations')
+    pids = worker_pids(samples)
+    check(len(pids) >= min(args.workers, 2), f'workers reporting: pids {pids}')
+    check(any(k.startswith('cjdm_visitor_queue_pending') for k in samples), 'ingest backlog gauge present')
+    check(total(samples, 'cjdm_db_pool_wait_seconds_count') > 0, 'pool wait histogram observed')
+
+    # A worker exit must not make counters go backwards
+    os.kill(pids[0], signal.SIGTERM)
+    time.sleep(3)
+    after = scrape()
+    regressed = [k for k, v in samples.items() if '_total' in k and 'pid=' not in k and after.get(k, 0) < v]
+    check(not regressed, f'counters after worker restart: {len(regressed)} went backwards'
+          + (f': {regressed[:3]}' if regressed else ''))
+    check(pids[0] not in worker_pids(after), f'dead worker gauges dropped: pids now {worker_pids(after)}')
+finally:
+    server.terminate()
+    server.wait(30)
+    shutil.rmtree(work, ignore_errors=True)
+
+print(f"\n{'❌ ' + str(len(failures)) + ' check(s) failed' if failures else '✅ all checks passed'}")
+sys.exit(1 if failures else 0)
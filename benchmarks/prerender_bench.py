@@ -0,0 +1,99 @@
+"""Pre-render benchmark: static files against the page cache and full renders.
+
+Seeds notices, results and gallery rows (in several categories) into a
+throwaway SQLite database (or the scratch PostgreSQL database in DATABASE_URL),
+runs `prerender` over the public pages and checks that every stored file is
+byte-identical to the page rendered dynamically. It then times anonymous GETs
+of each page served three ways: from the pre-rendered file, from the page
+cache, and rendered on every request. Finally it posts a notice through the
+admin route and reports how long the background regeneration takes to
+bring /notices and / back to static serving.
+
+    python benchmarks/prerender_bench.py --requests 500
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--requests', type=int, default=300, help='GETs per page and serving mode.')
+parser.add_argument('--rows', type=int, default=60, help='Notices, results and gallery rows to seed.')
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-prerender-bench.db')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    if os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+work = tempfile.mkdtemp(prefix='cjdm-prerender-')
+os.environ.update(PRERENDER='1', PRERENDER_DIR=work, PRERENDER_DELAY='0.1', PAGE_CACHE_BACKEND='memory')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+with site.app.app_context():
+    for i in range(args.rows):
+        site.db.session.add(site.Notice(title=f'Notice {i}', content='Details ' * 40, category='Exam'))
+        site.db.session.add(site.Result(title=f'Result {i}', course='BSC', semester=str(i % 6 + 1),
+                                        drive_link=f'https://drive.google.com/file/d/r{i}/view'))
+        site.db.session.add(site.Gallery(title=f'Photo {i}', image_url=f'https://example.com/{i}.jpg',
+                                         category=('Campus', 'Sports', 'Events')[i % 3]))
+    site.db.session.commit()
+    pages = site.prerender_pages()
+    started = time.perf_counter()
+    written = site.prerender(pages)
+    print(f"prerender: {written}/{len(pages)} pages in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+client = site.app.test_client()
+
+def path(endpoint, category):
+    return site.app.url_map.bind('localhost').build(endpoint, {'category': category} if category else {})
+
+def median_ms(url):
+    runs = []
+    for _ in range(args.requests):
+        started = time.perf_counter()
+        client.get(url)
+        runs.append((time.perf_counter() - started) * 1000)
+    return statistics.median(runs)
+
+failures = 0
+print(f"\n{'page':<28}{'static':>9}{'page cache':>12}{'render':>9}   identical")
+for endpoint, category in pages:
+    url = path(endpoint, category)
+    static_response = client.get(url)
+    site.PRERENDER = False
+    dynamic = site.app.test_client().get(url, headers={'Cookie': ''})
+    cached = median_ms(url)
+    page_cache, site.page_cache = site.page_cache, None
+    rendered = median_ms(url)
+    site.page_cache, site.PRERENDER = page_cache, True
+    static = median_ms(url)
+    same = static_response.headers.get('X-Cache') == 'STATIC' and static_response.get_data() == dynamic.get_data()
+    failures += not same
+    print(f"{url:<28}{static:>7.2f}ms{cached:>10.2f}ms{rendered:>7.2f}ms   {'✅' if same else '❌'}")
+
+client.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+client.post('/admin/notices/add', data={'title': 'Fresh notice', 'content': 'Posted by the benchmark'})
+changed = time.perf_counter()
+client.get('/admin/logout')
+visitor = site.app.test_client()
+for url in ('/notices', '/'):
+    while True:
+        response = visitor.get(url)
+        if response.headers.get('X-Cache') == 'STATIC':
+            break
+        time.sleep(0.01)
+    fresh = b'Fresh notice' in response.get_data()
+    failures += not fresh
+    print(f"\n{'✅' if fresh else '❌'} {url} static again {(time.perf_counter() - changed) * 1000:.0f}ms after the commit "
+          f"(PRERENDER_DELAY {site.PRERENDER_DELAY * 1000:.0f}ms)")
+print(f"\nstats: {site._prerender_stats}")
+shutil.rmtree(work, ignore_errors=True)
+sys.exit(1 if failures else 0)
@@ -0,0 +1,339 @@
+"""Latency and throughput benchmark for every GET route in app.py.
+
+Seeds a throwaway SQLite database (or the scratch PostgreSQL database given in
+DATABASE_URL) with synthetic books, results, notices, gallery images, messages
+and visitors, then drives every public and admin page through the Flask test
+client and/or a real gunicorn server. Reports p50/p95/p99 latency, requests per
+second and SQL statements per request, saves the run as JSON, and flags routes
+that regressed against a saved baseline (exit status 1).
+
+    python benchmarks/routes_bench.py --visitors 1000000 --out before.json
+    python benchmarks/routes_bench.py --mode both --compare before.json --out after.json
+
+Seeded data is reused between runs (top-up only) unless --fresh is given. The
+page cache is off by default so the numbers measure the view code; pass
+--page-cache disk to measure what production serves.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--books', type=int, default=20000)
+parser.add_argument('--results', type=int, default=2000)
+parser.add_argument('--notices', type=int, default=5000)
+parser.add_argument('--gallery', type=int, default=2000)
+parser.add_argument('--messages', type=int, default=5000)
+parser.add_argument('--visitors', type=int, default=200000)
+parser.add_argument('--days', type=int, default=120, help='Spread visitors over this many days.')
+parser.add_argument('--mode', choices=['client', 'gunicorn', 'both'], default='client')
+parser.add_argument('--requests', type=int, default=200, help='Timed requests per route.')
+parser.add_argument('--warmup', type=int, default=5)
+parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+parser.add_argument('--concurrency', type=int, default=8, help='Parallel clients against gunicorn.')
+parser.add_argument('--port', type=int, default=8765)
+parser.add_argument('--page-cache', choices=['none', 'memory', 'disk'], default='none')
+parser.add_argument('--routes', default='', help='Only routes whose name or path matches this regex.')
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-routes-bench.db')
+parser.add_argument('--fresh', action='store_true', help='Delete the SQLite database and reseed.')
+parser.add_argument('--out', help='Write the run to this JSON file.')
+parser.add_argument('--compare', help='Baseline JSON from an earlier run.')
+parser.add_argument('--threshold', type=float, default=0.20, help='Allowed p95 slowdown, as a fraction.')
+parser.add_argument('--min-ms', type=float, default=2.0, help='Ignore p95 slowdowns smaller than this.')
+parser.add_argument('--seed', type=int, default=42)
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    if args.fresh and os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+os.environ['PAGE_CACHE_BACKEND'] = args.page_cache
+os.environ['PAGE_CACHE_DIR'] = '/tmp/cjdm-routes-bench-cache'
+shutil.rmtree(os.environ['PAGE_CACHE_DIR'], ignore_errors=True)
+
+sys.path.insert(0, ROOT)
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+SUBJECTS = ['Physics', 'Chemistry', 'Mathematics', 'Botany', 'Zoology', 'History', 'Economics',
+            'Political Science', 'Sociology', 'Hindi', 'English', 'Odia', 'Accountancy']
+WORDS = ['introduction', 'principles', 'advanced', 'modern', 'organic', 'quantum', 'mechanics',
+         'algebra', 'calculus', 'statistics', 'ancient', 'indian', 'economy', 'theory', 'practical',
+         'handbook', 'guide', 'notes', 'literature', 'grammar', 'accounting', 'genetics', 'optics']
+PAGES = ['home', 'about', 'courses', 'faculty', 'library', 'results', 'gallery', 'notices', 'contact']
+AGENTS = ['Mozilla/5.0 (Linux; Android 13) Chrome/120.0 Mobile Safari/537.36',
+          'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0 Safari/537.36',
+          'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Safari/604.1',
+          'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)']
+# Query-string variants worth timing on their own
+EXTRA_ROUTES = [('library?search', '/library?search=organic+chemistry', False),
+                ('library?subject', '/library?subject=Physics&semester=3', False),
+                ('gallery?category', '/gallery?category=Events', False)]
+
+# =================== SEEDING ===================
+rng = random.Random(args.seed)
+NOW = site.datetime.utcnow()
+
+def fill(model, target, make, batch_size=5000):
+    missing = target - model.query.count()
+    if missing <= 0:
+        return 0
+    start, batch = time.perf_counter(), []
+    for i in range(missing):
+        batch.append(make(i))
+        if len(batch) == batch_size:
+            site.db.session.execute(site.db.insert(model), batch)
+            batch = []
+    if batch:
+        site.db.session.execute(site.db.insert(model), batch)
+    site.note_content_change(model)
+    site.db.session.commit()
+    print(f"  {model.__tablename__:<18}+{missing:>9}  ({time.perf_counter() - start:.1f}s)")
+    return missing
+
+def ago(minutes):
+    return NOW - site.timedelta(minutes=minutes)
+
+def book(i):
+    subject = rng.choice(SUBJECTS)
+    link = f'https://drive.google.com/file/d/bench-book-{i}/view'
+    row = {'title': ' '.join(rng.sample(WORDS, 3)).title() + f' {subject}', 'author': f'A. Author{i % 300}',
+           'subject': subject, 'semester': str(rng.randint(1, 6)), 'course': rng.choice(['BA', 'BSC', 'BCOM']),
+           'drive_link': link, 'description': ' '.join(rng.sample(WORDS, 8)), 'uploaded_by': 'bench',
+           'upload_date': ago(i), 'is_active': True}
+    row.update(site.drive_link_fields(link))
+    return row
+
+def result(i):
+    link = f'https://drive.google.com/file/d/bench-result-{i}/view'
+    row = {'title': f'Semester {i % 6 + 1} Result {2000 + i % 25}', 'exam_type': rng.choice(['Regular', 'Back']),
+           'course': rng.choice(['BA', 'BSC', 'BCOM']), 'semester': str(i % 6 + 1), 'year': str(2000 + i % 25),
+           'drive_link': link, 'uploaded_by': 'bench', 'upload_date': ago(i * 7), 'is_active': True}
+    row.update(site.drive_link_fields(link))
+    return row
+
+def notice(i):
+    return {'title': f'Notice {i}: ' + ' '.join(rng.sample(WORDS, 4)), 'content': ' '.join(rng.choices(WORDS, k=60)),
+            'category': rng.choice(['General', 'Exam', 'Admission', 'Event']), 'is_important': i % 20 == 0,
+            'posted_by': 'bench', 'post_date': ago(i * 11), 'is_active': True}
+
+def image(i):
+    return {'title': f'Photo {i}', 'image_url': f'https://drive.google.com/file/d/bench-img-{i}/view',
+            'category': rng.choice(['Campus', 'Events', 'Sports', 'Cultural']), 'upload_date': ago(i * 13),
+            'is_active': True}
+
+def message(i):
+    return {'name': f'Student {i}', 'email': f'student{i}@example.com', 'subject': 'Admission query',
+            'message': ' '.join(rng.choices(WORDS, k=30)), 'date': ago(i * 5), 'is_read': i % 3 != 0}
+
+def seed():
+    print(f"Seeding {site.db.engine.dialect.name} database...")
+    fill(site.Book, args.books, book)
+    fill(site.Result, args.results, result)
+    fill(site.Notice, args.notices, notice)
+    fill(site.Gallery, args.gallery, image)
+    fill(site.ContactMessage, args.messages, message)
+    site.reconcile_content_counters()   # Core inserts bypass the counter hooks
+
+    ua_ids = list(site.user_agent_ids(AGENTS).values())
+    population = [f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+                  for _ in range(max(1, args.visitors // 4))]
+    def visitor(i):
+        when = NOW - site.timedelta(seconds=rng.randrange(args.days * 86400))
+        return {'ip_address': rng.choice(population), 'page': rng.choice(PAGES), 'user_agent_id': rng.choice(ua_ids),
+                'visit_date': when, 'date_only': when.strftime('%Y-%m-%d')}
+    if fill(site.Visitor, args.visitors, visitor, batch_size=20000):
+        start = time.perf_counter()
+        site.rebuild_daily_stats()
+        sketched = site.rebuild_visitor_sketches(batch_size=50000)
+        print(f"  rollup + sketches over {sketched} visitor rows ({time.perf_counter() - start:.1f}s)")
+
+# =================== MEASURING ===================
+_sql = {'count': 0, 'thread': None}
+
+def _count_sql(conn, cursor, statement, parameters, context, executemany):
+    if threading.get_ident() == _sql['thread']:   # ignore the visitor flusher thread
+        _sql['count'] += 1
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+def summarize(samples, wall, statuses, queries=None):
+    ordered = sorted(samples)
+    summary = {'p50': round(percentile(ordered, 50), 3), 'p95': round(percentile(ordered, 95), 3),
+               'p99': round(percentile(ordered, 99), 3), 'mean': round(statistics.fmean(ordered), 3),
+               'max': round(ordered[-1], 3), 'rps': round(len(samples) / wall, 1),
+               'status': sorted(set(statuses))}
+    if queries is not None:
+        summary['queries'] = statistics.median(queries)
+        summary['queries_max'] = max(queries)
+    return summary
+
+def discover_routes():
+    routes = []
+    for rule in site.app.url_map.iter_rules():
+        if 'GET' not in rule.methods or rule.arguments or rule.endpoint in ('static', 'admin_logout'):
+            continue
+        needs_admin = rule.rule.startswith('/admin/') and rule.endpoint != 'admin_login'
+        routes.append((rule.endpoint, rule.rule, needs_admin))
+    routes = sorted(routes, key=lambda r: (r[2], r[1])) + EXTRA_ROUTES
+    if args.routes:
+        routes = [r for r in routes if re.search(args.routes, r[0]) or re.search(args.routes, r[1])]
+    return routes
+
+def run_client(routes):
+    anon, admin = site.app.test_client(), site.app.test_client()
+    admin.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+    site.event.listen(engine, 'before_cursor_execute', _count_sql)
+    _sql['thread'] = threading.get_ident()
+    results = {}
+    try:
+        for name, path, needs_admin in routes:
+            client = admin if needs_admin else anon
+            for _ in range(args.warmup):
+                client.get(path)
+            samples, statuses, queries = [], [], []
+            wall = time.perf_counter()
+            for _ in range(args.requests):
+                _sql['count'] = 0
+                start = time.perf_counter()
+                response = client.get(path)
+                samples.append((time.perf_counter() - start) * 1000)
+                statuses.append(response.status_code)
+                queries.append(_sql['count'])
+            results[name] = summarize(samples, time.perf_counter() - wall, statuses, queries)
+            print_row(name, results[name])
+    finally:
+        site.event.remove(engine, 'before_cursor_execute', _count_sql)
+    return results
+
+def fetch(path, cookie=None, method='GET', body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=60)
+    headers = {'Cookie': cookie} if cookie else {}
+    if body is not None:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    start = time.perf_counter()
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return (time.perf_counter() - start) * 1000, response.status, response.getheader('Set-Cookie')
+    finally:
+        conn.close()
+
+def run_gunicorn(routes):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+         '--workers', str(args.workers), '--timeout', '120', '--log-level', 'warning'],
+        cwd=ROOT, env=os.environ.copy(), stdout=subprocess.DEVNULL)
+    results = {}
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                fetch('/about')
+                break
+            except OSError:
+                if server.poll() is not None or time.time() > deadline:
+                    raise SystemExit('❌ gunicorn did not start')
+                time.sleep(0.2)
+        body = urlencode({'username': 'admin', 'password': 'admin123'})
+        set_cookie = fetch('/admin/login', method='POST', body=body)[2] or ''
+        cookie = set_cookie.split(';', 1)[0]
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            for name, path, needs_admin in routes:
+                jar = cookie if needs_admin else None
+                list(pool.map(lambda _: fetch(path, jar), range(args.warmup * args.concurrency)))
+                wall = time.perf_counter()
+                timings = list(pool.map(lambda _: fetch(path, jar), range(args.requests)))
+                results[name] = summarize([t[0] for t in timings], time.perf_counter() - wall,
+                                          [t[1] for t in timings])
+                print_row(name, results[name])
+    finally:
+        server.terminate()
+        server.wait(30)
+    return results
+
+# =================== REPORTING ===================
+def print_header(mode):
+    detail = (f"{args.workers} workers, {args.concurrency} clients" if mode == 'gunicorn' else 'sequential')
+    print(f"\n▶ {mode} ({detail}, {args.requests} requests per route)")
+    print(f"{'route':<28}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}{'sql':>6}  status")
+
+def print_row(name, r):
+    sql = f"{r['queries']:g}" if 'queries' in r else '-'
+    print(f"{name:<28}{r['p50']:>7.1f}ms{r['p95']:>7.1f}ms{r['p99']:>7.1f}ms{r['rps']:>9.1f}{sql:>6}  "
+          f"{','.join(map(str, r['status']))}")
+
+def compare(report, baseline):
+    if baseline['meta'].get('volumes') != report['meta']['volumes']:
+        print("\n⚠️ Baseline was seeded with different volumes; comparison may be misleading")
+    regressions = []
+    print(f"\n▶ Compared with {args.compare} (p95 +{args.threshold:.0%} and +{args.min_ms}ms, or more SQL)")
+    for mode, routes in report['results'].items():
+        for name, now in routes.items():
+            before = baseline['results'].get(mode, {}).get(name)
+            if not before:
+                continue
+            slower = now['p95'] > before['p95'] * (1 + args.threshold) and now['p95'] - before['p95'] > args.min_ms
+            more_sql = now.get('queries', 0) > before.get('queries', now.get('queries', 0))
+            change = (now['p95'] - before['p95']) / before['p95'] if before['p95'] else 0
+            flag = '❌ REGRESSION' if slower or more_sql else ('✅ faster' if change < -args.threshold else '')
+            if slower or more_sql:
+                regressions.append(f'{mode}:{name}')
+            sql = f"  sql {before['queries']:g}→{now['queries']:g}" if 'queries' in now and 'queries' in before else ''
+            print(f"{mode + ':' + name:<38}p95 {before['p95']:>7.1f} → {now['p95']:>7.1f}ms {change:>+7.0%}{sql}  {flag}")
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+# Requests run outside this context: sharing one app context would share flask.g
+# (and the logged-in user) between the anonymous and admin clients.
+with site.app.app_context():
+    seed()
+    engine = site.db.engine
+    volumes = {m.__tablename__: m.query.count() for m in
+               (site.Book, site.Result, site.Notice, site.Gallery, site.ContactMessage, site.Visitor)}
+report = {'meta': {'started': site.datetime.utcnow().isoformat(timespec='seconds'), 'git': git_revision(),
+                   'python': platform.python_version(), 'database': engine.dialect.name,
+                   'page_cache': args.page_cache, 'requests': args.requests, 'warmup': args.warmup,
+                   'workers': args.workers, 'concurrency': args.concurrency, 'volumes': volumes},
+          'results': {}}
+routes = discover_routes()
+for mode in (['client', 'gunicorn'] if args.mode == 'both' else [args.mode]):
+    print_header(mode)
+    report['results'][mode] = run_client(routes) if mode == 'client' else run_gunicorn(routes)
+site.flush_visitors()
+
+if args.out:
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Saved to {args.out}")
+if args.compare:
+    with open(args.compare) as f:
+        regressions = compare(report, json.load(f))
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n✅ No regressions")
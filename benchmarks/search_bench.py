@@ -0,0 +1,91 @@
+"""Library search benchmark: ranked full-text search vs the old ILIKE scan.
+
+Seeds a synthetic catalogue into a throwaway SQLite database (or a scratch
+PostgreSQL database given in DATABASE_URL) and times both search paths.
+Search hits and ranking are checked by search_check.py.
+
+    python benchmarks/search_bench.py --books 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--books', type=int, default=100000)
+parser.add_argument('--repeat', type=int, default=20)
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-search-bench.db')
+parser.add_argument('--seed', type=int, default=42)
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    if os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+SUBJECTS = ['Physics', 'Chemistry', 'Mathematics', 'Botany', 'Zoology', 'History', 'Economics',
+            'Political Science', 'Sociology', 'Hindi', 'English', 'Odia', 'Accountancy', 'Business Studies']
+WORDS = ['introduction', 'principles', 'advanced', 'modern', 'organic', 'inorganic', 'quantum',
+         'mechanics', 'thermodynamics', 'algebra', 'calculus', 'statistics', 'ancient', 'medieval',
+         'indian', 'economy', 'theory', 'practical', 'handbook', 'guide', 'notes', 'literature',
+         'grammar', 'poetry', 'accounting', 'finance', 'management', 'cell', 'biology', 'genetics',
+         'ecology', 'optics', 'electricity', 'magnetism', 'waves', 'reactions', 'spectroscopy']
+FILLER = ['covers', 'the', 'syllabus', 'for', 'students', 'with', 'examples', 'exercises', 'chapter',
+          'university', 'semester', 'questions', 'solved', 'papers', 'revised', 'edition', 'and', 'of']
+AUTHORS = ['Sharma', 'Verma', 'Mishra', 'Patnaik', 'Mohanty', 'Das', 'Gupta', 'Agarwal', 'Mehta',
+           'Rao', 'Iyer', 'Morrison', 'Resnick', 'Halliday', 'Beiser', 'Chandra', 'Jain', 'Sahu']
+QUERIES = ['physics', 'organic chem', 'quantum mechanics', 'mohanty', 'hist', 'accounting principles',
+           'zzzz nothing']
+
+def seed(count):
+    rng = random.Random(args.seed)
+    now = site.datetime.utcnow()
+    batch = []
+    for i in range(count):
+        subject = rng.choice(SUBJECTS)
+        batch.append({
+            'title': ' '.join(rng.sample(WORDS, 3)).title() + f' {subject}',
+            'author': f"{rng.choice('ABCDEFGHKMPRS')}. {rng.choice(AUTHORS)}",
+            'subject': subject, 'semester': str(rng.randint(1, 6)), 'course': rng.choice(['BA', 'BSC', 'BCOM']),
+            'drive_link': f'https://drive.google.com/file/d/bench{i}/view',
+            'description': ' '.join(rng.choice(FILLER) for _ in range(24)) + ' ' + rng.choice(WORDS),
+            'upload_date': now - site.timedelta(minutes=i), 'is_active': True,
+        })
+        if len(batch) == 5000:
+            site.db.session.execute(site.db.insert(site.Book), batch)
+            batch = []
+    if batch:
+        site.db.session.execute(site.db.insert(site.Book), batch)
+    site.db.session.commit()
+
+def timed(build):
+    samples, rows = [], 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        rows = len(build().with_entities(site.Book.id).all())
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples), rows
+
+with site.app.app_context():
+    backend = site.book_search_backend()
+    existing = site.Book.query.count()
+    if existing < args.books:
+        start = time.perf_counter()
+        seed(args.books - existing)
+        print(f"Seeded {args.books - existing} books in {time.perf_counter() - start:.1f}s")
+    print(f"Backend: {backend}, catalogue: {site.Book.query.count()} books, {args.repeat} runs per query\n")
+    print("Row counts differ where full-text search also matches the description.\n")
+    print(f"{'query':<24}{'ILIKE p50':>11}{'max':>9}{'rows':>8}   {backend + ' p50':>11}{'max':>9}{'rows':>8}{'speedup':>9}")
+    for text in QUERIES:
+        base = lambda: site.Book.query.filter_by(is_active=True)
+        like_p50, like_max, like_rows = timed(lambda: site.like_search(base(), text))
+        fts_p50, fts_max, fts_rows = timed(lambda: site.search_books(base(), text, backend))
+        print(f"{text:<24}{like_p50:>9.1f}ms{like_max:>7.1f}ms{like_rows:>8}   "
+              f"{fts_p50:>9.1f}ms{fts_max:>7.1f}ms{fts_rows:>8}{like_p50 / max(fts_p50, 0.001):>8.1f}x")
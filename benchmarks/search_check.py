@@ -0,0 +1,86 @@
+"""Library search check: hits, ranking and index sync of the full-text backend.
+
+Seeds a small known catalogue into a throwaway SQLite database (or the scratch
+PostgreSQL database in DATABASE_URL) and checks that search_books():
+  * matches word prefixes in title, author, subject and description,
+  * requires every term, and finds nothing for an unknown word,
+  * ranks a title match above a description-only match,
+  * never misses a book the old ILIKE search finds by a whole word,
+  * picks up books added through /admin/books/add and drops removed ones.
+Timings against the ILIKE path are in search_bench.py.
+
+    python benchmarks/search_check.py
+"""
+import argparse
+import os
+import sys
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-search-check.db')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    if os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+os.environ.setdefault('PAGE_CACHE_BACKEND', 'none')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+BOOKS = [
+    ('Quantum Mechanics', 'H. C. Verma', 'Physics', 'Operators and wave functions'),
+    ('Concepts of Physics', 'H. C. Verma', 'Physics', 'Mechanics, optics and a little quantum theory'),
+    ('Organic Chemistry', 'Morrison', 'Chemistry', 'Reactions and mechanisms'),
+    ('Inorganic Chemistry', 'J. D. Lee', 'Chemistry', 'Periodic table'),
+    ('History of Odisha', 'Mohanty', 'History', 'Kalinga to the present'),
+    ('Principles of Accounting', 'Agarwal', 'Accountancy', 'Double entry'),
+]
+
+failures = []
+def check(ok, label):
+    print(f"{'✅' if ok else '❌'} {label}")
+    if not ok:
+        failures.append(label)
+
+def titles(text):
+    query = site.Book.query.filter_by(is_active=True)
+    return [b.title for b in site.search_books(query, text).all()]
+
+with site.app.app_context():
+    for i, (title, author, subject, description) in enumerate(BOOKS):
+        site.db.session.add(site.Book(title=title, author=author, subject=subject, description=description,
+                                      drive_link=f'https://drive.google.com/file/d/search{i}/view'))
+    site.db.session.commit()
+    backend = site.book_search_backend()
+    print(f"backend: {backend}\n")
+
+    check(backend != 'like', f'full-text backend in use ({backend})')
+    check(set(titles('chem')) == {'Organic Chemistry', 'Inorganic Chemistry'}, f"prefix 'chem': {titles('chem')}")
+    check(titles('mohanty') == ['History of Odisha'], f"author 'mohanty': {titles('mohanty')}")
+    check(set(titles('accountancy')) == {'Principles of Accounting'}, f"subject 'accountancy': {titles('accountancy')}")
+    check(titles('kalinga') == ['History of Odisha'], f"description 'kalinga': {titles('kalinga')}")
+    check(titles('organic chem') == ['Organic Chemistry'], f"every term required: {titles('organic chem')}")
+    check(titles('zzzz') == [], f"unknown word: {titles('zzzz')}")
+    check(titles('quantum')[:1] == ['Quantum Mechanics'] and 'Concepts of Physics' in titles('quantum'),
+          f"title match ranks above description match: {titles('quantum')}")
+    for word in ('physics', 'verma', 'history', 'principles'):
+        like = {b.title for b in site.like_search(site.Book.query.filter_by(is_active=True), word).all()}
+        check(like <= set(titles(word)), f"'{word}' finds every ILIKE hit ({len(like)})")
+
+client = site.app.test_client()
+client.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+client.post('/admin/books/add', data={'title': 'Thermodynamics Handbook', 'author': 'Sahu', 'subject': 'Physics',
+                                      'drive_link': 'https://drive.google.com/file/d/search-new/view'})
+with site.app.app_context():
+    check(titles('thermo') == ['Thermodynamics Handbook'], f"added book is searchable: {titles('thermo')}")
+    book_id = site.Book.query.filter_by(title='Thermodynamics Handbook').one().id
+check(b'Thermodynamics Handbook' in client.get('/library?search=thermo').get_data(), '/library?search= lists it')
+client.get(f'/admin/books/delete/{book_id}')
+with site.app.app_context():
+    check(titles('thermo') == [], f"removed book is not: {titles('thermo')}")
+
+print(f"\n{'❌ ' + str(len(failures)) + ' check(s) failed' if failures else '✅ all checks passed'}")
+sys.exit(1 if failures else 0)
@@ -0,0 +1,113 @@
+"""Cold-start benchmark: module import time and gunicorn time-to-first-request.
+
+Measures, against a throwaway SQLite database:
+  * `import app` wall time in a fresh interpreter (median of --repeat runs),
+  * bootstrap time on an empty and on an existing database,
+  * time from launching gunicorn to the first 200 response, cold and warm.
+With --compare-rev the same numbers are taken for an older git revision
+(exported with `git archive`) so startup changes can be judged side by side.
+
+    python benchmarks/startup_bench.py --workers 2 --compare-rev HEAD~1
+"""
+import argparse
+import http.client
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--workers', type=int, default=2)
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument('--port', type=int, default=8767)
+parser.add_argument('--compare-rev', help='Also measure this git revision, e.g. HEAD~1.')
+args = parser.parse_args()
+
+def environment(work):
+    env = dict(os.environ, SQLITE_PATH=os.path.join(work, 'college.db'), PAGE_CACHE_DIR=os.path.join(work, 'cache'),
+               METRICS_DIR=os.path.join(work, 'metrics'))
+    env.pop('DATABASE_URL', None)
+    return env
+
+def run_python(root, env, code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=root, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+def import_ms(root, env):
+    code = 'import time; t = time.perf_counter(); import app; print((time.perf_counter() - t) * 1000)'
+    samples = []
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=root, env=env, check=True, text=True,
+                             capture_output=True).stdout
+        samples.append(float(out.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+def first_request_ms(root, env):
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+                               '--workers', str(args.workers), '--log-level', 'warning'],
+                              cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=30)
+                conn.request('GET', '/about')
+                if conn.getresponse().status == 200:
+                    return (time.perf_counter() - start) * 1000
+            except OSError:
+                if server.poll() is not None or time.perf_counter() - start > 120:
+                    raise SystemExit('❌ gunicorn did not start')
+                time.sleep(0.01)
+            finally:
+                conn.close()
+    finally:
+        server.terminate()
+        server.wait(30)
+
+def measure(root):
+    work = tempfile.mkdtemp(prefix='cjdm-startup-')
+    env = environment(work)
+    results = {}
+    try:
+        bootstraps = hasattr_bootstrap(root)
+        results['ttfr cold'] = first_request_ms(root, env)
+        results['ttfr warm'] = first_request_ms(root, env)
+        if bootstraps:
+            os.remove(env['SQLITE_PATH'])
+            results['bootstrap cold'] = run_python(root, env, 'import app; app.bootstrap_db()')
+            results['bootstrap warm'] = run_python(root, env, 'import app; app.bootstrap_db()')
+        results['import app'] = import_ms(root, env)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+def hasattr_bootstrap(root):
+    with open(os.path.join(root, 'app.py')) as f:
+        return 'def bootstrap_db' in f.read()
+
+columns = [('current', ROOT)]
+exported = None
+if args.compare_rev:
+    exported = tempfile.mkdtemp(prefix='cjdm-rev-')
+    archive = subprocess.run(['git', 'archive', args.compare_rev], cwd=ROOT, check=True, capture_output=True).stdout
+    subprocess.run(['tar', '-x', '-C', exported], input=archive, check=True)
+    columns.append((args.compare_rev, exported))
+
+try:
+    table = {name: measure(root) for name, root in columns}
+finally:
+    if exported:
+        shutil.rmtree(exported, ignore_errors=True)
+
+print(f"\n{args.workers} gunicorn workers, median of {args.repeat} imports\n")
+print(f"{'':<18}" + ''.join(f'{name:>14}' for name, _ in columns))
+for metric in ['import app', 'bootstrap cold', 'bootstrap warm', 'ttfr cold', 'ttfr warm']:
+    cells = [table[name].get(metric) for name, _ in columns]
+    print(f'{metric:<18}' + ''.join(f'{c:>12.0f}ms' if c is not None else f"{'-':>14}" for c in cells))
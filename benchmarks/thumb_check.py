@@ -0,0 +1,184 @@
+"""Thumbnail proxy check: coalescing, resizing, cache headers and eviction.
+
+Serves generated JPEGs from a local HTTP stand-in for Google Drive that counts
+how often each image is fetched, points a gallery and a faculty row at it, and
+checks that:
+  * concurrent requests for one thumbnail, from threads and from forked
+    worker processes, reach the source once,
+  * thumbnails come back at the requested width, smaller than the original,
+    with immutable cache headers, and answer If-None-Match with 304,
+  * a failing source falls back to a redirect without refetching each time,
+  * the disk cache evicts least recently served files first, along with the
+    lock files of evicted sources,
+  * soft-deleted rows are 404 instead of being proxied or redirected.
+Also prints miss / hit latency against fetching the original directly.
+
+    python benchmarks/thumb_check.py --threads 16 --workers 4
+"""
+import argparse
+import http.server
+import io
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--threads', type=int, default=16)
+parser.add_argument('--workers', type=int, default=4)
+parser.add_argument('--source-delay', type=float, default=0.2, help='Seconds the stand-in takes per image.')
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-thumb-check.db')
+args = parser.parse_args()
+
+try:
+    from PIL import Image
+except ImportError:
+    raise SystemExit('❌ Pillow is needed to generate the test images (pip install Pillow)')
+
+work = tempfile.mkdtemp(prefix='cjdm-thumbs-')
+os.environ['THUMB_DIR'] = os.path.join(work, 'cache')
+if not os.environ.get('DATABASE_URL'):
+    if os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+def jpeg(width, height, color):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(out, 'JPEG', quality=95)
+    return out.getvalue()
+
+IMAGES = {f'/uc/photo{i}': jpeg(2400, 1600, (40 * i % 255, 90, 160)) for i in range(6)}
+fetches = {}
+fetches_lock = threading.Lock()
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        with fetches_lock:
+            fetches[self.path] = fetches.get(self.path, 0) + 1
+        time.sleep(args.source_delay)
+        body = IMAGES.get(self.path)
+        self.send_response(200 if body else 500)
+        self.send_header('Content-Type', 'image/jpeg' if body else 'text/html')
+        self.end_headers()
+        self.wfile.write(body or b'<html>quota exceeded</html>')
+
+    def log_message(self, *a):
+        pass
+
+server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base = f'http://127.0.0.1:{server.server_port}'
+
+failures = []
+def check(ok, label):
+    print(f"{'✅' if ok else '❌'} {label}")
+    if not ok:
+        failures.append(label)
+
+with site.app.app_context():
+    photo = site.Gallery(title='Campus', image_url=f'{base}/uc/photo0')
+    broken = site.Gallery(title='Broken', image_url=f'{base}/uc/missing')
+    teacher = site.Faculty(name='Dr. Check', photo_url=f'{base}/uc/photo1')
+    site.db.session.add_all([photo, broken, teacher])
+    site.db.session.commit()
+    photo_id, broken_id, teacher_id = photo.id, broken.id, teacher.id
+
+client = site.app.test_client()
+page = client.get('/gallery').get_data(as_text=True)
+check(f'/thumb/gallery/{photo_id}/320?v=' in page and f'{base}/uc/photo0' not in page,
+      'gallery page links thumbnails, not the source')
+check(f'/thumb/faculty/{teacher_id}/160?v=' in client.get('/faculty').get_data(as_text=True),
+      'faculty page links thumbnails')
+
+# Threads inside one worker
+def get(path):
+    started = time.perf_counter()
+    response = site.app.test_client().get(path)
+    return response, (time.perf_counter() - started) * 1000
+
+url = f'/thumb/gallery/{photo_id}/320'
+with ThreadPoolExecutor(args.threads) as pool:
+    results = list(pool.map(get, [url] * args.threads))
+check(all(r.status_code == 200 for r, _ in results), f'{args.threads} concurrent requests all 200')
+check(fetches.get('/uc/photo0') == 1, f"source fetched {fetches.get('/uc/photo0')}x for {args.threads} threads")
+response = results[0][0]
+body = response.get_data()
+check(Image.open(io.BytesIO(body)).width == 320, 'thumbnail is 320px wide')
+check(len(body) < len(IMAGES['/uc/photo0']) / 10,
+      f"thumbnail {len(body)} bytes vs original {len(IMAGES['/uc/photo0'])} bytes")
+check('immutable' in response.headers['Cache-Control'] and 'max-age=31536000' in response.headers['Cache-Control'],
+      f"Cache-Control: {response.headers['Cache-Control']}")
+revalidate = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+check(revalidate.status_code == 304, 'If-None-Match answers 304')
+client.get(f'/thumb/gallery/{photo_id}/640')
+check(fetches.get('/uc/photo0') == 1, 'another width is cut from the cached original')
+check(client.get(f'/thumb/gallery/{photo_id}/333').status_code == 404, 'widths outside THUMB_WIDTHS are 404')
+
+# Forked workers share the disk cache and the flock
+def worker_fetch(_):
+    return os.path.getsize(site.thumbnail(f'{base}/uc/photo2', 640))
+
+with multiprocessing.get_context('fork').Pool(args.workers) as pool:
+    sizes = pool.map(worker_fetch, range(args.workers * 2))
+check(fetches.get('/uc/photo2') == 1 and len(set(sizes)) == 1,
+      f"source fetched {fetches.get('/uc/photo2')}x for {args.workers * 2} calls from {args.workers} processes")
+
+# Failing source
+first = client.get(f'/thumb/gallery/{broken_id}/320')
+second = client.get(f'/thumb/gallery/{broken_id}/320')
+check(first.status_code == 302 and first.headers['Location'].endswith('/uc/missing'), 'failing source redirects')
+check(second.status_code == 302 and fetches.get('/uc/missing') == 1, 'failed source is not refetched right away')
+
+# Latency: miss, hit, and the original straight from the source
+misses, hits, direct = [], [], []
+for i in (3, 4, 5):
+    with site.app.app_context():
+        row = site.Gallery(title=f'P{i}', image_url=f'{base}/uc/photo{i}')
+        site.db.session.add(row)
+        site.db.session.commit()
+        row_id = row.id
+    misses.append(get(f'/thumb/gallery/{row_id}/320')[1])
+    hits += [get(f'/thumb/gallery/{row_id}/320')[1] for _ in range(20)]
+    started = time.perf_counter()
+    urllib.request.urlopen(f'{base}/uc/photo{i}').read()
+    direct.append((time.perf_counter() - started) * 1000)
+print(f"\n   original from source {statistics.median(direct):7.1f}ms "
+      f"(stand-in delay {args.source_delay * 1000:.0f}ms)")
+print(f"   thumbnail miss       {statistics.median(misses):7.1f}ms")
+print(f"   thumbnail hit        {statistics.median(hits):7.1f}ms\n")
+
+# Eviction: touch one file, shrink the budget, the untouched ones go first
+cache = os.environ['THUMB_DIR']
+files = sorted((e.path for e in os.scandir(cache) if not e.name.startswith('.')), key=os.path.getmtime)
+for i, path in enumerate(files):
+    os.utime(path, (1000 + i, 1000 + i))
+keep = files[0]
+os.utime(keep, None)
+budget = int(os.path.getsize(keep) / 0.9) + 1   # prune leaves 10% headroom
+removed = site.prune_thumbnails(max_bytes=budget)
+left = [e.path for e in os.scandir(cache) if not e.name.startswith('.')]
+check(left == [keep] and removed == len(files) - 1, f'eviction kept the recently served file, removed {removed}')
+locks = sorted(e.name for e in os.scandir(cache) if e.name.endswith('.lock'))
+check(locks == [f".{os.path.basename(keep).rsplit('-', 1)[0]}.lock"], f'lock files of evicted sources removed: {locks}')
+
+# Soft-deleted rows are no longer proxied, nor redirected to their source
+with site.app.app_context():
+    site.db.session.get(site.Gallery, photo_id).is_active = False
+    site.db.session.get(site.Gallery, broken_id).is_active = False
+    site.db.session.commit()
+check(client.get(f'/thumb/gallery/{photo_id}/320').status_code == 404, 'soft-deleted image is 404')
+check(client.get(f'/thumb/gallery/{broken_id}/320').status_code == 404, 'soft-deleted failing image is 404, not a redirect')
+
+server.shutdown()
+print(f"\n{'❌ ' + str(len(failures)) + ' check(s) failed' if failures else '✅ all checks passed'}; cache in {work}")
+sys.exit(1 if failures else 0)
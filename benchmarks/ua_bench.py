@@ -0,0 +1,161 @@
+"""Bot filter benchmark: classification cost and visitor rows saved.
+
+Times classify_user_agent() per call, both uncached (the precompiled matcher
+alone) and memoized, over a User-Agent sample. The sample is either the
+built-in one or one UA per line from --sample, e.g. taken from an access log:
+
+    awk -F'"' '{print $6}' access.log > uas.txt
+    python benchmarks/ua_bench.py --sample uas.txt
+
+Then it replays the sample as page views through the public routes, once with
+BOT_FILTER=off and once with tally, and reports the visitor rows written by
+each run. The built-in sample is made of real browser and crawler UA strings,
+weighted like the access log of a small public site (about 45% automated).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--sample', help='File with one User-Agent per line, replayed in order.')
+parser.add_argument('--views', type=int, default=5000, help='Page views to replay from the built-in sample.')
+parser.add_argument('--repeat', type=int, default=20, help='Timing passes over the sample.')
+parser.add_argument('--seed', type=int, default=7)
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-ua-bench.db')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    if os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+os.environ.setdefault('PAGE_CACHE_BACKEND', 'none')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+# (weight, user agent); bots are expected to be classified, browsers not
+BROWSERS = [
+    (18, 'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36'),
+    (9, 'Mozilla/5.0 (Linux; Android 13; SM-A145F) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.6422.165 Mobile Safari/537.36'),
+    (6, 'Mozilla/5.0 (Linux; Android 12; RMX3491) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36'),
+    (5, 'Mozilla/5.0 (Linux; Android 11; Redmi Note 9 Pro) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.6478.71 Mobile Safari/537.36'),
+    (4, 'Mozilla/5.0 (Linux; Android 13; V2207; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/126.0.6478.71 Mobile Safari/537.36'),
+    (3, 'Mozilla/5.0 (Linux; Android 12; CUBOT P60) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Mobile Safari/537.36'),
+    (3, 'Mozilla/5.0 (Linux; U; Android 11; en-US; RMX2185 Build/RP1A.201005.001) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/100.0.4896.58 UCBrowser/13.4.0.1306 Mobile Safari/537.36'),
+    (3, 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1'),
+    (5, 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36'),
+    (2, 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36 Edg/126.0.0.0'),
+    (1, 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:127.0) Gecko/20100101 Firefox/127.0'),
+    (1, 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4.1 Safari/605.1.15'),
+    (1, 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'),
+    # in-app browsers of apps whose link-preview fetchers are bots
+    (1, 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Snapchat/12.40.0.40 (like Safari/604.1)'),
+    (1, 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 [Pinterest/iOS]'),
+    (1, 'Mozilla/5.0 (Linux; Android 13; SM-A145F; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/125.0.6422.165 Mobile Safari/537.36 Viber/20.8.0.2'),
+    (1, 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Flipboard/4.3'),
+    (1, 'Mozilla/5.0 (Linux; Android 13; SM-A145F) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.6422.165 Mobile Safari/537.36 WhatsApp/2.23.20.0'),
+    (1, 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Tumblr/34.5'),
+    (1, 'Mozilla/5.0 (Linux; Android 13; Pixel 7; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/125.0.6422.165 Mobile Safari/537.36 Mastodon/2.6.0'),
+    (1, 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Bluesky/1.90'),
+    (1, 'Mozilla/5.0 (Linux; Android 12; RMX3491; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/124.0.0.0 Mobile Safari/537.36 OutbrainApp/3.1'),
+]
+BOTS = [
+    (8, 'Mozilla/5.0 (Linux; Android 6.0.1; Nexus 5X Build/MMB29P) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.6478.126 Mobile Safari/537.36 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'),
+    (3, 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'),
+    (4, 'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm) Chrome/116.0.1938.76 Safari/537.36'),
+    (2, 'Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)'),
+    (1, 'Mozilla/5.0 (compatible; Baiduspider/2.0; +http://www.baidu.com/search/spider.html)'),
+    (1, 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15 (Applebot/0.1; +http://www.apple.com/go/applebot)'),
+    (4, 'Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)'),
+    (3, 'Mozilla/5.0 (compatible; SemrushBot/7~bl; +http://www.semrush.com/bot.html)'),
+    (2, 'Mozilla/5.0 (compatible; MJ12bot/v1.4.8; http://mj12bot.com/)'),
+    (1, 'Mozilla/5.0 (compatible; DotBot/1.2; +https://opensiteexplorer.org/dotbot; help@moz.com)'),
+    (3, 'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; GPTBot/1.2; +https://openai.com/gptbot)'),
+    (2, 'Mozilla/5.0 (compatible; Bytespider; spider-feedback@bytedance.com) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.0.0 Safari/537.36'),
+    (1, 'CCBot/2.0 (https://commoncrawl.org/faq/)'),
+    (1, 'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; ClaudeBot/1.0; +claudebot@anthropic.com)'),
+    (4, 'WhatsApp/2.23.20.0'),
+    (2, 'facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)'),
+    (1, 'Pinterest/0.2 (+https://www.pinterest.com/bot.html)'),
+    (1, 'Mozilla/5.0 (compatible; Snap URL Preview Service; bot; snapchat; https://developers.snap.com/robots)'),
+    (1, 'Tumblr/14.0.835.186'),
+    (1, 'http.rb/5.1.1 (Mastodon/4.2.10; +https://mastodon.social/)'),
+    (1, 'Mozilla/5.0 (compatible; Bluesky Cardyb/1.1; +mailto:support@bsky.app)'),
+    (1, 'TelegramBot (like TwitterBot)'),
+    (1, 'Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)'),
+    (3, 'Mozilla/5.0+(compatible; UptimeRobot/2.0; http://www.uptimerobot.com/)'),
+    (2, 'Render/1.0'),
+    (1, 'curl/8.5.0'),
+    (1, 'python-requests/2.31.0'),
+    (1, 'Go-http-client/1.1'),
+    (1, 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/125.0.6422.60 Safari/537.36'),
+    (1, ''),
+]
+PAGES = ['/', '/about', '/courses', '/notices', '/library', '/results', '/faculty', '/gallery', '/contact']
+
+rng = random.Random(args.seed)
+if args.sample:
+    with open(args.sample, encoding='utf-8', errors='replace') as f:
+        sample = [line.rstrip('\n') for line in f]
+    expected = None
+else:
+    weighted = BROWSERS + BOTS
+    sample = rng.choices([ua for _, ua in weighted], weights=[w for w, _ in weighted], k=args.views)
+    expected = {ua: ua in {b for _, b in BOTS} for _, ua in weighted}
+    wrong = [ua for ua, is_bot in expected.items() if bool(site.classify_user_agent(ua)) != is_bot]
+    for ua in wrong:
+        print(f"❌ misclassified: {ua!r} -> {site.classify_user_agent(ua)}")
+
+# =================== CLASSIFICATION COST ===================
+distinct = list(dict.fromkeys(ua[:500] for ua in sample))
+
+def per_call_us(fn, values):
+    runs = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for ua in values:
+            fn(ua)
+        runs.append((time.perf_counter() - start) / len(values) * 1e6)
+    return statistics.median(runs)
+
+uncached = per_call_us(site.classify_user_agent.__wrapped__, distinct)
+site.classify_user_agent.cache_clear()
+per_call_us(site.classify_user_agent, sample)
+cached = per_call_us(site.classify_user_agent, sample)
+info = site.classify_user_agent.cache_info()
+print(f"\n{len(sample)} page views, {len(distinct)} distinct user agents")
+print(f"  matcher, uncached   {uncached:7.2f} µs per call (median UA length "
+      f"{statistics.median(len(ua) for ua in distinct):.0f})")
+print(f"  memoized            {cached:7.2f} µs per call (lru {info.currsize}/{info.maxsize})")
+
+# =================== ROWS WRITTEN ===================
+def replay(mode, run):
+    site.BOT_FILTER = mode
+    client = site.app.test_client()
+    before = dict(site.visitor_ingest_stats())
+    start = time.perf_counter()
+    for i, ua in enumerate(sample):
+        # every view from its own address, so none is deduplicated away
+        ip = f'10.{run}.{i // 250 % 250}.{i % 250}'
+        client.get(rng.choice(PAGES), headers={'User-Agent': ua, 'X-Forwarded-For': ip})
+    site.flush_visitors()
+    after = site.visitor_ingest_stats()
+    return {k: after[k] - before[k] for k in ('queued', 'written', 'bots')}, time.perf_counter() - start
+
+off, off_s = replay('off', 1)
+tally, tally_s = replay('tally', 2)
+with site.app.app_context():
+    categories = site.bot_traffic(1)
+saved = 1 - tally['written'] / max(off['written'], 1)
+print(f"\n{'BOT_FILTER':<12}{'queued':>9}{'rows written':>15}{'bots skipped':>15}{'replay':>10}")
+print(f"{'off':<12}{off['queued']:>9}{off['written']:>15}{off['bots']:>15}{off_s:>9.1f}s")
+print(f"{'tally':<12}{tally['queued']:>9}{tally['written']:>15}{tally['bots']:>15}{tally_s:>9.1f}s")
+print(f"\nvisitor rows written: -{saved:.0%}; bot hits by category: "
+      + ', '.join(f'{c} {n}' for c, n in categories))
+if expected is not None and wrong:
+    sys.exit(1)
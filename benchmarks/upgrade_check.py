@@ -0,0 +1,96 @@
+"""Upgrade check: `db-upgrade --report` against a database with the original schema.
+
+Creates a SQLite database with the tables as the first release defined them:
+no schema_migrations table, no indexes, books without the stored Drive link
+columns and visitors without user_agent_id. It seeds a few rows, then checks
+that:
+  * `flask db-upgrade --report` exits 0 and prints both the plans from before
+    the upgrade and the plans from after it,
+  * every migration is applied and the schema version is current,
+  * the seeded rows survive, with the Drive link columns backfilled,
+  * the public pages render on the upgraded database.
+
+    python benchmarks/upgrade_check.py
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-upgrade-check.db')
+args = parser.parse_args()
+
+# The tables of the first release, as db.create_all() made them
+BASELINE = '''
+CREATE TABLE admins (id INTEGER PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, password_hash VARCHAR(200) NOT NULL,
+    name VARCHAR(120) NOT NULL, role VARCHAR(50), created_at DATETIME);
+CREATE TABLE books (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, author VARCHAR(200) NOT NULL,
+    subject VARCHAR(100) NOT NULL, semester VARCHAR(20), course VARCHAR(100), drive_link VARCHAR(500) NOT NULL,
+    download_link VARCHAR(500), description TEXT, uploaded_by VARCHAR(120), upload_date DATETIME, is_active BOOLEAN);
+CREATE TABLE results (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, exam_type VARCHAR(100),
+    course VARCHAR(100), semester VARCHAR(20), year VARCHAR(10), drive_link VARCHAR(500) NOT NULL,
+    uploaded_by VARCHAR(120), upload_date DATETIME, is_active BOOLEAN);
+CREATE TABLE notices (id INTEGER PRIMARY KEY, title VARCHAR(300) NOT NULL, content TEXT NOT NULL,
+    category VARCHAR(50), attachment_link VARCHAR(500), is_important BOOLEAN, posted_by VARCHAR(120),
+    post_date DATETIME, is_active BOOLEAN);
+CREATE TABLE faculty (id INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, designation VARCHAR(100),
+    department VARCHAR(100), qualification VARCHAR(200), email VARCHAR(120), phone VARCHAR(15),
+    photo_url VARCHAR(500), experience VARCHAR(50), specialization VARCHAR(200), is_active BOOLEAN);
+CREATE TABLE courses (id INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, code VARCHAR(20), duration VARCHAR(50),
+    description TEXT, eligibility TEXT, seats INTEGER, department VARCHAR(100), is_active BOOLEAN);
+CREATE TABLE gallery (id INTEGER PRIMARY KEY, title VARCHAR(200), image_url VARCHAR(500) NOT NULL,
+    category VARCHAR(50), upload_date DATETIME, is_active BOOLEAN);
+CREATE TABLE contact_messages (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, email VARCHAR(120) NOT NULL,
+    phone VARCHAR(15), subject VARCHAR(200), message TEXT NOT NULL, date DATETIME, is_read BOOLEAN);
+CREATE TABLE visitors (id INTEGER PRIMARY KEY, ip_address VARCHAR(50), page VARCHAR(200), user_agent VARCHAR(500),
+    visit_date DATETIME, date_only VARCHAR(10));
+CREATE TABLE site_settings (id INTEGER PRIMARY KEY, "key" VARCHAR(100) NOT NULL UNIQUE, value TEXT NOT NULL,
+    updated_at DATETIME);
+INSERT INTO books (title, author, subject, course, drive_link, upload_date, is_active)
+    VALUES ('Optics', 'Ghatak', 'Physics', 'BSC', 'https://drive.google.com/file/d/book1/view', '2024-01-05', 1);
+INSERT INTO results (title, course, semester, drive_link, upload_date, is_active)
+    VALUES ('Semester 1', 'BSC', '1', 'https://drive.google.com/file/d/result1/view', '2024-02-01', 1);
+INSERT INTO notices (title, content, category, post_date, is_active)
+    VALUES ('Exam schedule', 'Details', 'Exam', '2024-03-01', 1);
+INSERT INTO visitors (ip_address, page, user_agent, visit_date, date_only)
+    VALUES ('10.0.0.1', 'home', 'Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0', '2024-03-01 10:00:00', '2024-03-01');
+'''
+
+if os.path.exists(args.sqlite_path):
+    os.remove(args.sqlite_path)
+with sqlite3.connect(args.sqlite_path) as conn:
+    conn.executescript(BASELINE)
+os.environ['SQLITE_PATH'] = args.sqlite_path
+os.environ.pop('DATABASE_URL', None)
+os.environ.setdefault('PAGE_CACHE_BACKEND', 'none')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+failures = []
+def check(ok, label):
+    print(f"{'✅' if ok else '❌'} {label}")
+    if not ok:
+        failures.append(label)
+
+result = site.app.test_cli_runner().invoke(args=['db-upgrade', '--report'])
+print(result.output)
+check(result.exit_code == 0, f'db-upgrade --report exits {result.exit_code}'
+      + (f': {result.exception!r}' if result.exception else ''))
+check('before: ' in result.output and '⚠️' not in result.output, 'report shows the plans from before the upgrade')
+
+with site.app.app_context():
+    check(site.schema_version() == site.SCHEMA_VERSION,
+          f'schema version {site.schema_version()} of {site.SCHEMA_VERSION}')
+    book = site.Book.query.one()
+    check(book.drive_file_id == 'book1' and book.preview_link, f'book backfilled: {book.drive_file_id!r}')
+    check(site.Result.query.one().drive_file_id == 'result1', 'result backfilled')
+
+site.bootstrap_db()
+client = site.app.test_client()
+for url in ('/', '/library', '/results', '/notices'):
+    check(client.get(url).status_code == 200, f'{url} renders after the upgrade')
+
+print(f"\n{'❌ ' + str(len(failures)) + ' check(s) failed' if failures else '✅ all checks passed'}")
+sys.exit(1 if failures else 0)
@@ -0,0 +1,101 @@
+"""Wire benchmark: bytes sent per public route, before and after compression.
+
+Seeds a throwaway SQLite database (or the scratch PostgreSQL database in
+DATABASE_URL) and fetches each public route three ways: with no
+Accept-Encoding, with gzip, and with brotli. It also reports the CSS/JS
+bundles in each precompressed variant.
+
+The baseline is the page as it was sent before the bundles were extracted:
+the uncompressed HTML with the bundle sources inlined. That is the identity
+HTML plus the raw bundle bytes, less the two tags that now reference them.
+Every page paid for the bundles, so the first visit counts the page plus
+both bundles. A repeat visit counts the page alone, since the bundles are
+cached as immutable. The compression time column is the per-request CPU
+cost of the dynamic layer.
+
+    python benchmarks/wire_bench.py --rows 100
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--rows', type=int, default=60, help='Notices, results, books and gallery rows to seed.')
+parser.add_argument('--repeat', type=int, default=50, help='Compression timing runs per route.')
+parser.add_argument('--sqlite-path', default='/tmp/cjdm-wire-bench.db')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    if os.path.exists(args.sqlite_path):
+        os.remove(args.sqlite_path)
+    os.environ['SQLITE_PATH'] = args.sqlite_path
+os.environ.setdefault('PAGE_CACHE_BACKEND', 'none')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as site  # noqa: E402
+
+site.bootstrap_db()
+
+with site.app.app_context():
+    for i in range(args.rows):
+        site.db.session.add(site.Notice(title=f'Notice {i}', content='Examination schedule details ' * 12,
+                                        category='Exam'))
+        site.db.session.add(site.Result(title=f'Result {i}', course='BSC', semester=str(i % 6 + 1),
+                                        drive_link=f'https://drive.google.com/file/d/r{i}/view'))
+        site.db.session.add(site.Book(title=f'Book {i}', author=f'Author {i}', subject='Physics', course='BSC',
+                                      drive_link=f'https://drive.google.com/file/d/b{i}/view'))
+        site.db.session.add(site.Gallery(title=f'Photo {i}', image_url=f'https://example.com/{i}.jpg',
+                                         category=('Campus', 'Sports', 'Events')[i % 3]))
+    site.db.session.commit()
+
+client = site.app.test_client()
+ROUTES = ['/', '/about', '/courses', '/faculty', '/library', '/results', '/notices', '/gallery', '/contact',
+          '/sitemap.xml', '/feed.atom']
+ENCODINGS = ['gzip', 'br'] if site.brotli else ['gzip']
+
+def size(url, encoding=None):
+    response = client.get(url, headers={'Accept-Encoding': encoding} if encoding else {})
+    assert response.headers.get('Content-Encoding') == (encoding if len(response.get_data()) else None) \
+        or response.headers.get('Content-Encoding') is None, (url, encoding)
+    return len(response.get_data()), response.headers.get('Content-Encoding')
+
+# Bundles and the tags that reference them
+bundles = {}
+for bundle, name in site._asset_manifest.items():
+    bundles[bundle] = {'identity': size(f'/assets/{name}')[0]}
+    for encoding in ENCODINGS:
+        bundles[bundle][encoding] = size(f'/assets/{name}', encoding)[0]
+print(f"{'bundle':<12}{'raw':>8}" + ''.join(f'{e:>8}' for e in ENCODINGS))
+for bundle, sizes in bundles.items():
+    print(f"{bundle:<12}{sizes['identity']:>8}" + ''.join(f'{sizes[e]:>8}' for e in ENCODINGS))
+
+home = client.get('/').get_data(as_text=True)
+tags = sum(len(t) for t in re.findall(r'<link href="/assets/[^"]+" rel="stylesheet">|<script src="/assets/[^"]+"></script>',
+                                      home))
+inline = sum(s['identity'] for s in bundles.values()) + len('<style></style><script></script>')
+
+print(f"\n{'route':<14}{'baseline':>10}{'identity':>10}" + ''.join(f'{e:>8}' for e in ENCODINGS)
+      + f"{'first visit':>13}{'repeat':>9}{'saved':>8}{'compress':>10}")
+totals = {'baseline': 0, 'repeat': 0}
+best = ENCODINGS[-1]
+for url in ROUTES:
+    identity, _ = size(url)
+    is_page = url not in ('/sitemap.xml', '/feed.atom')
+    baseline = identity + (inline - tags if is_page else 0)
+    encoded = {e: size(url, e)[0] for e in ENCODINGS}
+    first = encoded[best] + (sum(s[best] for s in bundles.values()) if is_page else 0)
+    body = client.get(url).get_data()
+    runs = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        site.compress_body(body, best)
+        runs.append((time.perf_counter() - started) * 1000)
+    totals['baseline'] += baseline
+    totals['repeat'] += encoded[best]
+    print(f"{url:<14}{baseline:>10}{identity:>10}" + ''.join(f'{encoded[e]:>8}' for e in ENCODINGS)
+          + f"{first:>13}{encoded[best]:>9}{1 - encoded[best] / baseline:>8.0%}{statistics.median(runs):>8.2f}ms")
+print(f"\nall routes, repeat visits with {best}: {totals['baseline']} -> {totals['repeat']} bytes "
+      f"({1 - totals['repeat'] / totals['baseline']:.0%} fewer)")
@@ -0,0 +1,20 @@
+# Gunicorn settings, read automatically by `gunicorn app:app` from this directory.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '7860')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = 120
+# Import the app once in the master; workers fork with it already loaded
+preload_app = True
+
+def on_starting(server):
+    # Schema, migrations and seed data, once per deploy, before any worker forks.
+    # If it fails the master exits instead of starting workers on a broken schema.
+    from app import bootstrap_db
+    bootstrap_db()
+
+def post_fork(server, worker):
+    # Never reuse pooled connections inherited from the master
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,26 @@
+// Auto dismiss alerts after 5 seconds
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('.alert').forEach(function(alert) {
+        setTimeout(function() {
+            try {
+                var bsAlert = new bootstrap.Alert(alert);
+                bsAlert.close();
+            } catch(e) {}
+        }, 5000);
+    });
+});
+
+// Navbar scroll shadow effect
+window.addEventListener('scroll', function() {
+    var navbar = document.querySelector('.navbar');
+    if (window.scrollY > 50) {
+        navbar.style.boxShadow = '0 4px 20px rgba(0,0,0,0.15)';
+    } else {
+        navbar.style.boxShadow = 'none';
+    }
+});
+
+// Active nav link highlight
+document.querySelectorAll('.nav-link.active').forEach(function(link) {
+    link.style.background = 'rgba(255,255,255,0.15)';
+});